@@ -139,12 +139,19 @@ def hardlink_copy(src: str, dst: str):
 import os
 import hashlib
 
-def sha1sum(file_path, block_size=65536):
+# reusable read buffer, see iter_file_chunks in src/cas_torrent/hashing.py
+sha1sum_buffer = bytearray(1024 * 1024)
+
+def sha1sum(file_path):
     """Compute SHA-1 checksum of a file in chunks."""
     h = hashlib.sha1()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(block_size), b''):
-            h.update(chunk)
+    view = memoryview(sha1sum_buffer)
+    # buffering=0: read directly into our buffer
+    with open(file_path, 'rb', buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while size := f.readinto(view):
+            h.update(view[:size])
     return h.hexdigest()
 
 def files_are_identical(src_file, dst_file):
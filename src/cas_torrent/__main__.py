@@ -0,0 +1,5 @@
+# python3 -m cas_torrent
+
+from .cas_torrent import main
+
+main()
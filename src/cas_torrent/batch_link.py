@@ -0,0 +1,138 @@
+# create many links at once
+
+# creating links one by one costs many syscalls per link:
+# os.makedirs checks every parent directory,
+# and the kernel resolves the full link path.
+# for torrents with 100k+ files, we plan all links first, then create them:
+# - every parent directory is created once
+# - links are created relative to an open directory (dir_fd),
+#   so the kernel does not resolve the full path again
+# - links are created in sorted order, so directories are written in order
+# - existing links are checked only when creating the link fails
+
+import os
+import stat
+import errno
+import collections
+
+from . import materialize
+
+
+LinkStats = collections.namedtuple(
+    "LinkStats",
+    ["created", "skipped", "conflicts"],
+)
+
+
+class BatchLinker(object):
+    """
+    plan links, then create them at once
+
+    mode: symlink, hardlink or reflink, see materialize.py
+    """
+
+    def __init__(self, mode="symlink"):
+        assert mode in materialize.materialize_modes, f"unknown mode: {mode}"
+        self._mode = mode
+        # map dir_path to {link_name: link_target}
+        self._links = collections.defaultdict(dict)
+        self._num_links = 0
+        # (link_target, link_path) of existing files with other targets
+        self.conflicts = []
+        self.num_created = 0
+        self.num_skipped = 0
+
+    def __len__(self):
+        return self._num_links
+
+    def add(self, link_target, link_path):
+        """
+        plan a link from link_path to link_target
+
+        link_target and link_path must be absolute paths
+        """
+        dir_path, link_name = os.path.split(link_path)
+        dir_links = self._links[dir_path]
+        if link_name not in dir_links:
+            self._num_links += 1
+        dir_links[link_name] = link_target
+
+    def apply(self):
+        """
+        create all planned links
+
+        existing links to the same target are skipped.
+        existing files with other targets are not replaced,
+        they are returned in self.conflicts
+
+        return LinkStats
+        """
+        created_dirs = set()
+        for dir_path in sorted(self._links):
+            if dir_path not in created_dirs:
+                os.makedirs(dir_path, exist_ok=True)
+                # parent dirs exist now
+                parent_path = dir_path
+                while parent_path not in created_dirs:
+                    created_dirs.add(parent_path)
+                    next_parent_path = os.path.dirname(parent_path)
+                    if next_parent_path == parent_path:
+                        break
+                    parent_path = next_parent_path
+            dir_links = self._links[dir_path]
+            dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                for link_name in sorted(dir_links):
+                    self._create_link(dir_fd, dir_path, link_name, dir_links[link_name])
+            finally:
+                os.close(dir_fd)
+        self._links.clear()
+        self._num_links = 0
+        return LinkStats(self.num_created, self.num_skipped, len(self.conflicts))
+
+    def _create_link(self, dir_fd, dir_path, link_name, link_target):
+        mode = self._mode
+        try:
+            if mode == "reflink":
+                try:
+                    materialize.reflink(link_target, link_name, dst_dir_fd=dir_fd)
+                    self.num_created += 1
+                    return
+                except OSError as e:
+                    if e.errno not in materialize.unsupported_errnos:
+                        raise
+                mode = "hardlink"
+            if mode == "hardlink":
+                try:
+                    os.link(link_target, link_name, dst_dir_fd=dir_fd)
+                    self.num_created += 1
+                    return
+                except OSError as e:
+                    if e.errno == errno.EEXIST or e.errno not in materialize.unsupported_errnos:
+                        raise
+            os.symlink(os.path.relpath(link_target, dir_path), link_name, dir_fd=dir_fd)
+            self.num_created += 1
+        except FileExistsError:
+            if self._is_same_link(dir_fd, dir_path, link_name, link_target):
+                self.num_skipped += 1
+            else:
+                self.conflicts.append((link_target, os.path.join(dir_path, link_name)))
+
+    def _is_same_link(self, dir_fd, dir_path, link_name, link_target):
+        stat_result = os.stat(link_name, dir_fd=dir_fd, follow_symlinks=False)
+        if stat.S_ISLNK(stat_result.st_mode):
+            existing_target = os.readlink(link_name, dir_fd=dir_fd)
+            # relative or absolute symlink
+            return os.path.normpath(os.path.join(dir_path, existing_target)) == os.path.normpath(link_target)
+        # hardlink
+        try:
+            target_stat_result = os.stat(link_target)
+        except FileNotFoundError:
+            return False
+        return (
+            stat_result.st_ino == target_stat_result.st_ino and
+            stat_result.st_dev == target_stat_result.st_dev
+        )
+
+    def format_stats(self):
+        return f"created {self.num_created} links, skipped {self.num_skipped} existing links, {len(self.conflicts)} conflicts"
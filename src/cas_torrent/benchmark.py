@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+# benchmark file hashing and ingest of completed files
+
+# python3 -m cas_torrent.benchmark --output bench.json
+
+# synthetic files are created in a temporary directory:
+# random data, zero data (written zero bytes), sparse files (holes)
+# every case runs in a new python process,
+# so the peak RSS (resident set size) of the process is the peak RSS of the case.
+# syscall counts are read from /proc/self/io (linux only)
+
+# the output is json, to compare results between versions
+
+# shard layouts of the cas store can be compared with
+# python3 -m cas_torrent.benchmark --layouts 1x2,2x2,3x2 --layout-objects 1000000
+# this measures lookup latency in the dentry cache,
+# and with --cold, after dropping the dentry and inode caches (needs root)
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import random
+import argparse
+import resource
+import subprocess
+
+
+default_sizes = [
+    0,
+    1024,
+    16 * 1024,
+    1024 * 1024,
+    64 * 1024 * 1024,
+    1024 * 1024 * 1024,
+]
+
+file_kinds = ["random", "zero", "sparse"]
+
+# name of benchmarked function
+case_names = [
+    "get_sha256_of_path",
+    "get_bt2_root_hash_of_path",
+    "hash_file",
+    "hash_file_piece_layer",
+    "ingest_file",
+]
+
+
+def create_file(file_path, size, kind):
+    """
+    create a synthetic file
+    """
+    with open(file_path, "wb") as f:
+        if kind == "sparse":
+            # one hole
+            f.truncate(size)
+            return
+        if kind == "zero":
+            block = bytes(1024 * 1024)
+        else:
+            # repeat one random block, generating random data is slow
+            block = os.urandom(1024 * 1024)
+        remaining = size
+        while remaining > 0:
+            n = min(remaining, len(block))
+            f.write(block[:n])
+            remaining -= n
+
+
+def read_proc_io():
+    """
+    get io counters of this process, or None
+    """
+    try:
+        with open("/proc/self/io") as f:
+            return {
+                key: int(value)
+                for key, value in (line.split(": ") for line in f.read().splitlines())
+            }
+    except (OSError, ValueError):
+        return None
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes on linux, but in bytes on macos
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    return peak_rss
+
+
+def drop_file_cache(file_path):
+    # this works without root, but only for clean pages
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def run_case(case_name, file_path, work_dir):
+    """
+    run one case in this process
+
+    return the result as dict
+    """
+    from . import hashing
+
+    func = None
+    if case_name == "get_sha256_of_path":
+        func = lambda: hashing.get_sha256_of_path(file_path)
+    elif case_name == "get_bt2_root_hash_of_path":
+        func = lambda: hashing.get_bt2_root_hash_of_path(file_path)
+    elif case_name == "hash_file":
+        func = lambda: hashing.hash_file(file_path)
+    elif case_name == "hash_file_piece_layer":
+        func = lambda: hashing.hash_file(file_path, piece_length=4 * 1024 * 1024)
+    elif case_name == "ingest_file":
+        # full ingest of a completed file into a new cas store:
+        # hash, move to the sha256 store, create symlinks
+        # cas_torrent needs libtorrent, so dont import it for the other cases
+        from . import cas_torrent
+        from . import hash_index
+        from . import store_config
+        cas_torrent.store_prefix = os.path.join(work_dir, "cas")
+        cas_torrent.store_metadata = store_config.get_default_store_config()
+        from . import volumes
+        cas_torrent.store_volumes = volumes.VolumeManager([cas_torrent.store_prefix], 0)
+        cas_torrent.store_hash_index = hash_index.HashIndex(os.path.join(cas_torrent.store_prefix, "index.sqlite"))
+        # ingest_file moves the file, so ingest a hardlink
+        completed_file_path = os.path.join(work_dir, "torrent", os.path.basename(file_path))
+        os.makedirs(os.path.dirname(completed_file_path))
+        os.link(file_path, completed_file_path)
+        func = lambda: cas_torrent.ingest_file(completed_file_path)
+    else:
+        raise ValueError(f"unknown case: {case_name}")
+
+    peak_rss_before = get_peak_rss()
+    io_before = read_proc_io()
+    start_time = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start_time
+    io_after = read_proc_io()
+
+    result = {
+        "seconds": seconds,
+        "peak_rss": get_peak_rss(),
+        "peak_rss_before": peak_rss_before,
+    }
+    if io_before != None and io_after != None:
+        for key in ("syscr", "syscw", "rchar", "wchar", "read_bytes"):
+            result[key] = io_after[key] - io_before[key]
+    return result
+
+
+def run_case_in_subprocess(case_name, file_path, work_dir, cold_cache):
+    if cold_cache:
+        drop_file_cache(file_path)
+    result_path = os.path.join(work_dir, "result.json")
+    args = [
+        sys.executable, "-m", "cas_torrent.benchmark",
+        "--run-case", case_name, file_path, work_dir, result_path,
+    ]
+    # ingest_file prints debug output
+    proc = subprocess.run(args, stdout=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        raise Exception(f"benchmark case failed: {case_name} {file_path}")
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def parse_layout(layout_str):
+    """
+    parse shard layouts like 2x2: depth x width
+    """
+    shard_depth, shard_width = layout_str.lower().split("x")
+    return {"shard_depth": int(shard_depth), "shard_width": int(shard_width)}
+
+
+def drop_dentry_cache():
+    # needs root
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("2\n")
+        return True
+    except OSError:
+        return False
+
+
+def run_layout_case(layout, num_objects, num_lookups, base_dir, cold_cache):
+    """
+    create an empty sha256 store with num_objects files,
+    and measure the latency of os.stat on existing and missing files
+    """
+    from . import store_config
+    store_path = os.path.join(base_dir, "sha256")
+    hashids = [os.urandom(32).hex() for _ in range(num_objects)]
+    created_dirs = set()
+    for hashid in hashids:
+        file_path = os.path.join(store_path, *store_config.get_shard(hashid, layout))
+        dir_path = os.path.dirname(file_path)
+        if not dir_path in created_dirs:
+            os.makedirs(dir_path, exist_ok=True)
+            created_dirs.add(dir_path)
+        with open(file_path, "wb"):
+            pass
+    max_dir_entries = max(len(os.listdir(dir_path)) for dir_path in created_dirs)
+
+    result = {
+        "case": "layout_lookup",
+        "shard_depth": layout["shard_depth"],
+        "shard_width": layout["shard_width"],
+        "num_objects": num_objects,
+        "num_leaf_dirs": len(created_dirs),
+        "max_dir_entries": max_dir_entries,
+        "cold_cache": cold_cache and drop_dentry_cache(),
+    }
+    for lookup_kind in ("existing", "missing"):
+        if lookup_kind == "existing":
+            lookup_ids = random.sample(hashids, min(num_lookups, len(hashids)))
+        else:
+            lookup_ids = [os.urandom(32).hex() for _ in range(num_lookups)]
+        lookup_paths = [
+            os.path.join(store_path, *store_config.get_shard(hashid, layout))
+            for hashid in lookup_ids
+        ]
+        if cold_cache:
+            drop_dentry_cache()
+        start_time = time.perf_counter()
+        for file_path in lookup_paths:
+            try:
+                os.stat(file_path)
+            except FileNotFoundError:
+                pass
+        seconds = time.perf_counter() - start_time
+        result[f"{lookup_kind}_lookups"] = len(lookup_paths)
+        result[f"{lookup_kind}_microseconds"] = (seconds / len(lookup_paths) * 1e6) if lookup_paths else None
+    return result
+
+
+def run_layout_benchmark(options):
+    layouts = [parse_layout(s) for s in options.layouts.split(",")]
+    results = []
+    for layout in layouts:
+        base_dir = tempfile.mkdtemp(prefix="cas-torrent-benchmark-", dir=options.tmpdir)
+        try:
+            result = run_layout_case(layout, options.layout_objects, options.layout_lookups, base_dir, options.cold)
+        finally:
+            shutil.rmtree(base_dir, ignore_errors=True)
+        results.append(result)
+        print(
+            f"layout {layout['shard_depth']}x{layout['shard_width']}: "
+            f"{result['num_leaf_dirs']} leaf dirs, max {result['max_dir_entries']} entries: "
+            f"existing {result['existing_microseconds'] or 0:.1f} us, "
+            f"missing {result['missing_microseconds'] or 0:.1f} us",
+            file=sys.stderr,
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark file hashing and ingest of completed files",
+    )
+    parser.add_argument(
+        "--sizes", default=None,
+        help="comma separated file sizes, like 0,16K,1M,4G. default: " + ",".join(map(str, default_sizes)),
+    )
+    parser.add_argument(
+        "--kinds", default=",".join(file_kinds),
+        help="comma separated file kinds. default: " + ",".join(file_kinds),
+    )
+    parser.add_argument(
+        "--cases", default=",".join(case_names),
+        help="comma separated benchmark cases. default: " + ",".join(case_names),
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1,
+        help="run every case n times",
+    )
+    parser.add_argument(
+        "--cold", action="store_true", default=False,
+        help="drop the test file from the page cache before every run",
+    )
+    parser.add_argument(
+        "--tmpdir", default=None,
+        help="directory for synthetic files. use a directory on the benchmarked filesystem",
+    )
+    parser.add_argument(
+        "--output", "-o", default=None,
+        help="write results as json to this file. default: stdout",
+    )
+    parser.add_argument(
+        "--layouts", default=None,
+        help="compare lookup latency of shard layouts instead of hashing, like 1x2,2x2,3x2 (depth x width)",
+    )
+    parser.add_argument(
+        "--layout-objects", type=int, default=100000,
+        help="number of files in the store for --layouts. default: 100000",
+    )
+    parser.add_argument(
+        "--layout-lookups", type=int, default=10000,
+        help="number of lookups per layout for --layouts. default: 10000",
+    )
+    parser.add_argument(
+        "--run-case", nargs=4, default=None,
+        metavar=("CASE", "FILE", "WORK_DIR", "RESULT"),
+        help=argparse.SUPPRESS,
+    )
+    options = parser.parse_args()
+
+    if options.run_case:
+        case_name, file_path, work_dir, result_path = options.run_case
+        result = run_case(case_name, file_path, work_dir)
+        with open(result_path, "w") as f:
+            json.dump(result, f)
+        return
+
+    from . import store_config
+
+    sizes = default_sizes
+    if options.sizes != None:
+        sizes = [store_config.parse_size(s) for s in options.sizes.split(",")]
+    kinds = options.kinds.split(",")
+    cases = options.cases.split(",")
+
+    try:
+        from .cas_torrent import cas_torrent_version
+    except ImportError as e:
+        # the hashing cases work without libtorrent
+        cas_torrent_version = None
+        if "ingest_file" in cases:
+            print(f"benchmark: skipping ingest_file: {e}", file=sys.stderr)
+            cases = [case_name for case_name in cases if case_name != "ingest_file"]
+
+    results = []
+    if options.layouts:
+        results = run_layout_benchmark(options)
+        kinds = []
+    base_dir = tempfile.mkdtemp(prefix="cas-torrent-benchmark-", dir=options.tmpdir)
+    try:
+        for kind in kinds:
+            for size in sizes:
+                file_path = os.path.join(base_dir, f"{kind}-{size}")
+                create_file(file_path, size, kind)
+                for case_name in cases:
+                    for run_idx in range(options.repeat):
+                        work_dir = tempfile.mkdtemp(dir=base_dir)
+                        result = run_case_in_subprocess(case_name, file_path, work_dir, options.cold)
+                        shutil.rmtree(work_dir)
+                        result.update({
+                            "case": case_name,
+                            "kind": kind,
+                            "size": size,
+                            "run": run_idx,
+                            "mb_per_second": (size / 1e6 / result["seconds"]) if result["seconds"] > 0 else None,
+                        })
+                        results.append(result)
+                        print(
+                            f"{case_name:26s} {kind:7s} {size:>12d} bytes: "
+                            f"{result['seconds']:8.4f} s "
+                            f"{result['mb_per_second'] or 0:9.1f} MB/s "
+                            f"peak rss {result['peak_rss'] / 1e6:7.1f} MB "
+                            f"read syscalls {result.get('syscr', '?')}",
+                            file=sys.stderr,
+                        )
+                os.unlink(file_path)
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    report = {
+        "cas_torrent_version": cas_torrent_version,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.time(),
+        "cold_cache": options.cold,
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+# bt2r table: map bt2 root hash to sha256 hash and file size
+
+# resolving files by bt2 root hash with the bt2r store
+# needs os.path.exists and os.readlink per file,
+# which is slow for torrents with many files (random directory seeks)
+
+# the table is a sorted array of fixed-width records in one file,
+# so a lookup is a binary search in a memory-mapped file.
+# new records are appended to a write-ahead log (wal),
+# which is merged into the table when it gets too large.
+# removed records are stored as tombstones in the wal
+
+# cas/bt2r.table
+# header: magic (8 bytes), number of records (uint64)
+# record: bt2 root (32 bytes), sha256 (32 bytes), size (uint64)
+# cas/bt2r.table.wal
+# record: bt2 root (32 bytes), sha256 (32 bytes), size (uint64)
+
+# the bt2r store is still the source of truth,
+# the table is rebuilt from the hash index when it is missing
+
+# the table is shared between processes, for example cas_torrent and store_gc.
+# writers take an exclusive flock on cas/bt2r.table.lock,
+# and read the changes of other processes before they write:
+# records appended to the wal, and a new table after compaction.
+# readers check for changes at most once per second
+
+# python3 -m cas_torrent.bt2r_table cas/ some_bt2_root_hash_hex...
+
+import os
+import sys
+import time
+import mmap
+import fcntl
+import struct
+import threading
+import contextlib
+import collections
+
+
+magic = b"CASBT2R1"
+header_struct = struct.Struct("<8sQ")
+record_struct = struct.Struct("<32s32sQ")
+record_size = record_struct.size # 72
+# size of removed records in the wal
+tombstone_size = 2**64 - 1
+
+# merge the wal into the table when the wal has more records
+default_max_wal_records = 10000
+
+# seconds between checks for changes of other processes in get
+sync_interval = 1.0
+
+
+TableEntry = collections.namedtuple(
+    "TableEntry",
+    ["bt2_root", "sha256", "size"],
+)
+
+
+class Bt2rTable(object):
+    """
+    sorted table of (bt2_root, sha256, size) records
+
+    keys are raw bt2 root digests (bytes)
+
+    readonly: dont write the table or the wal,
+      for example in helper scripts that run parallel to cas_torrent
+    """
+
+    def __init__(self, table_path, readonly=False, max_wal_records=default_max_wal_records):
+        self._path = table_path
+        self._wal_path = table_path + ".wal"
+        self._lock_path = table_path + ".lock"
+        self._readonly = readonly
+        self._max_wal_records = max_wal_records
+        # the table is shared between threads
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._num_records = 0
+        # (st_dev, st_ino) of the mapped table, to find new tables after compaction
+        self._table_id = None
+        # map bt2_root to (sha256, size) of records in the wal
+        self._wal = {}
+        # number of bytes read from the wal
+        self._wal_offset = 0
+        self._wal_file = None
+        self._lock_fd = self._open_lock_file()
+        self._last_sync = time.monotonic()
+        with self._file_lock(False):
+            self._open_table()
+            self._read_wal()
+
+    @property
+    def path(self):
+        return self._path
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def __len__(self):
+        # approximate: records in the wal can replace records in the table
+        return self._num_records + len(self._wal)
+
+    def _open_lock_file(self):
+        try:
+            return os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            if not self._readonly:
+                raise
+        try:
+            return os.open(self._lock_path, os.O_RDONLY)
+        except OSError:
+            # readonly table in a readonly store without lock file
+            return None
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive):
+        # lock between processes. threads use self._lock
+        if self._lock_fd == None:
+            yield
+            return
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _get_table_id(self):
+        try:
+            stat_result = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return (stat_result.st_dev, stat_result.st_ino)
+
+    def _sync(self):
+        """
+        read the changes of other processes. call with the file lock
+        """
+        self._last_sync = time.monotonic()
+        if self._get_table_id() != self._table_id:
+            # another process has compacted the table
+            self._open_table()
+            self._read_wal()
+            return
+        self._read_wal_tail()
+
+    def _maybe_sync(self):
+        if time.monotonic() - self._last_sync < sync_interval:
+            return
+        with self._file_lock(False):
+            self._sync()
+
+    def _open_table(self):
+        if self._mmap != None:
+            self._mmap.close()
+            self._mmap = None
+        self._num_records = 0
+        self._table_id = None
+        try:
+            f = open(self._path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            stat_result = os.fstat(f.fileno())
+            self._table_id = (stat_result.st_dev, stat_result.st_ino)
+            file_size = stat_result.st_size
+            if file_size <= header_struct.size:
+                return
+            table_magic, num_records = header_struct.unpack(f.read(header_struct.size))
+            if table_magic != magic:
+                raise ValueError(f"bt2r table: bad magic in {self._path}")
+            if header_struct.size + num_records * record_size > file_size:
+                raise ValueError(f"bt2r table: truncated table {self._path}")
+            # the mmap stays valid after closing the file
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._num_records = num_records
+
+    def _read_wal(self):
+        self._wal = {}
+        self._wal_offset = 0
+        self._read_wal_tail()
+
+    def _read_wal_tail(self):
+        # read new records in the wal
+        try:
+            f = open(self._wal_path, "rb")
+        except FileNotFoundError:
+            if self._wal_offset > 0:
+                self._wal = {}
+                self._wal_offset = 0
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size < self._wal_offset:
+                # the wal was merged into the table by another process.
+                # this happens only with a new table, see _sync
+                self._wal = {}
+                self._wal_offset = 0
+            f.seek(self._wal_offset)
+            data = f.read()
+        # ignore a partial record at the end, after a crash
+        num_records = len(data) // record_size
+        for bt2_root, sha256, size in record_struct.iter_unpack(data[:num_records * record_size]):
+            self._wal[bt2_root] = (sha256, size)
+        self._wal_offset += num_records * record_size
+
+    def _search(self, bt2_root):
+        """
+        binary search in the table
+
+        return the record offset, or None
+        """
+        mm = self._mmap
+        lo = 0
+        hi = self._num_records
+        base = header_struct.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = base + mid * record_size
+            key = mm[offset:offset + 32]
+            if key < bt2_root:
+                lo = mid + 1
+            elif key > bt2_root:
+                hi = mid
+            else:
+                return offset
+        return None
+
+    def get(self, bt2_root):
+        """
+        get the TableEntry of a bt2 root hash, or None
+        """
+        with self._lock:
+            self._maybe_sync()
+            wal_record = self._wal.get(bt2_root)
+            if wal_record != None:
+                sha256, size = wal_record
+                if size == tombstone_size:
+                    return None
+                return TableEntry(bt2_root, sha256, size)
+            if self._mmap == None:
+                return None
+            offset = self._search(bt2_root)
+            if offset == None:
+                return None
+            return TableEntry(*record_struct.unpack_from(self._mmap, offset))
+
+    def get_sha256(self, bt2_root):
+        entry = self.get(bt2_root)
+        if entry == None:
+            return None
+        return entry.sha256
+
+    def _append_wal(self, bt2_root, sha256, size):
+        # call with the exclusive file lock, after _sync
+        assert not self._readonly
+        assert len(bt2_root) == 32 and len(sha256) == 32
+        if self._wal_file == None:
+            self._wal_file = open(self._wal_path, "ab")
+        self._wal_file.write(record_struct.pack(bt2_root, sha256, size))
+        self._wal_file.flush()
+        self._wal[bt2_root] = (sha256, size)
+        self._wal_offset = os.fstat(self._wal_file.fileno()).st_size
+        if len(self._wal) > self._max_wal_records:
+            self._compact()
+
+    def add(self, bt2_root, sha256, size):
+        with self._lock, self._file_lock(True):
+            self._sync()
+            wal_record = self._wal.get(bt2_root)
+            if wal_record == (sha256, size):
+                return
+            if wal_record == None and self._mmap != None:
+                offset = self._search(bt2_root)
+                if offset != None and record_struct.unpack_from(self._mmap, offset)[1:] == (sha256, size):
+                    return
+            self._append_wal(bt2_root, sha256, size)
+
+    def remove(self, bt2_root):
+        with self._lock, self._file_lock(True):
+            self._sync()
+            self._append_wal(bt2_root, bytes(32), tombstone_size)
+
+    def compact(self):
+        """
+        merge the wal into the table
+        """
+        with self._lock, self._file_lock(True):
+            self._sync()
+            self._compact()
+
+    def _iter_table_records(self):
+        mm = self._mmap
+        if mm == None:
+            return
+        base = header_struct.size
+        for record_idx in range(self._num_records):
+            yield record_struct.unpack_from(mm, base + record_idx * record_size)
+
+    def _compact(self):
+        # call with the exclusive file lock, after _sync
+        assert not self._readonly
+        wal_records = sorted(self._wal.items())
+        tmp_path = self._path + ".tmp"
+        num_records = 0
+        with open(tmp_path, "wb") as f:
+            f.write(header_struct.pack(magic, 0))
+            # merge two sorted lists
+            wal_idx = 0
+            for record in self._iter_table_records():
+                bt2_root = record[0]
+                while wal_idx < len(wal_records) and wal_records[wal_idx][0] <= bt2_root:
+                    wal_root, (sha256, size) = wal_records[wal_idx]
+                    wal_idx += 1
+                    if size != tombstone_size:
+                        f.write(record_struct.pack(wal_root, sha256, size))
+                        num_records += 1
+                    if wal_root == bt2_root:
+                        # replaced or removed
+                        record = None
+                if record != None:
+                    f.write(record_struct.pack(*record))
+                    num_records += 1
+            for wal_root, (sha256, size) in wal_records[wal_idx:]:
+                if size != tombstone_size:
+                    f.write(record_struct.pack(wal_root, sha256, size))
+                    num_records += 1
+            f.seek(0)
+            f.write(header_struct.pack(magic, num_records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self._path)
+        # the wal is merged
+        if self._wal_file != None:
+            self._wal_file.close()
+            self._wal_file = None
+        with open(self._wal_path, "wb"):
+            pass
+        self._wal = {}
+        self._wal_offset = 0
+        self._open_table()
+
+    def rebuild(self, records):
+        """
+        replace the table with records
+
+        records: iterable of (bt2_root, sha256, size)
+        """
+        with self._lock, self._file_lock(True):
+            self._wal = {
+                bt2_root: (sha256, size)
+                for bt2_root, sha256, size in records
+            }
+            if self._mmap != None:
+                self._mmap.close()
+                self._mmap = None
+            self._num_records = 0
+            self._compact()
+
+    def reload(self):
+        """
+        read changes from other processes now
+        """
+        with self._lock, self._file_lock(False):
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._wal_file != None:
+                self._wal_file.close()
+                self._wal_file = None
+            if self._mmap != None:
+                self._mmap.close()
+                self._mmap = None
+            if self._lock_fd != None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(f"usage: python3 -m cas_torrent.bt2r_table cas/ bt2_root_hash_hex...", file=sys.stderr)
+        sys.exit(1)
+    store_prefix = sys.argv[1]
+    table = Bt2rTable(os.path.join(store_prefix, "bt2r.table"), readonly=True)
+    for bt2_root_hex in sys.argv[2:]:
+        entry = table.get(bytes.fromhex(bt2_root_hex))
+        if entry == None:
+            print(bt2_root_hex, "not found")
+            continue
+        print(bt2_root_hex, entry.sha256.hex(), entry.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,7 @@ import os.path
 import tempfile
 import shutil
 import hashlib
-import math
+import collections
 
 import libtorrent as lt
 
@@ -27,6 +27,23 @@ from . import casfs_util
 # https://github.com/7sDream/torrent_parser/blob/master/torrent_parser.py
 from . import torrent_parser
 
+from . import hashing
+from . import hash_index
+from . import bt2r_table
+from . import store_config
+from . import reshard
+from . import volumes
+from . import materialize
+from . import batch_link
+from . import las_index
+from . import v1_match
+from . import file_list
+from . import v1_pieces
+from . import hash_pool
+from . import completion_queue
+from . import completed_files
+from .hashing import get_bt2_root_hash_of_path, get_sha256_of_path
+
 
 # also in setup.py
 # FIXME single source
@@ -58,38 +75,6 @@ def is_empty_hash(h):
     return h == "0000000000000000000000000000000000000000000000000000000000000000"
 
 
-def get_bt2_root_hash_of_path(file_path):
-    """
-    get bittorrent v2 merkle root hash of file path
-    """
-    # sha256 performance https://stackoverflow.com/questions/67355203/how-to-improve-the-speed-of-merkle-root-calculation
-    nodes = []
-    chunk_size = 16 * 1024
-
-    with open(file_path, "rb") as f:
-        # TODO better. this needs much memory for large files
-        while chunk := f.read(chunk_size):
-            leaf_node = hashlib.sha256(chunk).digest()
-            nodes.append(leaf_node)
-
-        # pad tree to binary tree
-        # TODO better. use less memory
-        empty_digest = b"\x00" * 32
-        num_missing_nodes = 2**math.ceil(math.log2(len(nodes))) - len(nodes)
-        nodes += [empty_digest] * num_missing_nodes
-
-        while len(nodes) != 1:
-            next_nodes = []
-            for i in range(0, len(nodes), 2):
-                node1 = nodes[i]
-                # tree was padded to binary tree, so nodes[i+1] is always defined
-                node2 = nodes[i+1]
-                parent_node = hashlib.sha256(node1 + node2).digest()
-                next_nodes.append(parent_node)
-            nodes = next_nodes
-        return nodes[0]
-
-
 def create_relative_symlink(link_target, link_path, target_is_directory=False):
     # debug
     print(f"creating symlink from {repr(link_path)} to {repr(link_target)}")
@@ -98,6 +83,18 @@ def create_relative_symlink(link_target, link_path, target_is_directory=False):
     os.symlink(link_target_relative, link_path, target_is_directory)
 
 
+def materialize_store_file(file_sha256_store_path, file_path):
+    """
+    create file_path from a file in the sha256 store,
+    as symlink, hardlink or reflink, depending on the store config
+    """
+    mode = store_metadata["materialize"]
+    used_mode = materialize.materialize_file(file_sha256_store_path, file_path, mode)
+    # debug
+    print(f"creating {used_mode} from {repr(file_path)} to {repr(file_sha256_store_path)}")
+    return used_mode
+
+
 def symlink_las_cas(file_las_path, file_cas_path_list):
     """
     create symlink from las to cas
@@ -112,31 +109,33 @@ def symlink_las_cas(file_las_path, file_cas_path_list):
     before the file extension
     """
     # FIXME pass more cas paths to symlink_las_cas
-    # FIXME check all paths in file_cas_path_list
     file_cas_path = file_cas_path_list[0]
-    if os.path.islink(file_las_path):
-        print("symlink exists: file_las_path:", file_las_path)
-        # FIXME handle absolute symlinks
-        # os.path.realpath should not resolve symlinks, only remove "x/../" path components
-        # -> use os.path.abspath
-        #link_target = os.path.realpath(os.path.join(os.path.dirname(file_las_path), os.readlink(file_las_path)))
-        link_target = os.path.abspath(os.path.join(os.path.dirname(file_las_path), os.readlink(file_las_path)))
-        if link_target == file_cas_path:
-            return
-        # FIXME handle other cases of "symlink exists to identical content"
-        # check both bt1 and bt2 stores
-        print("symlink exists: link_target:", link_target)
-        raise Exception("FIXME handle existing files in las store")
-        # FIXME check link_target. if its the same content, ignore
-        # if the content is different, rename the symlink
-        # by appending " (1)" or " (2)" or " (3)" etc before the file extension
-        return new_file_las_path
-    elif os.path.exists(file_las_path):
-        print("file exists: file_las_path:", file_las_path)
-        raise Exception("FIXME handle existing files in las store")
+    new_file_las_path, exists = las_store_index.find_las_path(file_las_path, file_cas_path_list)
+    if not exists:
+        # create symlink from las to bt2 store
+        os.makedirs(os.path.dirname(new_file_las_path), exist_ok=True)
+        create_relative_symlink(file_cas_path, new_file_las_path)
+        las_store_index.add(new_file_las_path, file_cas_path)
+    if new_file_las_path != file_las_path:
+        print(f"symlink_las_cas: renamed {repr(file_las_path)} to {repr(new_file_las_path)}")
         return new_file_las_path
-    # create symlink from las to bt2 store
-    create_relative_symlink(file_cas_path, file_las_path)
+
+
+def plan_las_link(las_linker, file_las_path, file_cas_path_list):
+    """
+    plan a symlink from las to cas, see symlink_las_cas
+
+    the las path is reserved in the las index,
+    so other files of this torrent see the link before it is created
+    """
+    file_cas_path = file_cas_path_list[0]
+    new_file_las_path, exists = las_store_index.find_las_path(file_las_path, file_cas_path_list)
+    if exists:
+        return
+    if new_file_las_path != file_las_path:
+        print(f"plan_las_link: renamed {repr(file_las_path)} to {repr(new_file_las_path)}")
+    las_linker.add(file_cas_path, new_file_las_path)
+    las_store_index.add(new_file_las_path, file_cas_path)
 
 
 def add_torrent(ses, filename, options):
@@ -144,6 +143,8 @@ def add_torrent(ses, filename, options):
 
     info_hash_v1 = None
     info_hash_v2 = None
+    # unknown for magnet links
+    torrent_size = 0
 
     if filename.startswith('magnet:'):
         print("add_torrent: parsing magnet link:", filename)
@@ -172,29 +173,34 @@ def add_torrent(ses, filename, options):
         # info_hash = binascii.hexlify(hashlib.sha1(info_bytes).digest()).decode()
         # # print(f"info_hash: {info_hash}")
         # self.assertEqual(info_hash, "f435d2324f313bad7ff941633320fe4d1c9c3079")
-        # TODO does parse_torrent_file preserve the sort order of "info"?
         # https://stackoverflow.com/questions/19749085/calculating-the-info-hash-of-a-torrent-file
         #   Be observant that the example torrent file given by Arvid, both the root-dictionary and the info-dictionary is unsorted.
         #   According to the bencode specification a dictionary must be sorted.
         #   However the agreed convention when a info-dictionary for some reason is unsorted,
         #   is to hash the info-dictionary raw as it is (unsorted), as explained by Arvid above.
         # https://stackoverflow.com/questions/28348678/what-exactly-is-the-info-hash-in-a-torrent-file
-        # hash_raw=True is needed for lossless parsing and encoding, to preserve the info hash
-        torrent_data = torrent_parser.parse_torrent_file(filename, hash_raw=True)
-        info_bytes = torrent_parser.encode(torrent_data["info"])
-        # this is not part of torrent_parser
-        # https://github.com/7sDream/torrent_parser/issues/14
-        # add functions to calculate v1 and v2 info hashes of torrent files
+        # so we hash the raw bytes of "info", recorded by the parser.
+        # encoding torrent_data["info"] again would be slower, and lossy for unsorted dicts
+        # see also torrent_parser.info_hashes
+        # dont decode "pieces" and "piece layers" = LazyValue
+        with open(filename, "rb") as f:
+            parser = torrent_parser.TorrentFileParser(f, hash_raw=True, span_paths=[["info"]], exclude_paths=torrent_parser.TorrentFileParser.BULK_HASH_PATHS)
+            torrent_data = parser.parse()
+        info_bytes = parser.get_span_data(["info"])
         # FIXME handle v1-only and v2-only torrents
         # dont get info_hash_v1 of v2-only torrents
         # dont get info_hash_v2 of v1-only torrents
         # TODO or should we always calculate both hashes?
         info_hash_v1 = hashlib.sha1(info_bytes).hexdigest()
         info_hash_v2 = hashlib.sha256(info_bytes).hexdigest()
+        torrent_size = ti.total_size()
 
         resume_file = os.path.join(options.save_path, ti.name() + '.fastresume')
         try:
-            atp = lt.read_resume_data(open(resume_file, 'rb').read())
+            resume_data = open(resume_file, 'rb').read()
+            atp = lt.read_resume_data(resume_data)
+            # files that were moved to the sha256 store before
+            resume_completed_files[ti.name()] = completed_files.read_from_resume_data(resume_data)
         except Exception as e:
             print('failed to open resume file "%s": %s' % (resume_file, e))
         atp.ti = ti
@@ -247,30 +253,30 @@ def add_torrent(ses, filename, options):
     # for v1-only magnet links, this uses the v1 hash
     # FIXME magnet links: later with metadata, move files from bt1 to bt2 store
     store_path = get_store_path_from_hashes(info_hash_v1, info_hash_v2)
+    # find the torrent in all volumes, or choose a volume for a new torrent
+    existing_store_path = store_volumes.find_path(os.path.relpath(store_path, store_prefix))
+    if existing_store_path != None:
+        store_path = existing_store_path
+    else:
+        volume = store_volumes.choose_volume(torrent_size)
+        store_path = get_store_path_from_hashes(info_hash_v1, info_hash_v2, volume.store_prefix)
+        if torrent_size > 0:
+            # released on torrent_finished_alert
+            store_volumes.reserve(store_path, volume, torrent_size)
     atp.save_path = store_path
     print("add_torrent: save path:", atp.save_path)
 
     if not is_empty_hash(info_hash_v1) and not is_empty_hash(info_hash_v1):
         # v1 torrents: create symlink from bt1 to bt2 store
         # FIXME for magnet links, do this later with metadata
-        store_path_v1 = get_store_path_from_hashes(info_hash_v1, None)
+        store_path_v1 = get_store_path_from_hashes(info_hash_v1, None, get_volume_prefix(store_path))
         # note: os.path.exists returns False on broken symlinks
         if not os.path.exists(store_path_v1) and not os.path.islink(store_path_v1):
             create_relative_symlink(store_path, store_path_v1)
 
     # use complete files from the bt2r store
-
-    # populate the bt2r store from the sha256 store
-    print("populating bt2r store from sha256 store")
-    for sha256_root, _dirs, sha256_files in os.walk(os.path.join(store_prefix, "sha256")):
-        for sha256_file in sha256_files:
-            sha256_file_path = os.path.join(sha256_root, sha256_file)
-            bt2_root_hash = get_bt2_root_hash_of_path(sha256_file_path).hex()
-            #print("sha256 file:", sha256_file_path)
-            bt2_root_file_path = get_file_store_path(bt2_root_hash, "bt2r")
-            if os.path.exists(bt2_root_file_path):
-                continue
-            create_relative_symlink(sha256_file_path, bt2_root_file_path)
+    # note: ingest_file adds new files to the hash index and the bt2r store,
+    # the sha256 store is scanned only on startup, see populate_bt2r_store
 
     #print("torrent_data:")
     # TypeError: Object of type bytes is not JSON serializable
@@ -282,79 +288,8 @@ def add_torrent(ses, filename, options):
 
     #torrent_piece_length = torrent_data['info']['piece length']
 
-    if 'file tree' in torrent_data['info']:
-        def walk_file_tree(file_tree, entry_path=[]):
-            for entry_name, entry in file_tree.items():
-                if entry_name != "":
-                    # branch node == directory
-                    # recurse
-                    walk_file_tree(entry, entry_path + [entry_name])
-                    continue
-
-                # leaf node == file
-
-                #print("walk_file_tree: file:", os.path.join(*entry_path), entry['length'], entry['pieces root'].hex())
-
-                file_path = os.path.join(store_path, *entry_path)
-
-                if os.path.exists(file_path):
-                    continue
-
-                # search for existing file by bt2r hash
-
-                # bt2r = bittorrent root hash
-                file_bt2r_hash = entry['pieces root'].hex()
-                file_bt2r_store_path = get_file_store_path(file_bt2r_hash, "bt2r")
-                #print("walk_file_tree: file_bt2r_store_path", file_bt2r_store_path)
-
-                if not os.path.exists(file_bt2r_store_path):
-                    continue
-
-                """
-                    # not needed. now we can lookup files by bt2r hash
-
-                    # FIXME try to find complete file by file size and file hash
-
-                    file_size = entry['length']
-
-                    # bash: find cas/sha256/ -size 6186712c
-
-                    for sha256_root, _dirs, sha256_files in os.walk(os.path.join(store_prefix, "sha256")):
-                        for sha256_file in sha256_files:
-                            sha256_file_path = os.path.join(sha256_root, sha256_file)
-                            print("sha256 file:", sha256_file_path)
-                            if os.path.getsize(sha256_file_path) != file_size:
-                                continue
-
-                    raise Exception("todo")
-
-                    continue
-                """
-
-                # get sha256 store path
-                # this assumes that bt2r store files are always symlinked to sha256 store files
-                file_sha256_store_path = os.path.normpath(os.path.join(os.path.dirname(file_bt2r_store_path), os.readlink(file_bt2r_store_path)))
-                #print("walk_file_tree: file_sha256_store_path", file_sha256_store_path)
-
-                # create symlink from torrent to sha256 store
-                print(f"walk_file_tree: found complete file: creating symlink from {repr(file_path)} to {repr(file_sha256_store_path)}")
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                link_target = os.path.relpath(file_sha256_store_path, os.path.dirname(file_path))
-                #print(f"walk_file_tree: symlink({repr(link_target)}, {repr(file_bt2r_store_path)}")
-                os.symlink(link_target, file_path, target_is_directory=False)
-                #create_relative_symlink(file_sha256_store_path, file_path)
-
-        torrent_name = torrent_data['info']['name']
-
-        # FIXME verify this for single file torrents
-        walk_file_tree(torrent_data['info']['file tree'], [torrent_name])
-
-    #raise Exception("todo")
-
-
-
-    # FIXME create las (location-addressed store) and handle filepath collisions
-    # chromium handles filepath collisions like "f.txt" and "f (1).txt" and "f (2).txt"
+    # create las (location-addressed store) and handle filepath collisions
+    # like chromium: "f.txt" and "f (1).txt" and "f (2).txt"
     # FIXME for magnet links, do this later with metadata
     # fix: 4.2.5 overwrites files if file names are the same
     # https://github.com/qbittorrent/qBittorrent/issues/12842
@@ -362,105 +297,78 @@ def add_torrent(ses, filename, options):
     # In the context of CAS, these traditional approaches are referred to as "location-addressed",
     # as each file is represented by a list of one or more locations, the path and filename, on the physical storage.
 
-    if 'file tree' in torrent_data['info']:
-        def walk_file_tree(file_tree, entry_path=[]):
-            for entry_name, entry in file_tree.items():
-                if entry_name != "":
-                    # branch node == directory
-                    # recurse
-                    walk_file_tree(entry, entry_path + [entry_name])
-                    continue
-
-                # leaf node == file
-
-                #print("walk_file_tree: file:", os.path.join(*entry_path), entry['length'], entry['pieces root'].hex())
-
-                file_path = os.path.join(store_path, *entry_path)
-
-                # note: entry_path[0] == torrent_name
-                file_las_path = os.path.join(las_store_prefix, *entry_path)
-
-                print("file_path:", file_path)
-                print("file_las_path:", file_las_path)
-
-                symlink_las_cas(file_las_path, [file_path])
-
-                # search for existing file by bt2r hash
-
-                # bt2r = bittorrent root hash
-                file_bt2r_hash = entry['pieces root'].hex()
-                file_bt2r_store_path = get_file_store_path(file_bt2r_hash, "bt2r")
-                #print("walk_file_tree: file_bt2r_store_path", file_bt2r_store_path)
-
-                if not os.path.exists(file_bt2r_store_path):
-                    continue
-
-                if os.path.islink(file_path):
-                    # TODO? check if the symlink points to the sha256 store
-                    continue
-
-                """
-                    # find file by size and bt2r hash
-                    # not needed
-                    # with populated bt2r store, we can lookup files by bt2r hash
-
-                    # FIXME try to find complete file by file size and file hash
-
-                    file_size = entry['length']
-
-                    # bash: find cas/sha256/ -size 6186712c
-
-                    for sha256_root, _dirs, sha256_files in os.walk(os.path.join(store_prefix, "sha256")):
-                        for sha256_file in sha256_files:
-                            sha256_file_path = os.path.join(sha256_root, sha256_file)
-                            print("sha256 file:", sha256_file_path)
-                            if os.path.getsize(sha256_file_path) != file_size:
-                                continue
-
-                    raise Exception("todo")
-
-                    continue
-                """
-
+    # plan all links, then create them at once
+    # links from torrent to sha256 store, for complete files
+    store_linker = batch_link.BatchLinker(store_metadata["materialize"])
+    # map torrent file path to file_idx of planned store links
+    store_linked_files = {}
+    # links from las store to torrent
+    las_linker = batch_link.BatchLinker("symlink")
+
+    # files of "file tree" or "files", or the single file
+    torrent_files = file_list.get_file_list(torrent_data['info'])
+    if not torrent_files.is_v2():
+        # v1 torrents have no bt2r hash
+        v1_complete_files = find_v1_complete_files(torrent_data['info'], torrent_files)
+
+    for file_idx in range(len(torrent_files)):
+        # note: entry_path[0] == torrent_name
+        # create one symlink per file, so we can merge directories
+        entry_path = torrent_files.get_path(file_idx)
+        file_path = os.path.join(store_path, *entry_path)
+        file_las_path = os.path.join(las_store_prefix, *entry_path)
+
+        if torrent_files.is_v2():
+            # search for existing file by bt2r hash
+
+            # bt2r = bittorrent root hash
+            # lookup in the bt2r table, this is faster than readlink in the bt2r store
+            # empty files have no pieces root
+            file_bt2r_hash = torrent_files.get_pieces_root(file_idx)
+            file_sha256 = None
+            if file_bt2r_hash != None:
+                file_sha256 = store_bt2r_table.get_sha256(file_bt2r_hash)
+            file_sha256_store_path = None
+            if file_sha256 != None:
                 # get sha256 store path
-                # this assumes that bt2r store files are always symlinked to sha256 store files
-                file_sha256_store_path = os.path.normpath(os.path.join(os.path.dirname(file_bt2r_store_path), os.readlink(file_bt2r_store_path)))
-                #print("walk_file_tree: file_sha256_store_path", file_sha256_store_path)
+                # None if removed from the sha256 store
+                file_sha256_store_path = find_file_store_path(file_sha256.hex())
+        else:
+            file_sha256_store_path = v1_complete_files.get(file_idx)
 
-                # create symlink from torrent to sha256 store
-                print(f"walk_file_tree: found complete file: creating symlink from {repr(file_path)} to {repr(file_sha256_store_path)}")
-                """
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                link_target = os.path.relpath(file_sha256_store_path, os.path.dirname(file_path))
-                #print(f"walk_file_tree: symlink({repr(link_target)}, {repr(file_bt2r_store_path)}")
-                os.symlink(link_target, file_path, target_is_directory=False)
-                """
-                create_relative_symlink(file_sha256_store_path, file_path)
-
-        torrent_name = torrent_data['info']['name']
+        if file_sha256_store_path == None:
+            plan_las_link(las_linker, file_las_path, [file_path])
+            continue
 
-        # FIXME verify this for single file torrents
-        walk_file_tree(torrent_data['info']['file tree'], [torrent_name])
-    elif 'files' in torrent_data['info']:
-        #print(torrent_data['info'])
-        torrent_name = torrent_data['info']['name']
-        # create one symlink per file, so we can merge directories
-        for file_entry in torrent_data['info']['files']:
-            # FIXME handle single file torrents
-            file_path = os.path.join(store_path, torrent_name, *file_entry['path'])
-            print("file_path:", file_path)
-            file_las_path = os.path.join(las_store_prefix, torrent_name, *file_entry['path'])
-            #file_size = file_entry['length']
-            print("file_las_path:", file_las_path)
-            symlink_las_cas(file_las_path, [file_path])
-    else:
-        # single file torrent
-        #print(torrent_data['info'])
-        torrent_name = torrent_data['info']['name']
-        file_path = os.path.join(store_path, torrent_name)
-        print("file_path:", file_path)
-        file_las_path = os.path.join(las_store_prefix, torrent_name)
-        print("file_las_path:", file_las_path)
+        # the torrent file is created later by store_linker,
+        # so also compare the sha256 store path with existing las links
+        plan_las_link(las_linker, file_las_path, [file_path, file_sha256_store_path])
+
+        # create link from torrent to sha256 store
+        # existing files are not replaced: links and partial files
+        store_linker.add(file_sha256_store_path, file_path)
+        store_linked_files[file_path] = file_idx
+
+    print(f"add_torrent: found {len(store_linker)} complete files")
+    store_linker.apply()
+    print("add_torrent: torrent store:", store_linker.format_stats())
+    # linked files are in the sha256 store, dont hash them again in complete_file.
+    # reflinks look like downloaded files, see materialize.is_materialized
+    conflict_paths = set(file_path for link_target, file_path in store_linker.conflicts)
+    torrent_completed = completed_files.CompletedFiles(
+        len(torrent_files),
+        resume_completed_files.get(torrent_data['info']['name']),
+    )
+    for file_path, file_idx in store_linked_files.items():
+        if file_path not in conflict_paths:
+            torrent_completed.set_completed(file_idx)
+    resume_completed_files[torrent_data['info']['name']] = torrent_completed.to_bytes()
+    del store_linked_files
+    las_linker.apply()
+    print("add_torrent: las store:", las_linker.format_stats())
+    for file_path, file_las_path in las_linker.conflicts:
+        # the las store was changed by another app
+        las_store_index.load_path(file_las_path)
         symlink_las_cas(file_las_path, [file_path])
 
     if not is_empty_hash(info_hash_v2):
@@ -477,20 +385,106 @@ def add_torrent(ses, filename, options):
 # TODO better?
 store_prefix = None
 las_store_prefix = None
+las_store_index = None
+# max number of candidate files with the same size
+max_v1_candidates = 20
+# cas/store.json
+store_metadata = None
+# VolumeManager of all cas stores. store_prefix is the primary volume
+store_volumes = None
 store_dirs_v1 = None
 store_dirs_v2 = None
 store_files_v2 = None
+store_hash_index = None
+# map bt2 root hash to sha256 hash
+store_bt2r_table = None
+store_hash_pool = None
+# map torrent handle to InflightHasher
+inflight_hashers = None
+# map torrent handle to {file_idx: (file_path, file_bt2r_hash, file_size)}
+# of completed files that wait for in-flight hashing
+inflight_ingest_files = None
+store_completion_queue = None
+# map torrent handle to CompletedFiles
+torrent_completed_files = None
+# map torrent name to bitmap of completed files from resume data
+resume_completed_files = None
+
+def get_v1_piece_lengths():
+    """
+    return the piece lengths of cached v1 piece hashes, or None
+    """
+    return store_metadata["v1_piece_lengths"] or None
+
+
+def write_v1_pieces(file_sha256_store_path, ingest_result):
+    """
+    cache the v1 piece hashes of a file in the sha256 store
+    """
+    # same volume as the sha256 file
+    v1_pieces_path = get_file_store_path(ingest_result.sha256.hex(), v1_pieces.v1_pieces_store_dir, get_volume_prefix(file_sha256_store_path))
+    if os.path.exists(v1_pieces_path):
+        return
+    v1_pieces.write_v1_pieces(v1_pieces_path, ingest_result.size, ingest_result.v1_pieces)
+
+
+def find_v1_complete_files(torrent_info, torrent_files):
+    """
+    find complete files of a v1 torrent in the sha256 store
+
+    torrent_files: file_list.FileList of the torrent
+
+    candidates are found by file size in the hash index,
+    and verified with the v1 piece hashes
+
+    return {file_idx: sha256_store_path}
+    """
+    piece_length = torrent_info['piece length']
+    pieces = torrent_info['pieces']
+    if isinstance(pieces, torrent_parser.LazyValue):
+        pieces = pieces.value
+    total_size = torrent_files.get_total_size()
+    v1_complete_files = {}
+    num_cached = 0
+    # verify candidates in parallel
+    jobs = []
+    for v1_file in v1_match.iter_v1_files(torrent_files):
+        if len(v1_match.get_full_pieces(v1_file, piece_length, total_size)) == 0:
+            # small file, cannot be verified
+            continue
+        # many small files can have the same size
+        for file_sha256 in store_hash_index.get_by_size(v1_file.length, max_v1_candidates):
+            file_sha256_store_path = find_file_store_path(file_sha256.hex())
+            if file_sha256_store_path == None:
+                continue
+            # cached v1 piece hashes
+            v1_pieces_path = get_file_store_path(file_sha256.hex(), v1_pieces.v1_pieces_store_dir, get_volume_prefix(file_sha256_store_path))
+            file_v1_pieces = v1_pieces.read_v1_pieces(v1_pieces_path)
+            if file_v1_pieces != None:
+                is_complete = v1_match.verify_v1_pieces(file_v1_pieces, v1_file, pieces, piece_length, total_size)
+                if is_complete != None:
+                    num_cached += 1
+                    if is_complete and v1_file.file_idx not in v1_complete_files:
+                        v1_complete_files[v1_file.file_idx] = file_sha256_store_path
+                    continue
+            future = store_hash_pool.submit(v1_match.verify_file, file_sha256_store_path, v1_file, pieces, piece_length, total_size)
+            jobs.append((v1_file.file_idx, file_sha256_store_path, future))
+    for file_idx, file_sha256_store_path, future in jobs:
+        if future.result() and file_idx not in v1_complete_files:
+            v1_complete_files[file_idx] = file_sha256_store_path
+    if jobs or num_cached:
+        print(f"find_v1_complete_files: verified {len(jobs)} candidates, {num_cached} candidates from cache, found {len(v1_complete_files)} complete files")
+    return v1_complete_files
 
-def get_store_path_from_hashes(info_hash_v1, info_hash_v2):
+
+def get_store_path_from_hashes(info_hash_v1, info_hash_v2, volume_prefix=None):
     global store_prefix
     global las_store_prefix
     use_v2 = not is_empty_hash(info_hash_v2)
     hashid = info_hash_v2 if use_v2 else info_hash_v1
     store_dir = "bt2" if use_v2 else "bt1"
     assert hashid != None
-    shard_depth = 2
-    shard_width = 2
-    store_shard = casfs_util.shard(hashid, shard_depth, shard_width)
+    store_shard = store_config.get_shard(hashid, store_metadata)
     #print("store shard:", repr(store_shard))
     # "".join(map(lambda n: str(n % 10), range(1, 65)))
     # cas/bt2/12/34/567890123456789012345678901234567890123456789012345678901234
@@ -498,32 +492,318 @@ def get_store_path_from_hashes(info_hash_v1, info_hash_v2):
     #print("get_store_path_from_hashes: store_dir:", store_dir)
     #print("get_store_path_from_hashes: hashid:", hashid)
     #print("get_store_path_from_hashes: join paths:", [store_prefix, store_dir, *store_shard])
-    store_path = os.path.join(store_prefix, store_dir, *store_shard)
+    if volume_prefix == None:
+        volume_prefix = store_prefix
+    store_path = os.path.join(volume_prefix, store_dir, *store_shard)
     return store_path
 
 
-def get_file_store_path(file_hash, store_dir="sha256"):
+def get_file_store_path(file_hash, store_dir="sha256", volume_prefix=None):
     global store_prefix
     global las_store_prefix
     #print("file_hash", repr(file_hash))
     assert len(file_hash) == 64
     assert not is_empty_hash(file_hash)
-    shard_depth = 2
-    shard_width = 2
-    store_shard = casfs_util.shard(file_hash, shard_depth, shard_width)
+    store_shard = store_config.get_shard(file_hash, store_metadata)
     # "".join(map(lambda n: str(n % 10), range(1, 65)))
     # cas/sha256/12/34/567890123456789012345678901234567890123456789012345678901234
-    store_path = os.path.join(store_prefix, store_dir, *store_shard)
+    if volume_prefix == None:
+        volume_prefix = store_prefix
+    store_path = os.path.join(volume_prefix, store_dir, *store_shard)
     return store_path
 
 
-# https://stackoverflow.com/questions/1131220/get-the-md5-hash-of-big-files-in-python
-def get_sha256_of_path(file_path, chunk_size=8192):
-    hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        while chunk := f.read(chunk_size):
-            hash.update(chunk)
-    return hash.digest()
+def get_volume_prefix(path):
+    """
+    get the cas store that contains path
+    """
+    volume = store_volumes.get_volume_of_path(path)
+    if volume == None:
+        return store_prefix
+    return volume.store_prefix
+
+
+def find_file_store_path(file_hash, store_dir="sha256"):
+    """
+    find a file in the sha256 or bt2r store of all volumes
+
+    return None if the file does not exist
+    """
+    if store_dir == "sha256" and store_hash_index != None:
+        # the hash index knows the volume of the file
+        index_entry = store_hash_index.get(bytes.fromhex(file_hash))
+        if index_entry != None:
+            volume = store_volumes.get_volume_by_dev(index_entry.dev)
+            if volume != None:
+                file_store_path = get_file_store_path(file_hash, store_dir, volume.store_prefix)
+                if os.path.exists(file_store_path):
+                    return file_store_path
+    return store_volumes.find_path(os.path.relpath(get_file_store_path(file_hash, store_dir), store_prefix))
+
+
+def populate_bt2r_store():
+    """
+    create bt2r store links for all files in the sha256 store
+
+    use the hash index to hash only new files.
+    hash files in parallel with the hash pool
+
+    this runs on startup for a new hash index, or with --rescan-store
+    """
+    print("populating bt2r store from sha256 store")
+    shard_depth = store_metadata["shard_depth"]
+    v1_piece_lengths = get_v1_piece_lengths()
+    store_hash_pool.reset_stats()
+
+    # hashing jobs and finished directories, in order
+    # ("file", sha256_file_path, file_sha256, stat_result, future, volume_prefix)
+    # ("dir", dir_path, dir_mtime_ns)
+    pending = collections.deque()
+    max_pending_files = 1000
+    num_pending_files = 0
+
+    def handle_pending():
+        nonlocal num_pending_files
+        item = pending.popleft()
+        if item[0] == "dir":
+            _, dir_path, dir_mtime_ns = item
+            store_hash_index.set_dir_mtime(dir_path, dir_mtime_ns)
+            return
+        _, sha256_file_path, file_sha256, stat_result, future, volume_prefix = item
+        num_pending_files -= 1
+        hash_result = future.result()
+        if isinstance(hash_result, hashing.IngestResult):
+            # with v1 piece hashes
+            write_v1_pieces(sha256_file_path, hash_result)
+            bt2_root_hash = hash_result.bt2_root
+        else:
+            bt2_root_hash = hash_result
+        store_hash_index.add(file_sha256, bt2_root_hash, stat_result)
+        if bt2_root_hash == None:
+            # empty file has no root hash
+            return
+        store_bt2r_table.add(bt2_root_hash, file_sha256, stat_result.st_size)
+        # bt2r links are on the volume of the sha256 file
+        bt2_root_file_path = get_file_store_path(bt2_root_hash.hex(), "bt2r", volume_prefix)
+        if os.path.lexists(bt2_root_file_path):
+            return
+        create_relative_symlink(sha256_file_path, bt2_root_file_path)
+
+    # one transaction for all changes, not one per file
+    with store_hash_index.batch():
+        for volume in store_volumes:
+            sha256_store_path = os.path.join(volume.store_prefix, "sha256")
+            for dir_path, sha256_prefix, dir_mtime_ns in hash_index.iter_changed_dirs(store_hash_index, sha256_store_path, shard_depth):
+                indexed_sha256_set = set(store_hash_index.prefix_range(sha256_prefix, volume.dev))
+                for sha256_entry in os.scandir(dir_path):
+                    if not sha256_entry.is_file(follow_symlinks=False):
+                        continue
+                    sha256_file_path = sha256_entry.path
+                    try:
+                        file_sha256 = bytes.fromhex(sha256_prefix + sha256_entry.name)
+                    except ValueError:
+                        print("populate_bt2r_store: ignoring unknown file:", sha256_file_path)
+                        continue
+                    indexed_sha256_set.discard(file_sha256)
+                    stat_result = sha256_entry.stat(follow_symlinks=False)
+                    index_entry = store_hash_index.get(file_sha256)
+                    if store_hash_index.is_entry_current(index_entry, stat_result):
+                        continue
+                    # new file, or file was added outside of cas_torrent
+                    #print("sha256 file:", sha256_file_path)
+                    # drop_cache: dont evict the page cache of seeded files
+                    if v1_piece_lengths:
+                        future = store_hash_pool.submit(hashing.hash_file, sha256_file_path, drop_cache=True, v1_piece_lengths=v1_piece_lengths)
+                    else:
+                        future = store_hash_pool.submit(get_bt2_root_hash_of_path, sha256_file_path, drop_cache=True)
+                    pending.append(("file", sha256_file_path, file_sha256, stat_result, future, volume.store_prefix))
+                    num_pending_files += 1
+                    while num_pending_files > max_pending_files:
+                        handle_pending()
+                # remove deleted files from the index
+                for file_sha256 in indexed_sha256_set:
+                    if len(store_volumes) > 1 and find_file_store_path(file_sha256.hex()) != None:
+                        # file is on another volume with the same st_dev
+                        continue
+                    index_entry = store_hash_index.get(file_sha256)
+                    if index_entry != None and index_entry.bt2_root != None:
+                        store_bt2r_table.remove(index_entry.bt2_root)
+                    store_hash_index.remove(file_sha256)
+                pending.append(("dir", dir_path, dir_mtime_ns))
+
+        while pending:
+            handle_pending()
+
+    print("populate_bt2r_store:", store_hash_pool.format_stats())
+
+
+def ingest_file(file_path, file_bt2r_hash=None, ingest_result=None):
+    """
+    move a complete file to the sha256 store,
+    and create symlinks from file path and from the bt2r store
+
+    the file is read only once, to get both sha256 and bt2r hashes
+
+    file_bt2r_hash: expected bt2 root hash from the torrent, or None
+    ingest_result: result of hashing.hash_file(file_path), when the file was hashed before
+    """
+    if ingest_result == None:
+        ingest_result = hashing.hash_file(file_path, v1_piece_lengths=get_v1_piece_lengths())
+
+    # note: file_bt2r_hash != file_sha256
+    if file_bt2r_hash != None and ingest_result.bt2_root != None and file_bt2r_hash != ingest_result.bt2_root.hex():
+        # this should never happen, libtorrent has verified the pieces.
+        # keep the file in the torrent directory, and dont mark it as completed
+        raise Exception(f"ingest_file: bt2 root hash mismatch: expected {file_bt2r_hash}, actual {ingest_result.bt2_root.hex()}, path {repr(file_path)}")
+
+    # TODO avoid hex
+    file_sha256 = ingest_result.sha256.hex()
+    # find the file in all volumes
+    file_sha256_store_path = find_file_store_path(file_sha256)
+
+    # FIXME handle truncated SHA-256 hashes https://blog.libtorrent.org/2020/09/bittorrent-v2/
+
+    if file_sha256_store_path != None:
+        # file exists in sha256 store
+        # delete duplicate file in torrent store
+        print("ingest_file: file exists in sha256 store:", file_sha256_store_path)
+        os.unlink(file_path)
+    else:
+        # prefer the volume of the file, so we can move the file with os.rename
+        volume = store_volumes.choose_volume(ingest_result.size, near_path=file_path)
+        file_sha256_store_path = get_file_store_path(file_sha256, "sha256", volume.store_prefix)
+        # move file from torrent to store
+        print(f"ingest_file: moving file from {repr(file_path)} to {repr(file_sha256_store_path)}")
+        os.makedirs(os.path.dirname(file_sha256_store_path), exist_ok=True)
+        store_volumes.move_file(file_path, file_sha256_store_path)
+
+    # TODO better
+    assert os.path.exists(file_sha256_store_path) == True
+    assert os.path.exists(file_path) == False
+
+    if store_hash_index != None:
+        store_hash_index.add(ingest_result.sha256, ingest_result.bt2_root, os.stat(file_sha256_store_path))
+
+    if ingest_result.v1_pieces != None:
+        write_v1_pieces(file_sha256_store_path, ingest_result)
+
+    # create link from torrent to sha256 file store
+    materialize_store_file(file_sha256_store_path, file_path)
+
+    # create symlink from root hash to sha256 file store
+    # this also works for v1-only torrents
+    if ingest_result.bt2_root == None:
+        # empty file has no root hash
+        return ingest_result
+    bt2_root_hash = ingest_result.bt2_root.hex()
+    if store_bt2r_table != None:
+        store_bt2r_table.add(ingest_result.bt2_root, ingest_result.sha256, ingest_result.size)
+    # bt2r links are on the volume of the sha256 file
+    file_bt2r_store_path = get_file_store_path(bt2_root_hash, "bt2r", get_volume_prefix(file_sha256_store_path))
+    if not os.path.lexists(file_bt2r_store_path):
+        try:
+            create_relative_symlink(file_sha256_store_path, file_bt2r_store_path)
+        except FileExistsError:
+            # created by another thread
+            pass
+
+    return ingest_result
+
+
+CompletionJob = collections.namedtuple(
+    "CompletionJob",
+    ["file_path", "file_size", "file_bt2r_hash", "ingest_result", "completed_files", "file_idx"],
+)
+
+
+def complete_file(completion_queue, job):
+    """
+    move a completed file to the sha256 store
+
+    this runs in a worker thread of the completion queue
+    """
+    file_path = job.file_path
+
+    print(f"file completed: making file read-only: {repr(file_path)}")
+    with completion_queue.stage("chmod"):
+        os.chmod(file_path, 0o444)
+
+    # verify file size
+    print(f"file completed: checking file size")
+    with completion_queue.stage("stat"):
+        file_size_actual = os.path.getsize(file_path)
+        # symlink or hardlink to the sha256 store
+        file_is_link = materialize.is_materialized(file_path)
+    # TODO better
+    assert file_size_actual == job.file_size
+
+    if not file_is_link and job.ingest_result == None and job.file_bt2r_hash != None and store_bt2r_table != None:
+        # libtorrent has verified the file with its bt2 root hash,
+        # so a file with the same bt2 root hash and size in the sha256 store has the same data.
+        # dont read the file again: reflinks from an older session, or duplicate downloads
+        with completion_queue.stage("stat"):
+            file_sha256_store_path = None
+            table_entry = store_bt2r_table.get(bytes.fromhex(job.file_bt2r_hash))
+            if table_entry != None and table_entry.size == job.file_size:
+                file_sha256_store_path = find_file_store_path(table_entry.sha256.hex())
+        if file_sha256_store_path != None:
+            print(f"file completed: file exists in sha256 store: {repr(file_sha256_store_path)}")
+            with completion_queue.stage("store"):
+                os.unlink(file_path)
+                materialize_store_file(file_sha256_store_path, file_path)
+            file_is_link = True
+
+    if not file_is_link:
+        # keep all symlinks and hardlinks
+        # move only regular files to the sha256 store
+
+        ingest_result = job.ingest_result
+        if ingest_result == None:
+            # hash in the hash pool, to limit parallel reads per device
+            with completion_queue.stage("hash"):
+                ingest_result = store_hash_pool.submit(hashing.hash_file, file_path, v1_piece_lengths=get_v1_piece_lengths()).result()
+
+        with completion_queue.stage("store"):
+            ingest_file(file_path, job.file_bt2r_hash, ingest_result)
+
+    # dont complete this file again
+    job.completed_files.set_completed(job.file_idx)
+
+
+def get_torrent_completed_files(h, torrent_info):
+    """
+    return the CompletedFiles of a torrent
+    """
+    torrent_completed = torrent_completed_files.get(h)
+    if torrent_completed == None:
+        torrent_completed = torrent_completed_files[h] = completed_files.CompletedFiles(
+            torrent_info.files().num_files(),
+            resume_completed_files.pop(torrent_info.name(), None),
+        )
+    return torrent_completed
+
+
+def ingest_inflight_files(h, inflight_hasher):
+    """
+    ingest completed files of a torrent that were hashed while downloading
+
+    files that were not hashed completely are hashed from disk
+    """
+    inflight_files = inflight_ingest_files.get(h)
+    if not inflight_files:
+        return
+    for file_idx, (file_path, file_bt2r_hash, file_size) in list(inflight_files.items()):
+        ingest_result = inflight_hasher.pop_result(file_idx, file_size)
+        if ingest_result == None:
+            if not inflight_hasher.is_failed(file_idx) and inflight_hasher.num_pending_reads > 0:
+                # wait for more read_piece_alert
+                continue
+            # some pieces were not hashed,
+            # for example when the torrent was started with existing files
+            print(f"ingest_inflight_files: file {file_idx} was not hashed completely, hashing from disk")
+            inflight_hasher.drop_file(file_idx)
+        del inflight_files[file_idx]
+        store_completion_queue.put(CompletionJob(file_path, file_size, file_bt2r_hash, ingest_result, torrent_completed_files[h], file_idx), file_path)
 
 
 def main():
@@ -531,9 +811,20 @@ def main():
     # global state
     global store_prefix
     global las_store_prefix
+    global las_store_index
+    global store_metadata
+    global store_volumes
     global store_dirs_v1
     global store_dirs_v2
     global store_files_v2
+    global store_hash_index
+    global store_bt2r_table
+    global store_hash_pool
+    global inflight_hashers
+    global inflight_ingest_files
+    global store_completion_queue
+    global torrent_completed_files
+    global resume_completed_files
 
 
 
@@ -578,6 +869,61 @@ def main():
         help='sets HTTP proxy host and port (separated by ":")'
     )
 
+    parser.add_argument(
+        '--hash-threads', type=int, default=None,
+        help='the maximum number of threads for file hashing. default is the number of cpu cores'
+    )
+
+    parser.add_argument(
+        '--hash-threads-per-device', type=int, default=2,
+        help='the maximum number of threads for file hashing per storage device'
+    )
+
+    parser.add_argument(
+        '--hash-inflight', action='store_true', default=False,
+        help='hash files while they are downloaded, so completed files are not read again'
+    )
+
+    parser.add_argument(
+        '--completion-threads', type=int, default=2,
+        help='the number of threads that move completed files to the sha256 store'
+    )
+
+    parser.add_argument(
+        '--completion-queue-size', type=int, default=100,
+        help='the maximum number of completed files queued for the completion threads'
+    )
+
+    parser.add_argument(
+        '--cas-config', type=str, default=volumes.cas_config_path,
+        help='config file with a list of cas stores in "dirs". default: ~/.config/cas.json. without config, use cas/ in the working directory'
+    )
+
+    parser.add_argument(
+        '--min-free-space', type=float, default=volumes.default_min_free_bytes / 1e9,
+        help='the minimum free space on every cas store given in GB'
+    )
+
+    parser.add_argument(
+        '--materialize', type=str, default=None, choices=materialize.materialize_modes,
+        help='how complete files appear in torrent directories: symlink, hardlink or reflink to the sha256 store. this is stored in cas/store.json. default: symlink'
+    )
+
+    parser.add_argument(
+        '--v1-piece-hashes', action='store_true', default=None,
+        help='cache v1 piece hashes of new files in the sha256 store, to find files of v1 torrents faster. this is stored in cas/store.json'
+    )
+
+    parser.add_argument(
+        '--no-v1-piece-hashes', dest='v1_piece_hashes', action='store_false',
+        help='dont cache v1 piece hashes of new files'
+    )
+
+    parser.add_argument(
+        '--rescan-store', action='store_true',
+        help='scan the sha256 store for files that were added or removed by other apps, and update the hash index and the bt2r store'
+    )
+
     parser.add_argument(
         'torrent_file',
         nargs='*',
@@ -618,13 +964,67 @@ def main():
     alerts_log = []
 
     # init global state
-    store_prefix = os.path.join(os.getcwd(), "cas")
+    store_prefix_list = volumes.read_cas_config_dirs(options.cas_config)
+    if store_prefix_list == None:
+        store_prefix_list = [os.path.join(os.getcwd(), "cas")]
+    store_volumes = volumes.VolumeManager(store_prefix_list, int(options.min_free_space * 1e9))
+    # the primary volume has the hash index
+    store_prefix = store_volumes.primary.store_prefix
     print("main: store_prefix:", store_prefix)
+    for volume in store_volumes.volumes[1:]:
+        print("main: more store_prefix:", volume.store_prefix)
     las_store_prefix = os.path.join(os.getcwd(), "las")
     print("main: las_store_prefix:", las_store_prefix)
+    las_store_index = las_index.LasIndex(las_store_prefix)
+    las_store_index.load()
+    print(f"main: loaded {len(las_store_index)} las paths")
+    if os.path.exists(os.path.join(store_prefix, reshard.reshard_state_file_name)):
+        raise Exception(f"store is being resharded. finish the reshard first: python3 -m cas_torrent.reshard {' '.join(store_prefix_list)}")
+    store_metadata = store_config.read_store_config(store_prefix)
+    for volume in store_volumes:
+        if not os.path.exists(os.path.join(volume.store_prefix, store_config.store_config_file_name)):
+            # record the layout of new and old stores
+            store_config.write_store_config(volume.store_prefix, store_metadata)
+            continue
+        volume_metadata = store_config.read_store_config(volume.store_prefix)
+        if (volume_metadata["shard_depth"], volume_metadata["shard_width"]) != (store_metadata["shard_depth"], store_metadata["shard_width"]):
+            raise Exception(f"all cas stores must have the same shard layout. reshard {volume.store_prefix}")
+    if options.materialize != None and options.materialize != store_metadata["materialize"]:
+        # existing links are not changed
+        store_metadata["materialize"] = options.materialize
+        for volume in store_volumes:
+            volume_metadata = store_config.read_store_config(volume.store_prefix)
+            volume_metadata["materialize"] = options.materialize
+            store_config.write_store_config(volume.store_prefix, volume_metadata)
+    print(f"main: materialize files as {store_metadata['materialize']}")
+    if options.v1_piece_hashes != None:
+        v1_piece_lengths = v1_pieces.default_v1_piece_lengths if options.v1_piece_hashes else []
+        store_metadata["v1_piece_lengths"] = v1_piece_lengths
+        for volume in store_volumes:
+            volume_metadata = store_config.read_store_config(volume.store_prefix)
+            volume_metadata["v1_piece_lengths"] = v1_piece_lengths
+            store_config.write_store_config(volume.store_prefix, volume_metadata)
+    if store_metadata["v1_piece_lengths"]:
+        print(f"main: caching v1 piece hashes for piece lengths {store_metadata['v1_piece_lengths']}")
+    print(f"main: shard layout: depth {store_metadata['shard_depth']} width {store_metadata['shard_width']}")
     store_dirs_v1 = set()
     store_dirs_v2 = set()
     store_files_v2 = set()
+    store_hash_index = hash_index.HashIndex(os.path.join(store_prefix, "index.sqlite"))
+    store_bt2r_table = bt2r_table.Bt2rTable(os.path.join(store_prefix, "bt2r.table"))
+    if not store_bt2r_table.exists():
+        print("main: building bt2r table from hash index")
+        store_bt2r_table.rebuild(store_hash_index.iter_bt2_roots())
+    store_hash_pool = hash_pool.HashPool(options.hash_threads, options.hash_threads_per_device)
+    inflight_hashers = {}
+    inflight_ingest_files = {}
+    store_completion_queue = completion_queue.CompletionQueue(complete_file, options.completion_threads, options.completion_queue_size)
+    torrent_completed_files = {}
+    resume_completed_files = {}
+
+    if options.rescan_store or not store_hash_index.has_scanned_dirs():
+        # populate the bt2r store from the sha256 store
+        populate_bt2r_store()
 
     for f in (options.torrent_files or []):
         add_torrent(ses, f, options)
@@ -697,7 +1097,8 @@ def main():
                     hashid = info_hash_v2
                     # "".join(map(lambda n: str(n % 10), range(1, 65)))
                     # cas/bt2/12/34/567890123456789012345678901234567890123456789012345678901234
-                    v2_store_path = get_store_path_from_hashes(None, hashid)
+                    # keep the torrent on its volume
+                    v2_store_path = get_store_path_from_hashes(None, hashid, get_volume_prefix(t.save_path))
                     print("v2 store path:", v2_store_path)
                     store_path = v2_store_path
 
@@ -739,7 +1140,7 @@ def main():
                     hashid = str(t.info_hashes.v1)
                     # "".join(map(lambda n: str(n % 10), range(1, 41)))
                     # cas/bt1/12/34/567890123456789012345678901234567890
-                    v1_store_path = get_store_path_from_hashes(hashid, None)
+                    v1_store_path = get_store_path_from_hashes(hashid, None, get_volume_prefix(t.save_path))
                     print("v1 store path:", v1_store_path)
 
                     # prefer v2_store_path
@@ -796,7 +1197,7 @@ def main():
                             continue
                         file_path = os.path.join(store_path, file_storage.file_path(file_idx))
                         file_bt2r_hash = str(file_storage.root(file_idx))
-                        file_bt2r_store_path = get_file_store_path(file_bt2r_hash, "bt2r")
+                        file_bt2r_store_path = find_file_store_path(file_bt2r_hash, "bt2r")
                         if False:
                             print(f"file {file_idx} path:", file_path)
                             print(f"file {file_idx} root:", file_storage.root(file_idx))
@@ -804,9 +1205,11 @@ def main():
                             #print(f"file {file_idx} flags:", file_flags)
                             #print(f"file {file_idx} hash:", file_storage.hash(file_idx))
 
-                        if os.path.exists(file_bt2r_store_path) and not os.path.exists(file_path):
-                            # FIXME readlink file_bt2r_store_path to create symlink to sha256 store
-                            create_relative_symlink(file_bt2r_store_path, file_path)
+                        if file_bt2r_store_path != None and os.path.exists(file_bt2r_store_path) and not os.path.lexists(file_path):
+                            # link to the sha256 store, not to the bt2r store
+                            materialize_store_file(os.path.realpath(file_bt2r_store_path), file_path)
+                            # dont hash the file again in complete_file
+                            get_torrent_completed_files(h, torrent_info).set_completed(file_idx)
 
 
             out += 'name: %-40s\n' % t.name[:40]
@@ -848,6 +1251,34 @@ def main():
                 h.set_max_connections(60)
                 h.set_max_uploads(-1)
                 torrents[h] = h.status()
+                if options.hash_inflight:
+                    inflight_hashers[h] = hashing.InflightHasher(v1_piece_lengths=get_v1_piece_lengths())
+
+            if isinstance(a, lt.piece_finished_alert) and a.handle in inflight_hashers:
+                # hash files while they are downloaded
+                # read the verified piece, the data is returned in read_piece_alert
+                inflight_hashers[a.handle].num_pending_reads += 1
+                a.handle.read_piece(a.piece_index)
+
+            if isinstance(a, lt.read_piece_alert) and a.handle in inflight_hashers:
+                h = a.handle
+                inflight_hasher = inflight_hashers[h]
+                inflight_hasher.num_pending_reads -= 1
+                file_storage = h.get_torrent_info().files()
+                piece_data = memoryview(a.buffer)
+                piece_offset = 0
+                for file_slice in file_storage.map_block(a.piece, 0, a.size):
+                    file_idx = file_slice.file_index
+                    if file_storage.file_flags(file_idx) & 1 == 1:
+                        # pad file
+                        pass
+                    elif a.error.value() != 0:
+                        print(f"read_piece_alert: failed to read piece {a.piece}: {a.error.message()}")
+                        inflight_hasher.drop_file(file_idx)
+                    else:
+                        inflight_hasher.add_file_data(file_idx, file_slice.offset, piece_data[piece_offset:piece_offset + file_slice.size])
+                    piece_offset += file_slice.size
+                ingest_inflight_files(h, inflight_hasher)
 
             if isinstance(a, lt.metadata_received_alert):
                 # https://www.libtorrent.org/reference-Torrent_Handle.html
@@ -881,12 +1312,18 @@ def main():
                 store_path = h.save_path()
                 print("store_path:", store_path)
 
+                if isinstance(a, lt.torrent_finished_alert):
+                    # all files are allocated
+                    store_volumes.release(store_path)
+
                 # get file_storage
                 torrent_info = h.get_torrent_info()
                 file_storage = torrent_info.files()
 
                 file_idx_list = None
 
+                torrent_completed = get_torrent_completed_files(h, torrent_info)
+
                 if isinstance(a, lt.file_completed_alert):
                     # one file
                     file_idx = a.index
@@ -896,12 +1333,18 @@ def main():
                     print("torrent finished. moving all files to the sha256 files store")
                     file_idx_list = range(file_storage.num_files())
 
+                # skip files that were completed before
+                file_idx_list = torrent_completed.iter_missing(file_idx_list)
+
+                inflight_hasher = inflight_hashers.get(h)
+
                 for file_idx in file_idx_list:
 
                     file_flags = file_storage.file_flags(file_idx)
 
                     # skip pad files
                     if file_flags & 1 == 1:
+                        torrent_completed.set_completed(file_idx)
                         continue
 
                     print("file completed: id:", file_idx)
@@ -910,61 +1353,27 @@ def main():
                     file_path = os.path.join(store_path, file_storage.file_path(file_idx))
                     print("file completed: path:", file_path)
                     # https://www.libtorrent.org/reference-Alerts.html#file-completed-alert
-                    # TODO move file to the sha256 files store
-                    # then create symlinks to other stores
-                    # os.symlink(
-                    #create_relative_symlink(file_store_path, file_path)
-
-                    print(f"file completed: making file read-only: {repr(file_path)}")
-                    os.chmod(file_path, 0o444)
 
-                    # verify file size
-                    print(f"file completed: checking file size")
-                    file_size_actual = os.path.getsize(file_path)
                     file_size = file_storage.file_size(file_idx)
-                    # TODO better
-                    assert file_size_actual == file_size
 
-                    if os.path.islink(file_path):
-                        # keep all symlinks
-                        # move only regular files to the sha256 store
+                    # TODO avoid str()
+                    file_bt2r_hash = str(file_storage.root(file_idx))
+                    if is_empty_hash(file_bt2r_hash):
+                        # v1-only torrent
+                        file_bt2r_hash = None
+
+                    if inflight_hasher != None and not inflight_hasher.is_failed(file_idx):
+                        # the file was hashed while it was downloaded
+                        # wait for the last read_piece_alert
+                        inflight_files = inflight_ingest_files.setdefault(h, {})
+                        inflight_files[file_idx] = (file_path, file_bt2r_hash, file_size)
                         continue
 
-                    # move file
-                    file_sha256 = get_sha256_of_path(file_path).hex()
-                    file_sha256_store_path = get_file_store_path(file_sha256)
-
-                    # FIXME handle truncated SHA-256 hashes https://blog.libtorrent.org/2020/09/bittorrent-v2/
+                    # move the file to the sha256 store in a worker thread
+                    store_completion_queue.put(CompletionJob(file_path, file_size, file_bt2r_hash, None, torrent_completed, file_idx), file_path)
 
-                    #print(f"file {file_idx} hash:", file_storage.hash(file_idx))
-
-                    if os.path.exists(file_sha256_store_path):
-                        # file exists in sha256 store
-                        # delete duplicate file in torrent store
-                        print("file completed: file exists in sha256 store:", file_sha256_store_path)
-                        os.unlink(file_path)
-                    else:
-                        # move file from torrent to store
-                        print(f"file completed: moving file from {repr(file_path)} to {repr(file_sha256_store_path)}")
-                        os.makedirs(os.path.dirname(file_sha256_store_path), exist_ok=True)
-                        os.rename(file_path, file_sha256_store_path)
-
-                    # TODO better
-                    assert os.path.exists(file_sha256_store_path) == True
-                    assert os.path.exists(file_path) == False
-
-                    # create symlink from torrent to sha256 file store
-                    create_relative_symlink(file_sha256_store_path, file_path)
-
-                    # create symlink from root hash to sha256 file store
-                    # FIXME handle v1-only torrents
-                    # TODO verify root hash
-                    # note: file_bt2r_hash != file_sha256
-                    file_bt2r_hash = str(file_storage.root(file_idx))
-                    # TODO better check for v2 torrents
-                    if not is_empty_hash(file_bt2r_hash):
-                        file_bt2r_store_path = get_file_store_path(file_bt2r_hash, "bt2r")
-                        create_relative_symlink(file_store_path, file_bt2r_store_path)
+                if inflight_hasher != None:
+                    ingest_inflight_files(h, inflight_hasher)
 
 
 
@@ -1031,6 +1440,13 @@ def main():
 
         print("-" * 80)
 
+        # move completed files from the backlog to the completion queue
+        store_completion_queue.flush()
+        if not store_completion_queue.is_idle():
+            print(store_completion_queue.format_stats())
+            print(store_hash_pool.format_stats())
+            print(store_volumes.format_stats())
+
         time.sleep(5)
         #c = console.sleep_and_input(0.5)
         c = None
@@ -1052,6 +1468,11 @@ def main():
                 h.resume()
 
     ses.pause()
+
+    # finish moving completed files
+    store_completion_queue.shutdown()
+    store_bt2r_table.close()
+
     for h, t in torrents.items():
         if not h.is_valid() or not t.has_metadata:
             continue
@@ -1064,6 +1485,8 @@ def main():
                 print(a)
                 data = lt.write_resume_data_buf(a.params)
                 h = a.handle
+                if h in torrent_completed_files:
+                    data = completed_files.add_to_resume_data(data, torrent_completed_files[h])
                 # https://www.libtorrent.org/reference-Torrent_Handle.html
                 if h in torrents:
                     open(os.path.join(options.save_path, torrents[h].name + '.fastresume'), 'wb').write(data)
@@ -1078,4 +1501,5 @@ def main():
         time.sleep(0.5)
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# completed files of a torrent
+
+# every file of a torrent is moved to the sha256 store only once.
+# a bitmap of completed files is stored in the resume data,
+# so torrent_finished_alert and restarts dont check all files again
+
+# libtorrent ignores unknown keys in resume data
+
+import threading
+
+from . import torrent_parser
+
+
+resume_data_key = "cas_torrent completed files"
+
+
+class CompletedFiles(object):
+    """
+    bitmap of completed file indices of one torrent
+
+    the bitmap is shared between the alert loop and the completion threads
+    """
+
+    def __init__(self, num_files, bitmap=None):
+        self._num_files = num_files
+        self._bitmap = bytearray((num_files + 7) // 8)
+        if bitmap != None and len(bitmap) == len(self._bitmap):
+            self._bitmap[:] = bitmap
+        self._lock = threading.Lock()
+
+    @property
+    def num_files(self):
+        return self._num_files
+
+    def is_completed(self, file_idx):
+        return self._bitmap[file_idx >> 3] & (1 << (file_idx & 7)) != 0
+
+    def set_completed(self, file_idx):
+        with self._lock:
+            self._bitmap[file_idx >> 3] |= 1 << (file_idx & 7)
+
+    def iter_missing(self, file_idx_list=None):
+        """
+        yield file indices that are not completed
+        """
+        if file_idx_list == None:
+            file_idx_list = range(self._num_files)
+        bitmap = self._bitmap
+        for file_idx in file_idx_list:
+            if bitmap[file_idx >> 3] == 0xff:
+                continue
+            if bitmap[file_idx >> 3] & (1 << (file_idx & 7)) == 0:
+                yield file_idx
+
+    def to_bytes(self):
+        with self._lock:
+            return bytes(self._bitmap)
+
+
+def read_from_resume_data(resume_data):
+    """
+    get the bitmap of completed files from resume data, or None
+    """
+    try:
+        data = _decode_resume_data(resume_data)
+    except torrent_parser.InvalidTorrentDataException:
+        return None
+    if not isinstance(data, dict):
+        return None
+    return data.get(resume_data_key)
+
+
+def _decode_resume_data(resume_data):
+    # the bitmap is a hash field, so it is not decoded as string
+    return torrent_parser.decode(
+        resume_data,
+        errors="usebytes",
+        hash_fields={resume_data_key: (1, False)},
+        hash_raw=True,
+    )
+
+
+def add_to_resume_data(resume_data, completed_files):
+    """
+    add the bitmap of completed files to resume data
+
+    return the new resume data
+    """
+    data = _decode_resume_data(resume_data)
+    data[resume_data_key] = completed_files.to_bytes()
+    # bencode dicts are sorted by key
+    data = {
+        key: data[key]
+        for key in sorted(data, key=lambda key: key.encode("utf-8") if isinstance(key, str) else key)
+    }
+    return torrent_parser.encode(data)
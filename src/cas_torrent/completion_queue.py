@@ -0,0 +1,171 @@
+# asynchronous completion pipeline
+
+# completed files are moved to the sha256 store by worker threads,
+# so the alert loop does not block on disk io.
+# the alert loop must keep calling ses.pop_alerts,
+# otherwise alerts are dropped and status updates stall
+
+# backpressure: the queue of the worker threads is bounded.
+# when it is full, new jobs wait in a backlog
+# that is moved to the queue on every call of flush
+
+import time
+import queue
+import threading
+import traceback
+import contextlib
+import collections
+
+
+StageStats = collections.namedtuple(
+    "StageStats",
+    ["count", "total_seconds", "max_seconds"],
+)
+
+
+class CompletionQueue(object):
+    """
+    worker threads for completed files
+
+    handle_job(completion_queue, job) is called in a worker thread.
+    it can measure the latency of its stages with completion_queue.stage(name)
+    """
+
+    def __init__(self, handle_job, num_threads=2, max_queue_size=100):
+        self._handle_job = handle_job
+        self._queue = queue.Queue(max_queue_size)
+        self._backlog = collections.deque()
+        # keys of queued and running jobs
+        self._active_keys = set()
+        self._lock = threading.Lock()
+        # map stage name to [count, total_seconds, max_seconds]
+        self._stage_stats = {}
+        self._num_done = 0
+        self._num_failed = 0
+        self._threads = []
+        for thread_idx in range(max(1, num_threads)):
+            thread = threading.Thread(
+                target=self._worker,
+                name=f"completion_queue_{thread_idx}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, job, key=None):
+        """
+        add a job. never blocks
+
+        key: ignore the job when a job with the same key is queued or running,
+          for example the file path
+        """
+        if key != None:
+            with self._lock:
+                if key in self._active_keys:
+                    return False
+                self._active_keys.add(key)
+        # keep the order of jobs
+        self._backlog.append((time.monotonic(), key, job))
+        self.flush()
+        return True
+
+    def flush(self):
+        """
+        move jobs from the backlog to the queue, as long as the queue has space.
+        call this from the alert loop
+        """
+        while self._backlog:
+            try:
+                self._queue.put_nowait(self._backlog[0])
+            except queue.Full:
+                return
+            self._backlog.popleft()
+
+    @property
+    def backlog_size(self):
+        return len(self._backlog)
+
+    @property
+    def queue_size(self):
+        return self._queue.qsize()
+
+    def is_idle(self):
+        return not self._backlog and self._queue.unfinished_tasks == 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        measure the latency of a stage of a job
+        """
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self._add_stage_time(name, time.monotonic() - start_time)
+
+    def _add_stage_time(self, name, seconds):
+        with self._lock:
+            stats = self._stage_stats.get(name)
+            if stats == None:
+                stats = self._stage_stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def get_stage_stats(self):
+        with self._lock:
+            return {
+                name: StageStats(*stats)
+                for name, stats in self._stage_stats.items()
+            }
+
+    def format_stats(self):
+        out = (
+            f"completion queue: done {self._num_done} failed {self._num_failed} "
+            f"queued {self.queue_size} backlog {self.backlog_size}"
+        )
+        for name, stats in self.get_stage_stats().items():
+            out += (
+                f"\n  {name:8s} count {stats.count} "
+                f"avg {stats.total_seconds / stats.count * 1000:.1f}ms "
+                f"max {stats.max_seconds * 1000:.1f}ms"
+            )
+        return out
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            put_time, key, job = item
+            # time in backlog and queue
+            self._add_stage_time("wait", time.monotonic() - put_time)
+            try:
+                with self.stage("total"):
+                    self._handle_job(self, job)
+                with self._lock:
+                    self._num_done += 1
+            except Exception:
+                print(f"completion queue: job failed: {job}")
+                traceback.print_exc()
+                with self._lock:
+                    self._num_failed += 1
+            finally:
+                if key != None:
+                    with self._lock:
+                        self._active_keys.discard(key)
+                self._queue.task_done()
+
+    def shutdown(self):
+        """
+        finish all jobs and stop the worker threads
+        """
+        while self._backlog:
+            self.flush()
+            time.sleep(0.1)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -0,0 +1,150 @@
+# flat list of the files of a torrent
+
+# the v2 "file tree" is a tree of nested dicts,
+# the v1 "files" is a list of dicts with path lists,
+# and single file torrents have only "name" and "length".
+# the store and las passes of add_torrent and find_v1_complete_files
+# need the same things of every file: path, length and pieces root,
+# so the file list is built once per torrent, in parallel arrays.
+# every path component is stored once, paths are lists of name ids.
+# pieces roots are stored in one bytes object, 32 bytes per file
+
+import array
+
+
+pieces_root_size = 32
+
+# files without pieces root: empty files of v2 torrents
+empty_pieces_root = bytes(pieces_root_size)
+
+# BEP 47 padding files
+flag_pad = 1
+
+
+class FileList(object):
+    """
+    files of a torrent, in parallel arrays
+
+    file paths start with the torrent name.
+    file indices are in the order of "file tree" or "files"
+    """
+
+    __slots__ = ("names", "path_offsets", "path_ids", "lengths", "flags", "pieces_roots")
+
+    def __init__(self, names, path_offsets, path_ids, lengths, flags, pieces_roots):
+        # path components
+        self.names = names
+        # the path of file i is path_ids[path_offsets[i]:path_offsets[i + 1]]
+        self.path_offsets = path_offsets
+        self.path_ids = path_ids
+        self.lengths = lengths
+        self.flags = flags
+        # raw hashes (hash_raw=True), 32 bytes per file, or None for v1 torrents
+        self.pieces_roots = pieces_roots
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def is_v2(self):
+        return self.pieces_roots != None
+
+    def get_path(self, file_idx):
+        """
+        return the file path as list of path components
+        """
+        names = self.names
+        path_ids = self.path_ids[self.path_offsets[file_idx]:self.path_offsets[file_idx + 1]]
+        return [names[name_id] for name_id in path_ids]
+
+    def get_pieces_root(self, file_idx):
+        """
+        return the pieces root of a file, or None for v1 torrents and empty files
+        """
+        if self.pieces_roots == None:
+            return None
+        offset = file_idx * pieces_root_size
+        pieces_root = self.pieces_roots[offset:offset + pieces_root_size]
+        if pieces_root == empty_pieces_root:
+            return None
+        return pieces_root
+
+    def is_pad_file(self, file_idx):
+        return self.flags[file_idx] & flag_pad != 0
+
+    def get_total_size(self):
+        return sum(self.lengths)
+
+
+def get_file_list(info):
+    """
+    build the FileList of a torrent from its info dict
+
+    v2 and hybrid torrents use "file tree".
+    v1 torrents use "files", or "length" for single file torrents
+    """
+    names = []
+    name_ids = {}
+    path_offsets = array.array("Q", [0])
+    path_ids = array.array("I")
+    lengths = array.array("Q")
+    flags = array.array("B")
+    pieces_roots = None
+
+    def get_name_id(name):
+        name_id = name_ids.get(name)
+        if name_id == None:
+            name_id = name_ids[name] = len(names)
+            names.append(name)
+        return name_id
+
+    def add_file(length, flag=0):
+        path_offsets.append(len(path_ids))
+        lengths.append(length)
+        flags.append(flag)
+
+    torrent_name_id = get_name_id(info["name"])
+
+    if "file tree" in info:
+        pieces_roots = bytearray()
+        file_tree = info["file tree"]
+        # note: dir_path_ids[0] == torrent_name_id
+        dir_path_ids = [torrent_name_id]
+        if len(file_tree) == 1 and "" in file_tree.get(info["name"], {}):
+            # single file torrent: the file is "name", not "name/name"
+            dir_path_ids = []
+        # depth-first, in the order of the torrent file
+        stack = [iter(file_tree.items())]
+        while stack:
+            item = next(stack[-1], None)
+            if item == None:
+                stack.pop()
+                if stack:
+                    dir_path_ids.pop()
+                continue
+            entry_name, entry = item
+            if entry_name != "":
+                # branch node == directory
+                dir_path_ids.append(get_name_id(entry_name))
+                stack.append(iter(entry.items()))
+                continue
+            # leaf node == file. the file name is the last directory
+            path_ids.extend(dir_path_ids)
+            add_file(entry["length"])
+            # empty files have no pieces root
+            pieces_roots += entry.get("pieces root") or empty_pieces_root
+        pieces_roots = bytes(pieces_roots)
+    elif "files" in info:
+        for file_entry in info["files"]:
+            path_ids.append(torrent_name_id)
+            for name in file_entry["path"]:
+                path_ids.append(get_name_id(name))
+            flag = 0
+            if "p" in file_entry.get("attr", ""):
+                flag = flag_pad
+            add_file(file_entry["length"], flag)
+    else:
+        # single file torrent
+        path_ids.append(torrent_name_id)
+        add_file(info["length"])
+
+    return FileList(names, path_offsets, path_ids, lengths, flags, pieces_roots)
@@ -0,0 +1,255 @@
+# persistent hash index of the sha256 store
+
+# populating the bt2r store needs the bt2 root hash of every file in the sha256 store.
+# hashing the whole sha256 store on every add_torrent is slow,
+# so we store the hashes in a sqlite database: cas/index.sqlite
+
+# files are identified by (dev, ino, mtime_ns, size)
+# when the file is replaced or modified, we hash it again.
+# directories are identified by mtime_ns
+# when a file is added to or removed from a directory, its mtime changes,
+# so we only scan changed directories.
+# this also finds files that were added outside of cas_torrent
+
+# cas_torrent adds files to the index when they are ingested,
+# so the sha256 store is scanned only for a new index, or with --rescan-store.
+# a scan commits all changes in one transaction, see HashIndex.batch
+
+import os
+import time
+import sqlite3
+import threading
+import contextlib
+import collections
+
+
+IndexEntry = collections.namedtuple(
+    "IndexEntry",
+    ["sha256", "size", "bt2_root", "dev", "ino", "mtime_ns", "ingest_time"],
+)
+
+
+class HashIndex(object):
+    """
+    sqlite index of files in the sha256 store
+
+    keys are raw sha256 digests (bytes)
+    """
+
+    def __init__(self, index_path):
+        self._path = index_path
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        # the index is shared between threads
+        self._lock = threading.Lock()
+        # number of open batch blocks. changes are committed when this is 0
+        self._batch_depth = 0
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._db.execute("pragma journal_mode = wal")
+        self._db.execute("pragma synchronous = normal")
+        self._db.execute("""
+            create table if not exists objects (
+                sha256 blob primary key,
+                size integer not null,
+                bt2_root blob,
+                dev integer not null,
+                ino integer not null,
+                mtime_ns integer not null,
+                ingest_time real not null
+            ) without rowid
+        """)
+        # find candidate files of v1 torrents by file size
+        self._db.execute("""
+            create index if not exists objects_size on objects (size)
+        """)
+        self._db.execute("""
+            create table if not exists dirs (
+                path text primary key,
+                mtime_ns integer not null
+            ) without rowid
+        """)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _commit(self):
+        # with self._lock
+        if self._batch_depth == 0:
+            self._db.commit()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        commit all changes at the end of the block, not per change
+
+        changes of other threads are also committed at the end of the block
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                self._commit()
+
+    def has_scanned_dirs(self):
+        """
+        return True if the sha256 store was scanned before
+        """
+        with self._lock:
+            row = self._db.execute("select 1 from dirs limit 1").fetchone()
+        return row != None
+
+    def get(self, sha256):
+        with self._lock:
+            row = self._db.execute(
+                "select * from objects where sha256 = ?", (sha256,)
+            ).fetchone()
+        if row == None:
+            return None
+        return IndexEntry(*row)
+
+    def add(self, sha256, bt2_root, stat_result, ingest_time=None):
+        """
+        add or replace an object
+
+        stat_result: os.stat of the file in the sha256 store
+        """
+        if ingest_time == None:
+            ingest_time = time.time()
+        with self._lock:
+            self._db.execute(
+                "insert or replace into objects values (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    sha256,
+                    stat_result.st_size,
+                    bt2_root,
+                    stat_result.st_dev,
+                    stat_result.st_ino,
+                    stat_result.st_mtime_ns,
+                    ingest_time,
+                ),
+            )
+            self._commit()
+
+    def remove(self, sha256):
+        with self._lock:
+            self._db.execute("delete from objects where sha256 = ?", (sha256,))
+            self._commit()
+
+    def get_by_size(self, size, limit=None):
+        """
+        get sha256 digests of all objects with this size
+        """
+        with self._lock:
+            if limit == None:
+                rows = self._db.execute(
+                    "select sha256 from objects where size = ?", (size,)
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "select sha256 from objects where size = ? limit ?", (size, limit)
+                ).fetchall()
+        return [row[0] for row in rows]
+
+    def prefix_range(self, sha256_prefix, dev=None):
+        """
+        get all sha256 digests that start with a hex prefix
+
+        dev: only get files on this device (volume)
+        """
+        start = bytes.fromhex(sha256_prefix.ljust(64, "0"))
+        end = bytes.fromhex(sha256_prefix.ljust(64, "f"))
+        with self._lock:
+            if dev == None:
+                rows = self._db.execute(
+                    "select sha256 from objects where sha256 between ? and ?", (start, end)
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "select sha256 from objects where sha256 between ? and ? and dev = ?", (start, end, dev)
+                ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_bt2_roots(self):
+        """
+        yield (bt2_root, sha256, size) of all objects with a bt2 root hash
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "select bt2_root, sha256, size from objects where bt2_root is not null"
+            ).fetchall()
+        yield from rows
+
+    def iter_objects(self):
+        """
+        yield (sha256, size, bt2_root, dev) of all objects
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "select sha256, size, bt2_root, dev from objects"
+            ).fetchall()
+        yield from rows
+
+    def is_dir_unchanged(self, dir_path, mtime_ns):
+        with self._lock:
+            row = self._db.execute(
+                "select mtime_ns from dirs where path = ?", (dir_path,)
+            ).fetchone()
+        return row != None and row[0] == mtime_ns
+
+    def set_dir_mtime(self, dir_path, mtime_ns):
+        with self._lock:
+            self._db.execute(
+                "insert or replace into dirs values (?, ?)", (dir_path, mtime_ns)
+            )
+            self._commit()
+
+    def clear_dirs(self):
+        """
+        forget all directories, so all directories are scanned again
+        """
+        with self._lock:
+            self._db.execute("delete from dirs")
+            self._commit()
+
+    def is_entry_current(self, entry, stat_result):
+        """
+        return True if the indexed entry describes the file on disk
+        """
+        return (
+            entry != None and
+            entry.size == stat_result.st_size and
+            entry.dev == stat_result.st_dev and
+            entry.ino == stat_result.st_ino and
+            entry.mtime_ns == stat_result.st_mtime_ns
+        )
+
+
+def iter_changed_dirs(index, store_path, shard_depth):
+    """
+    yield (dir_path, sha256_prefix, mtime_ns) of changed leaf directories in the sha256 store
+
+    when the caller is done with a directory,
+    it should call index.set_dir_mtime(dir_path, mtime_ns).
+    mtime_ns is read before the directory is scanned,
+    so files added while scanning are found next time
+    """
+    def walk(dir_path, sha256_prefix, depth):
+        try:
+            entries = list(os.scandir(dir_path))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if depth + 1 < shard_depth:
+                yield from walk(entry.path, sha256_prefix + entry.name, depth + 1)
+                continue
+            mtime_ns = entry.stat(follow_symlinks=False).st_mtime_ns
+            if index.is_dir_unchanged(entry.path, mtime_ns):
+                continue
+            yield entry.path, sha256_prefix + entry.name, mtime_ns
+    yield from walk(store_path, "", 0)
@@ -0,0 +1,113 @@
+# parallel file hashing
+
+# hashlib releases the GIL when hashing large buffers,
+# so threads are enough to use multiple cpu cores.
+# hashing is limited by disk reads,
+# so we limit the number of threads per device (st_dev).
+# hard drives are slow on parallel reads (seeks), ssds are fast
+
+import os
+import time
+import threading
+import concurrent.futures
+
+
+class HashPool(object):
+    """
+    thread pool for hashing files
+
+    every device (st_dev) gets its own threads,
+    so a slow device does not block hashing on other devices
+    """
+
+    def __init__(self, num_threads=None, threads_per_device=2):
+        """
+        num_threads: maximum number of hashing threads for all devices,
+          default is the number of cpu cores
+        threads_per_device: maximum number of hashing threads per device
+        """
+        if num_threads == None:
+            num_threads = os.cpu_count() or 1
+        self._threads_per_device = max(1, min(threads_per_device, num_threads))
+        self._thread_semaphore = threading.BoundedSemaphore(max(1, num_threads))
+        # map st_dev to executor
+        self._executors = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._num_files = 0
+            self._num_bytes = 0
+            self._start_time = None
+            self._end_time = None
+
+    def _get_executor(self, dev):
+        with self._lock:
+            executor = self._executors.get(dev)
+            if executor == None:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    self._threads_per_device,
+                    thread_name_prefix=f"hash_pool_dev_{dev}",
+                )
+                self._executors[dev] = executor
+            return executor
+
+    def submit(self, func, file_path, *args, **kwargs):
+        """
+        call func(file_path, *args, **kwargs) in a hashing thread
+
+        return a concurrent.futures.Future
+        """
+        stat_result = os.stat(file_path)
+        executor = self._get_executor(stat_result.st_dev)
+        with self._lock:
+            if self._start_time == None:
+                self._start_time = time.monotonic()
+        def job():
+            with self._thread_semaphore:
+                result = func(file_path, *args, **kwargs)
+            with self._lock:
+                self._num_files += 1
+                self._num_bytes += stat_result.st_size
+                self._end_time = time.monotonic()
+            return result
+        return executor.submit(job)
+
+    def map(self, func, file_path_list, *args, **kwargs):
+        """
+        hash many files in parallel
+
+        yield (file_path, result) in the order of file_path_list
+        """
+        futures = [
+            (file_path, self.submit(func, file_path, *args, **kwargs))
+            for file_path in file_path_list
+        ]
+        for file_path, future in futures:
+            yield file_path, future.result()
+
+    def get_stats(self):
+        """
+        return (num_files, num_bytes, seconds) since the last reset_stats
+        """
+        with self._lock:
+            if self._start_time == None or self._end_time == None:
+                return self._num_files, self._num_bytes, 0
+            return self._num_files, self._num_bytes, self._end_time - self._start_time
+
+    def format_stats(self):
+        num_files, num_bytes, seconds = self.get_stats()
+        if seconds <= 0:
+            return f"hashed {num_files} files"
+        return (
+            f"hashed {num_files} files, {num_bytes / 1e6:.1f} MB in {seconds:.1f} seconds: "
+            f"{num_files / seconds:.1f} files/s, {num_bytes / 1e6 / seconds:.1f} MB/s"
+        )
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors = {}
+        for executor in executors:
+            executor.shutdown(wait)
@@ -0,0 +1,435 @@
+# file hashing for the cas store
+
+# read each file only once,
+# and get all the hashes we need from that one read:
+# sha256 for the sha256 store,
+# bt2 merkle root for the bt2r store,
+# optional bt2 piece layer for a given piece length,
+# optional v1 piece hashes (sha1) for some piece lengths, see v1_pieces.py
+
+# all files are read with iter_file_chunks:
+# readinto one large reusable buffer per thread,
+# and hash 16 KiB blocks through memoryview slices of that buffer,
+# so we dont allocate a new bytes object per read.
+# we use readinto and not mmap,
+# because mmap raises SIGBUS when a file is truncated while we read it
+
+# holes in sparse files are not read:
+# we find them with SEEK_DATA, and hash them as zero blocks
+
+import os
+import errno
+import hashlib
+import threading
+import collections
+
+from . import merkle
+
+
+# must be a multiple of merkle.block_size
+read_buffer_size = 1024 * 1024
+
+_thread_local = threading.local()
+
+zero_buffer = bytes(read_buffer_size)
+
+
+def _fadvise(fd, offset, length, advice):
+    # posix_fadvise is missing on some platforms, for example macos
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+def _get_hole_size(fd, offset, file_size):
+    """
+    return the size of the hole in a sparse file at offset,
+    rounded down to full blocks
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return 0
+    try:
+        data_offset = os.lseek(fd, offset, os.SEEK_DATA)
+    except OSError as e:
+        if e.errno != errno.ENXIO:
+            # SEEK_DATA is not supported
+            return 0
+        # no more data until the end of file
+        data_offset = file_size
+    hole_size = min(data_offset, file_size) - offset
+    # the last block can be shorter, it is read normally
+    return hole_size - hole_size % merkle.block_size
+
+
+def _update_zeros(hash, size):
+    while size > 0:
+        n = min(size, len(zero_buffer))
+        hash.update(zero_buffer[:n])
+        size -= n
+
+
+def iter_file_chunks(file_path, drop_cache=False, skip_holes=False):
+    """
+    read a file sequentially
+
+    yield memoryview chunks of the reusable read buffer.
+    a chunk is only valid until the next chunk is read.
+    all chunks are full, except the last chunk,
+    so chunks are aligned to 16 KiB blocks
+
+    drop_cache: drop the file from the page cache after reading,
+      so hashing many files does not evict the page cache of other files.
+      dont drop files that are seeded now
+    skip_holes: dont read holes of sparse files,
+      yield the size of the hole as int, a multiple of 16 KiB
+    """
+    # take the buffer of this thread while we use it
+    read_buffer = getattr(_thread_local, "read_buffer", None)
+    _thread_local.read_buffer = None
+    if read_buffer == None:
+        # first use in this thread, or nested use
+        read_buffer = bytearray(read_buffer_size)
+    view = memoryview(read_buffer)
+    try:
+        # buffering=0: read directly into our buffer
+        with open(file_path, "rb", buffering=0) as f:
+            fd = f.fileno()
+            _fadvise(fd, 0, 0, getattr(os, "POSIX_FADV_SEQUENTIAL", 2))
+            if skip_holes:
+                file_size = os.fstat(fd).st_size
+            offset = 0
+            while True:
+                if skip_holes:
+                    hole_size = _get_hole_size(fd, offset, file_size)
+                    # lseek has moved the file position
+                    f.seek(offset + hole_size)
+                    if hole_size > 0:
+                        yield hole_size
+                        offset += hole_size
+                        continue
+                # fill the buffer
+                size = 0
+                while size < len(view):
+                    n = f.readinto(view[size:])
+                    if not n:
+                        break
+                    size += n
+                if size == 0:
+                    break
+                yield view[:size]
+                if drop_cache:
+                    _fadvise(fd, offset, size, getattr(os, "POSIX_FADV_DONTNEED", 4))
+                offset += size
+                if size < len(view):
+                    # end of file
+                    break
+    finally:
+        view.release()
+        _thread_local.read_buffer = read_buffer
+
+
+IngestResult = collections.namedtuple(
+    "IngestResult",
+    ["size", "sha256", "bt2_root", "piece_layer", "v1_pieces"],
+    # v1_pieces: {piece_length: concatenated sha1 digests}
+    defaults=[None],
+)
+
+
+class V1PieceHasher(object):
+    """
+    streaming sha1 piece hasher for multiple piece lengths
+
+    pieces start at offset 0 of the file.
+    the last piece can be shorter
+    """
+
+    def __init__(self, piece_lengths):
+        self._piece_lengths = sorted(piece_lengths)
+        self._hashes = {piece_length: hashlib.sha1() for piece_length in self._piece_lengths}
+        # number of bytes in the current piece
+        self._fill = {piece_length: 0 for piece_length in self._piece_lengths}
+        self._digests = {piece_length: bytearray() for piece_length in self._piece_lengths}
+        # sha1 of a zero piece, for holes
+        self._zero_digests = {}
+
+    def update(self, data):
+        data = memoryview(data)
+        for piece_length in self._piece_lengths:
+            hash = self._hashes[piece_length]
+            fill = self._fill[piece_length]
+            pos = 0
+            while pos < len(data):
+                n = min(piece_length - fill, len(data) - pos)
+                hash.update(data[pos:pos + n])
+                fill += n
+                pos += n
+                if fill == piece_length:
+                    self._digests[piece_length] += hash.digest()
+                    hash = hashlib.sha1()
+                    fill = 0
+            self._hashes[piece_length] = hash
+            self._fill[piece_length] = fill
+
+    def update_zeros(self, size):
+        for piece_length in self._piece_lengths:
+            hash = self._hashes[piece_length]
+            fill = self._fill[piece_length]
+            remain = size
+            if fill > 0:
+                # fill the current piece
+                n = min(piece_length - fill, remain)
+                _update_zeros(hash, n)
+                fill += n
+                remain -= n
+                if fill == piece_length:
+                    self._digests[piece_length] += hash.digest()
+                    hash = hashlib.sha1()
+                    fill = 0
+            if remain >= piece_length:
+                zero_digest = self._zero_digests.get(piece_length)
+                if zero_digest == None:
+                    zero_hash = hashlib.sha1()
+                    _update_zeros(zero_hash, piece_length)
+                    zero_digest = self._zero_digests[piece_length] = zero_hash.digest()
+                self._digests[piece_length] += zero_digest * (remain // piece_length)
+                remain %= piece_length
+            if remain > 0:
+                _update_zeros(hash, remain)
+                fill += remain
+            self._hashes[piece_length] = hash
+            self._fill[piece_length] = fill
+
+    def result(self):
+        """
+        return {piece_length: concatenated sha1 digests}
+        """
+        v1_pieces = {}
+        for piece_length in self._piece_lengths:
+            digests = self._digests[piece_length]
+            if self._fill[piece_length] > 0:
+                # last piece
+                digests = digests + self._hashes[piece_length].digest()
+            v1_pieces[piece_length] = bytes(digests)
+        return v1_pieces
+
+
+class IngestHasher(object):
+    """
+    streaming multi-digest hasher
+
+    feed file data in order with update, then call result
+    """
+
+    def __init__(self, piece_length=None, v1_piece_lengths=None):
+        piece_layer_level = None
+        if piece_length != None:
+            # piece length is a power of two, at least 16 KiB
+            assert piece_length >= merkle.block_size
+            assert piece_length & (piece_length - 1) == 0
+            piece_layer_level = (piece_length // merkle.block_size).bit_length() - 1
+        self._piece_length = piece_length
+        self._sha256 = hashlib.sha256()
+        self._tree = merkle.MerkleTree(piece_layer_level)
+        self._v1_hasher = None
+        if v1_piece_lengths:
+            self._v1_hasher = V1PieceHasher(v1_piece_lengths)
+        # partial 16 KiB block
+        self._block = bytearray()
+        self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def update(self, data):
+        self._sha256.update(data)
+        if self._v1_hasher != None:
+            self._v1_hasher.update(data)
+        self._size += len(data)
+        block_size = merkle.block_size
+        block = self._block
+        data = memoryview(data)
+        if block:
+            # fill the partial block
+            missing = block_size - len(block)
+            block += data[:missing]
+            data = data[missing:]
+            if len(block) < block_size:
+                return
+            self._tree.add_block(block)
+            block.clear()
+        num_blocks = len(data) // block_size
+        for i in range(0, num_blocks * block_size, block_size):
+            self._tree.add_block(data[i:i + block_size])
+        block += data[num_blocks * block_size:]
+
+    def update_zeros(self, size):
+        """
+        add size zero bytes, at a block boundary.
+        size must be a multiple of 16 KiB
+        """
+        assert not self._block
+        assert size % merkle.block_size == 0
+        _update_zeros(self._sha256, size)
+        if self._v1_hasher != None:
+            self._v1_hasher.update_zeros(size)
+        self._size += size
+        self._tree.add_zero_blocks(size // merkle.block_size)
+
+    def result(self):
+        if self._block:
+            # last block of file
+            self._tree.add_block(self._block)
+            self._block.clear()
+        piece_layer = None
+        if self._piece_length != None:
+            piece_layer = self._tree.piece_layer()
+        return IngestResult(
+            size=self._size,
+            sha256=self._sha256.digest(),
+            bt2_root=self._tree.root(),
+            piece_layer=piece_layer,
+            v1_pieces=self._v1_hasher.result() if self._v1_hasher != None else None,
+        )
+
+
+def hash_file(file_path, piece_length=None, drop_cache=False, v1_piece_lengths=None):
+    """
+    get sha256, bt2 root hash and bt2 piece layer of file path
+    with one read of the file
+
+    v1_piece_lengths: also get v1 piece hashes for these piece lengths
+    """
+    hasher = IngestHasher(piece_length, v1_piece_lengths)
+    for chunk in iter_file_chunks(file_path, drop_cache, skip_holes=True):
+        if isinstance(chunk, int):
+            hasher.update_zeros(chunk)
+            continue
+        hasher.update(chunk)
+    return hasher.result()
+
+
+def get_bt2_root_hash_of_path(file_path, drop_cache=False):
+    """
+    get bittorrent v2 merkle root hash of file path
+
+    return None for empty files
+    """
+    # sha256 performance https://stackoverflow.com/questions/67355203/how-to-improve-the-speed-of-merkle-root-calculation
+    tree = merkle.MerkleTree()
+    block_size = merkle.block_size
+    for chunk in iter_file_chunks(file_path, drop_cache, skip_holes=True):
+        if isinstance(chunk, int):
+            tree.add_zero_blocks(chunk // block_size)
+            continue
+        for i in range(0, len(chunk), block_size):
+            tree.add_block(chunk[i:i + block_size])
+    return tree.root()
+
+
+# https://stackoverflow.com/questions/1131220/get-the-md5-hash-of-big-files-in-python
+def get_sha256_of_path(file_path, drop_cache=False):
+    hash = hashlib.sha256()
+    for chunk in iter_file_chunks(file_path, drop_cache, skip_holes=True):
+        if isinstance(chunk, int):
+            _update_zeros(hash, chunk)
+            continue
+        hash.update(chunk)
+    return hash.digest()
+
+
+class InflightHasher(object):
+    """
+    hash the files of one torrent while they are downloaded
+
+    feed verified piece data with add_file_data,
+    then get the hashes of complete files with pop_result,
+    so completed files dont have to be read again.
+
+    the file data must be fed in order.
+    data that arrives out of order is buffered up to max_pending_bytes.
+    when the buffer is full, the file is dropped and must be hashed from disk
+    """
+
+    def __init__(self, max_pending_bytes=64*1024*1024, v1_piece_lengths=None):
+        self._max_pending_bytes = max_pending_bytes
+        self._v1_piece_lengths = v1_piece_lengths
+        self._pending_bytes = 0
+        # map file index to IngestHasher
+        self._hashers = {}
+        # map file index to {offset: data}
+        self._pending = {}
+        # files that must be hashed from disk
+        self._failed = set()
+        # number of read_piece calls without read_piece_alert
+        self.num_pending_reads = 0
+
+    def add_file_data(self, file_idx, offset, data):
+        if file_idx in self._failed:
+            return
+        hasher = self._hashers.get(file_idx)
+        if hasher == None:
+            hasher = self._hashers[file_idx] = IngestHasher(v1_piece_lengths=self._v1_piece_lengths)
+        if offset > hasher.size:
+            # out of order, wait for the missing data
+            if self._pending_bytes + len(data) > self._max_pending_bytes:
+                print(f"InflightHasher: too much out of order data, file {file_idx} will be hashed from disk")
+                self.drop_file(file_idx)
+                return
+            self._pending.setdefault(file_idx, {})[offset] = bytes(data)
+            self._pending_bytes += len(data)
+            return
+        self._update(hasher, offset, data)
+        # feed pending data
+        pending = self._pending.get(file_idx)
+        while pending:
+            next_offset = min(pending)
+            if next_offset > hasher.size:
+                break
+            data = pending.pop(next_offset)
+            self._pending_bytes -= len(data)
+            self._update(hasher, next_offset, data)
+        if pending != None and len(pending) == 0:
+            del self._pending[file_idx]
+
+    @staticmethod
+    def _update(hasher, offset, data):
+        # skip data that was hashed before, for example a piece that was read twice
+        skip = hasher.size - offset
+        if skip >= len(data):
+            return
+        hasher.update(memoryview(data)[skip:])
+
+    def drop_file(self, file_idx):
+        self._failed.add(file_idx)
+        self._hashers.pop(file_idx, None)
+        for data in self._pending.pop(file_idx, {}).values():
+            self._pending_bytes -= len(data)
+
+    def is_failed(self, file_idx):
+        return file_idx in self._failed
+
+    def get_size(self, file_idx):
+        """
+        return the number of hashed bytes of a file
+        """
+        hasher = self._hashers.get(file_idx)
+        if hasher == None:
+            return 0
+        return hasher.size
+
+    def pop_result(self, file_idx, file_size):
+        """
+        return the IngestResult of a complete file, or None
+        """
+        if file_idx in self._failed or self.get_size(file_idx) != file_size:
+            return None
+        hasher = self._hashers.pop(file_idx, None)
+        if hasher == None:
+            # empty file
+            hasher = IngestHasher(v1_piece_lengths=self._v1_piece_lengths)
+        return hasher.result()
@@ -0,0 +1,137 @@
+# index of the las store (location-addressed store)
+
+# the las store has symlinks from file paths to the cas store.
+# two torrents can have the same file path:
+# if both paths link to the same cas path, the las path is shared (merge).
+# otherwise the new las path is renamed to "f (1).txt" or "f (2).txt" etc.
+
+# checking every las path with islink and readlink is slow
+# when adding many torrents with overlapping paths,
+# so the las store is loaded once into memory.
+# then every collision check is a dict lookup
+
+import os
+
+
+class LasIndex(object):
+    """
+    in-memory map of las path to cas path
+
+    all paths are absolute paths
+    """
+
+    def __init__(self, las_store_prefix):
+        self.las_store_prefix = las_store_prefix
+        # map las path to link target
+        # regular files in the las store map to themselves
+        self._links = {}
+        self._dirs = set([las_store_prefix])
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, las_path):
+        return las_path in self._links or las_path in self._dirs
+
+    def load(self):
+        """
+        load all links of the las store
+        """
+        self._links.clear()
+        self._dirs = set([self.las_store_prefix])
+        dir_stack = [self.las_store_prefix]
+        while dir_stack:
+            dir_path = dir_stack.pop()
+            try:
+                dir_iter = os.scandir(dir_path)
+            except FileNotFoundError:
+                continue
+            with dir_iter:
+                for entry in dir_iter:
+                    if entry.is_symlink():
+                        self._links[entry.path] = self._read_link(entry.path)
+                    elif entry.is_dir():
+                        self._dirs.add(entry.path)
+                        dir_stack.append(entry.path)
+                    else:
+                        self._links[entry.path] = entry.path
+
+    def load_path(self, las_path):
+        """
+        reload one las path from disk
+        """
+        self._links.pop(las_path, None)
+        self._dirs.discard(las_path)
+        if os.path.islink(las_path):
+            self._links[las_path] = self._read_link(las_path)
+        elif os.path.isdir(las_path):
+            self._dirs.add(las_path)
+        elif os.path.exists(las_path):
+            self._links[las_path] = las_path
+
+    def _read_link(self, las_path):
+        # dont resolve symlinks in the cas store, only remove "x/../"
+        return os.path.abspath(os.path.join(os.path.dirname(las_path), os.readlink(las_path)))
+
+    def get(self, las_path):
+        return self._links.get(las_path)
+
+    def add(self, las_path, cas_path):
+        self._links[las_path] = cas_path
+        dir_path = os.path.dirname(las_path)
+        while dir_path not in self._dirs:
+            self._dirs.add(dir_path)
+            dir_path = os.path.dirname(dir_path)
+
+    def remove(self, las_path):
+        self._links.pop(las_path, None)
+
+    def is_same_file(self, cas_path, other_cas_path):
+        """
+        return True if both cas paths have the same content
+        """
+        if cas_path == other_cas_path:
+            return True
+        # different torrents can link to the same file in the sha256 store
+        # this is called only on collisions
+        return os.path.realpath(cas_path) == os.path.realpath(other_cas_path)
+
+    def find_las_path(self, las_path, cas_path_list):
+        """
+        find the las path for a file
+
+        return (las_path, exists)
+
+        if a las path links to one of the cas paths, return that las path.
+        otherwise return a free las path: the original las path,
+        or the las path with " (1)" or " (2)" or " (3)" etc before the file extension
+        """
+        dir_path, file_name = os.path.split(las_path)
+        dir_path = self._find_dir_path(dir_path)
+        file_base, file_ext = os.path.splitext(file_name)
+        las_path = os.path.join(dir_path, file_name)
+        num = 0
+        while True:
+            cas_path = self._links.get(las_path)
+            if cas_path == None and las_path not in self._dirs:
+                return las_path, False
+            if cas_path != None:
+                for other_cas_path in cas_path_list:
+                    if self.is_same_file(cas_path, other_cas_path):
+                        return las_path, True
+            num += 1
+            las_path = os.path.join(dir_path, f"{file_base} ({num}){file_ext}")
+
+    def _find_dir_path(self, dir_path):
+        # a file of one torrent can have the same path as a directory of another torrent.
+        # then the directory is renamed to "d (1)" or "d (2)" etc
+        if dir_path in self._dirs or len(dir_path) <= len(self.las_store_prefix):
+            return dir_path
+        parent_path, dir_name = os.path.split(dir_path)
+        parent_path = self._find_dir_path(parent_path)
+        dir_path = os.path.join(parent_path, dir_name)
+        num = 0
+        while dir_path in self._links:
+            num += 1
+            dir_path = os.path.join(parent_path, f"{dir_name} ({num})")
+        return dir_path
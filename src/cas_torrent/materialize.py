@@ -0,0 +1,113 @@
+# materialize files of the sha256 store in torrent directories
+
+# by default, torrent directories contain symlinks to the sha256 store.
+# some tools dont follow symlinks,
+# and every read has to resolve the symlinks.
+# so files can also be materialized as hardlinks or reflinks:
+
+# symlink: always works, also between filesystems
+# hardlink: same filesystem. the file in the torrent directory is the same inode.
+#   files in the sha256 store are read-only, so they are not modified by accident
+# reflink: same filesystem, btrfs or xfs. a copy-on-write copy, no shared inode.
+#   this uses the FICLONE ioctl, like "cp --reflink"
+
+# when a mode does not work, we fall back to the next mode:
+# reflink -> hardlink -> symlink
+
+# the mode is stored per store in cas/store.json as "materialize"
+
+import os
+import stat
+import errno
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+
+
+materialize_modes = ("symlink", "hardlink", "reflink")
+
+default_materialize_mode = "symlink"
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# errors of os.link and FICLONE when the mode is not supported
+unsupported_errnos = (
+    errno.EXDEV, # cross-device link
+    errno.EPERM,
+    errno.EMLINK, # too many links
+    errno.EOPNOTSUPP,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.ENOSYS,
+)
+
+
+def reflink(src_path, dst_path, dst_dir_fd=None):
+    """
+    create dst_path as a copy-on-write copy of src_path
+
+    dst_dir_fd: dst_path is relative to this directory
+    """
+    if fcntl == None:
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported", dst_path)
+    with open(src_path, "rb") as src_file:
+        # fail if dst_path exists
+        dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o444, dir_fd=dst_dir_fd)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_file.fileno())
+        except OSError:
+            os.close(dst_fd)
+            os.unlink(dst_path, dir_fd=dst_dir_fd)
+            raise
+        os.close(dst_fd)
+
+
+def create_relative_symlink(link_target, link_path):
+    link_target_relative = os.path.relpath(link_target, os.path.dirname(link_path))
+    os.symlink(link_target_relative, link_path)
+
+
+def materialize_file(src_path, dst_path, mode=default_materialize_mode):
+    """
+    create dst_path from a file in the sha256 store
+
+    return the used mode, which can differ from mode
+    """
+    assert mode in materialize_modes, f"unknown materialize mode: {mode}"
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    if mode == "reflink":
+        try:
+            reflink(src_path, dst_path)
+            return "reflink"
+        except OSError as e:
+            if e.errno not in unsupported_errnos:
+                raise
+        mode = "hardlink"
+    if mode == "hardlink":
+        try:
+            os.link(src_path, dst_path)
+            return "hardlink"
+        except OSError as e:
+            if e.errno not in unsupported_errnos:
+                raise
+    create_relative_symlink(src_path, dst_path)
+    return "symlink"
+
+
+def is_materialized(file_path, stat_result=None):
+    """
+    return True if the file is a symlink or a hardlink,
+    so the file is already in the sha256 store
+
+    downloaded files have only one link.
+    reflinks are not detected, they look like normal files
+    """
+    if stat_result == None:
+        stat_result = os.lstat(file_path)
+    if stat.S_ISLNK(stat_result.st_mode):
+        return True
+    return stat_result.st_nlink > 1
@@ -0,0 +1,188 @@
+# bittorrent v2 merkle trees
+# https://www.bittorrent.org/beps/bep_0052.html
+
+# the merkle tree is built from sha256 hashes of 16 KiB blocks
+# the number of leaves is padded to a power of two
+# with padding leaves of 32 zero bytes
+
+# the tree is built streaming:
+# leaves are folded into a stack with one pending node per level,
+# so memory is O(log n) for n leaves.
+# padding is never hashed leaf by leaf:
+# the hash of a padding subtree depends only on its level,
+# so we precompute one padding hash per level
+
+import hashlib
+
+
+# bittorrent v2 block size
+block_size = 16 * 1024
+
+# hash of a padding leaf
+pad_digest = b"\x00" * 32
+
+# pad_hashes[level] = root hash of a padding subtree with 2**level leaves
+pad_hashes = [pad_digest]
+
+
+def get_pad_hash(level):
+    while len(pad_hashes) <= level:
+        h = pad_hashes[-1]
+        pad_hashes.append(hashlib.sha256(h + h).digest())
+    return pad_hashes[level]
+
+
+# sparse files and padded media files have long runs of zero bytes.
+# the hash of a zero block is always the same,
+# and so is the root hash of a subtree of zero blocks
+zero_block = bytes(block_size)
+
+# zero_hashes[level] = root hash of a subtree with 2**level zero blocks
+zero_hashes = [hashlib.sha256(zero_block).digest()]
+
+
+def get_zero_hash(level):
+    while len(zero_hashes) <= level:
+        h = zero_hashes[-1]
+        zero_hashes.append(hashlib.sha256(h + h).digest())
+    return zero_hashes[level]
+
+
+def is_zero_block(block):
+    """
+    return True if block is a full block of zero bytes
+    """
+    # comparing a memoryview is slow, so compare bytes.
+    # most blocks are not zero, check a short prefix first
+    return (
+        len(block) == block_size and
+        block[:8] == zero_block[:8] and
+        bytes(block) == zero_block
+    )
+
+
+class MerkleTree(object):
+    """
+    streaming bittorrent v2 merkle tree
+
+    add leaf hashes with add_leaf, then get the root hash with root
+    """
+
+    def __init__(self, piece_layer_level=None):
+        """
+        piece_layer_level: also collect the piece layer,
+        the tree level of one piece = log2(piece_length // block_size)
+        """
+        # levels[level] = pending left node at this level, or None
+        self._levels = []
+        self._num_leaves = 0
+        self._piece_layer_level = piece_layer_level
+        self._piece_hashes = [] if piece_layer_level != None else None
+
+    @property
+    def num_leaves(self):
+        return self._num_leaves
+
+    def add_leaf(self, leaf_hash):
+        self._add_node(0, leaf_hash)
+        self._num_leaves += 1
+
+    def add_block(self, block):
+        """
+        add one block of file data, up to 16 KiB.
+        only the last block of a file can be shorter
+        """
+        if is_zero_block(block):
+            self.add_leaf(zero_hashes[0])
+            return
+        self.add_leaf(hashlib.sha256(block).digest())
+
+    def add_zero_blocks(self, count):
+        """
+        add count full blocks of zero bytes, for example a hole in a sparse file
+
+        add subtrees of zero blocks, so this is O(log count)
+        """
+        piece_layer_level = self._piece_layer_level
+        while count > 0:
+            # the largest subtree that starts at the current leaf
+            # and has at most count leaves
+            level = count.bit_length() - 1
+            if self._num_leaves > 0:
+                level = min(level, (self._num_leaves & -self._num_leaves).bit_length() - 1)
+            if piece_layer_level != None and level > piece_layer_level:
+                # _add_node adds only pieces at the piece layer level
+                num_pieces = 1 << (level - piece_layer_level)
+                self._piece_hashes.extend([get_zero_hash(piece_layer_level)] * num_pieces)
+            self._add_node(level, get_zero_hash(level))
+            self._num_leaves += 1 << level
+            count -= 1 << level
+
+    def _add_node(self, level, node):
+        levels = self._levels
+        while len(levels) < level:
+            # subtree of zero blocks
+            levels.append(None)
+        piece_layer_level = self._piece_layer_level
+        if level == piece_layer_level:
+            self._piece_hashes.append(node)
+        while level < len(levels) and levels[level] is not None:
+            node = hashlib.sha256(levels[level] + node).digest()
+            levels[level] = None
+            level += 1
+            if level == piece_layer_level:
+                self._piece_hashes.append(node)
+        if level == len(levels):
+            levels.append(node)
+        else:
+            levels[level] = node
+
+    def root(self):
+        """
+        return the merkle root hash as bytes,
+        or None for an empty tree (empty files have no root hash)
+        """
+        levels = self._levels
+        node = None
+        for level, left in enumerate(levels):
+            if node is None:
+                if left is None:
+                    continue
+                if not any(levels[level + 1:]):
+                    # the number of leaves is a power of two
+                    return left
+                # pad the right side of this subtree
+                node = hashlib.sha256(left + get_pad_hash(level)).digest()
+            elif left is None:
+                node = hashlib.sha256(node + get_pad_hash(level)).digest()
+            else:
+                node = hashlib.sha256(left + node).digest()
+        return node
+
+    def piece_layer(self):
+        """
+        return the piece layer as concatenated piece hashes,
+        or None when the file has only one piece.
+        files with only one piece have no piece layer in the torrent
+        """
+        piece_layer_level = self._piece_layer_level
+        assert piece_layer_level != None
+        if self._num_leaves <= 2**piece_layer_level:
+            return None
+        piece_hashes = self._piece_hashes
+        # the last piece can be incomplete
+        # pad it to a full subtree, but dont change our state
+        node = None
+        for level in range(piece_layer_level):
+            left = self._levels[level]
+            if node is None:
+                if left is None:
+                    continue
+                node = hashlib.sha256(left + get_pad_hash(level)).digest()
+            elif left is None:
+                node = hashlib.sha256(node + get_pad_hash(level)).digest()
+            else:
+                node = hashlib.sha256(left + node).digest()
+        if node != None:
+            piece_hashes = piece_hashes + [node]
+        return b"".join(piece_hashes)
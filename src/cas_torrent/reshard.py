@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+# change the shard layout of a cas store in place
+
+# python3 -m cas_torrent.reshard --depth 3 --width 2 cas/
+
+# all volumes must have the same layout, so they are resharded together
+# python3 -m cas_torrent.reshard --depth 3 /disk1/cas /disk2/cas
+
+# stop cas_torrent before resharding.
+# cas_torrent refuses to start while a reshard is in progress
+
+# phase 1: move entries of the hash stores (sha256, bt1, bt2, bt2r) to their new paths
+# phase 2: rewrite symlinks in the bt1, bt2, bt2r and las stores.
+#   relative symlinks are broken by moving the link or the link target.
+#   the link target is parsed from the link text:
+#   the last path component that is a hash store dir, followed by the sharded hash,
+#   followed by the path in the torrent, for example
+#   ../../../sha256/12/34/5678...
+#   ../../../../cas/bt2/12/34/5678.../torrent_name/file.txt
+#   this does not depend on the old location of the link,
+#   so both phases can be interrupted and restarted.
+#   with multiple volumes, the link target is on the volume where the new target exists
+
+# progress is stored in cas/reshard.json of the first volume
+# work is split by top-level shard directory, and done in parallel
+
+import os
+import json
+import string
+import argparse
+import threading
+import concurrent.futures
+
+from . import store_config
+from . import hash_index
+
+
+reshard_state_file_name = "reshard.json"
+
+# map store dir to hash length in hex chars
+hash_store_dirs = {
+    "sha256": 64,
+    "bt2r": 64,
+    "bt2": 64,
+    # v1 info hashes
+    "bt1": 40,
+    # v1 piece hashes of files in the sha256 store
+    "v1p": 64,
+}
+
+# stores with symlinks
+link_store_dirs = ["bt1", "bt2", "bt2r"]
+
+hex_chars = set(string.hexdigits)
+
+
+def is_hex(s):
+    return s != "" and all(c in hex_chars for c in s)
+
+
+def parse_link_target(link_target):
+    """
+    parse a link to the cas store
+
+    return (store_dir, hashid, rest) or None
+    """
+    parts = link_target.split("/")
+    for part_idx in range(len(parts) - 1, -1, -1):
+        store_dir = parts[part_idx]
+        hash_len = hash_store_dirs.get(store_dir)
+        if hash_len == None:
+            continue
+        hashid = ""
+        rest_idx = part_idx + 1
+        while rest_idx < len(parts) and len(hashid) < hash_len and is_hex(parts[rest_idx]):
+            hashid += parts[rest_idx]
+            rest_idx += 1
+        if len(hashid) != hash_len:
+            continue
+        return store_dir, hashid, parts[rest_idx:]
+    return None
+
+
+class Reshard(object):
+    """
+    reshard cas stores
+
+    store_prefix_list: all volumes. the first volume has the progress file
+    """
+
+    def __init__(self, store_prefix_list, las_store_prefix, new_config=None, num_threads=4):
+        if isinstance(store_prefix_list, str):
+            store_prefix_list = [store_prefix_list]
+        self.store_prefix_list = [os.path.abspath(store_prefix) for store_prefix in store_prefix_list]
+        self.store_prefix = self.store_prefix_list[0]
+        self.las_store_prefix = None
+        if las_store_prefix != None:
+            self.las_store_prefix = os.path.abspath(las_store_prefix)
+        self.num_threads = num_threads
+        self.state_path = os.path.join(self.store_prefix, reshard_state_file_name)
+        self._lock = threading.Lock()
+        self.num_moved = 0
+        self.num_relinked = 0
+        self.num_conflicts = 0
+        try:
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+            print(f"reshard: resuming {self.state['phase']} phase")
+            if new_config != None and (
+                new_config["shard_depth"] != self.state["to"]["shard_depth"] or
+                new_config["shard_width"] != self.state["to"]["shard_width"]
+            ):
+                raise Exception(f"reshard: a different reshard is in progress: {self.state['to']}")
+        except FileNotFoundError:
+            old_config = store_config.read_store_config(self.store_prefix)
+            if new_config == None:
+                raise Exception("reshard: no new layout")
+            config = dict(old_config)
+            config["shard_depth"] = new_config["shard_depth"]
+            config["shard_width"] = new_config["shard_width"]
+            store_config.check_store_config(config)
+            self.state = {
+                "from": old_config,
+                "to": config,
+                "phase": "move",
+                # finished units of work of the current phase
+                "done": [],
+            }
+            self._write_state()
+        self.old_config = self.state["from"]
+        self.new_config = self.state["to"]
+
+    def _write_state(self):
+        # atomic write
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.rename(tmp_path, self.state_path)
+
+    def _set_done(self, unit):
+        with self._lock:
+            self.state["done"].append(unit)
+            self._write_state()
+
+    def _set_phase(self, phase):
+        with self._lock:
+            self.state["phase"] = phase
+            self.state["done"] = []
+            self._write_state()
+
+    def run(self):
+        if self.state["phase"] == "move":
+            if self.old_config["shard_depth"] != self.new_config["shard_depth"] or self.old_config["shard_width"] != self.new_config["shard_width"]:
+                self._run_units(self._get_move_units(), self._move_unit)
+            self._set_phase("relink")
+        if self.state["phase"] == "relink":
+            self._run_units(self._get_relink_units(), self._relink_unit)
+            self._set_phase("finish")
+        # phase finish
+        for store_prefix in self.store_prefix_list:
+            store_config.write_store_config(store_prefix, self.new_config)
+        # directory paths have changed, scan all directories again.
+        # files keep their inode and mtime, so they are not hashed again
+        index_path = os.path.join(self.store_prefix, "index.sqlite")
+        if os.path.exists(index_path):
+            index = hash_index.HashIndex(index_path)
+            index.clear_dirs()
+            index.close()
+        os.unlink(self.state_path)
+        print(f"reshard: done. moved {self.num_moved} entries, relinked {self.num_relinked} symlinks, {self.num_conflicts} conflicts")
+
+    def _run_units(self, units, func):
+        done = set(self.state["done"])
+        units = [unit for unit in units if unit not in done]
+        print(f"reshard: {self.state['phase']} phase: {len(units)} directories")
+        with concurrent.futures.ThreadPoolExecutor(self.num_threads) as executor:
+            futures = [executor.submit(self._run_unit, func, unit) for unit in units]
+            for future in concurrent.futures.as_completed(futures):
+                # raise exceptions from threads
+                future.result()
+
+    def _run_unit(self, func, unit):
+        func(unit)
+        self._set_done(unit)
+
+    def _get_move_units(self):
+        # unit: "volume_idx:store_dir/top_dir"
+        old_width = self.old_config["shard_width"]
+        for volume_idx, store_prefix in enumerate(self.store_prefix_list):
+            for store_dir in hash_store_dirs:
+                store_dir_path = os.path.join(store_prefix, store_dir)
+                try:
+                    names = sorted(os.listdir(store_dir_path))
+                except FileNotFoundError:
+                    continue
+                for name in names:
+                    if len(name) == old_width and is_hex(name):
+                        yield f"{volume_idx}:{store_dir}/{name}"
+
+    def _move_unit(self, unit):
+        volume_idx, unit = unit.split(":", 1)
+        store_dir, top_name = unit.split("/")
+        hash_len = hash_store_dirs[store_dir]
+        old_depth = self.old_config["shard_depth"]
+        old_width = self.old_config["shard_width"]
+        store_dir_path = os.path.join(self.store_prefix_list[int(volume_idx)], store_dir)
+
+        def walk(dir_path, hash_prefix, depth):
+            for entry in list(os.scandir(dir_path)):
+                name = entry.name
+                if not is_hex(name):
+                    continue
+                if depth < old_depth:
+                    if len(name) == old_width and entry.is_dir(follow_symlinks=False):
+                        walk(entry.path, hash_prefix + name, depth + 1)
+                    continue
+                # leaf of the old layout
+                # new leaves and new directories have other name lengths
+                if len(hash_prefix) + len(name) != hash_len:
+                    continue
+                hashid = hash_prefix + name
+                new_path = os.path.join(store_dir_path, *store_config.get_shard(hashid, self.new_config))
+                if new_path == entry.path:
+                    continue
+                if os.path.lexists(new_path):
+                    print(f"reshard: conflict: not moving {repr(entry.path)} to existing path {repr(new_path)}")
+                    with self._lock:
+                        self.num_conflicts += 1
+                    continue
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.rename(entry.path, new_path)
+                with self._lock:
+                    self.num_moved += 1
+            # remove empty directories of the old layout
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                pass
+
+        walk(os.path.join(store_dir_path, top_name), top_name, 1)
+
+    def _get_relink_units(self):
+        # unit: "volume_idx:store_dir/top_dir" or "las/name"
+        for volume_idx, store_prefix in enumerate(self.store_prefix_list):
+            for store_dir in link_store_dirs:
+                store_dir_path = os.path.join(store_prefix, store_dir)
+                try:
+                    names = sorted(os.listdir(store_dir_path))
+                except FileNotFoundError:
+                    continue
+                for name in names:
+                    yield f"{volume_idx}:{store_dir}/{name}"
+        if self.las_store_prefix != None:
+            try:
+                names = sorted(os.listdir(self.las_store_prefix))
+            except FileNotFoundError:
+                names = []
+            for name in names:
+                yield "las/" + name
+
+    def _relink_unit(self, unit):
+        if unit.startswith("las/"):
+            path = os.path.join(self.las_store_prefix, unit[4:])
+        else:
+            volume_idx, unit = unit.split(":", 1)
+            store_dir, name = unit.split("/", 1)
+            path = os.path.join(self.store_prefix_list[int(volume_idx)], store_dir, name)
+        if os.path.islink(path):
+            self._relink(path)
+            return
+        for dir_path, dir_names, file_names in os.walk(path):
+            # os.walk does not follow symlinks to directories
+            for name in dir_names + file_names:
+                file_path = os.path.join(dir_path, name)
+                if os.path.islink(file_path):
+                    self._relink(file_path)
+
+    def _relink(self, link_path):
+        link_target = os.readlink(link_path)
+        parsed = parse_link_target(link_target)
+        if parsed == None:
+            # not a link to the cas store
+            return
+        store_dir, hashid, rest = parsed
+        new_target_in_store = os.path.join(store_dir, *store_config.get_shard(hashid, self.new_config), *rest)
+        new_target = None
+        if len(self.store_prefix_list) == 1:
+            new_target = os.path.join(self.store_prefix, new_target_in_store)
+        else:
+            for store_prefix in self.store_prefix_list:
+                if os.path.lexists(os.path.join(store_prefix, new_target_in_store)):
+                    new_target = os.path.join(store_prefix, new_target_in_store)
+                    break
+            if new_target == None:
+                print(f"reshard: not found in all volumes: link {repr(link_path)} to {repr(link_target)}")
+                return
+        if not os.path.isabs(link_target):
+            new_target = os.path.relpath(new_target, os.path.dirname(os.path.abspath(link_path)))
+        if new_target == link_target:
+            return
+        # atomic replace
+        tmp_path = link_path + ".reshard-tmp"
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        os.symlink(new_target, tmp_path)
+        os.replace(tmp_path, link_path)
+        with self._lock:
+            self.num_relinked += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="change the shard layout of a cas store",
+    )
+    parser.add_argument("store_prefix", nargs="+", help="path to the cas stores, for example cas/. the first store is the primary store")
+    parser.add_argument("--las", default=None, help="path to the las store. default: las/ next to the first cas store")
+    parser.add_argument("--depth", type=int, default=None, help="new shard depth: number of directory levels")
+    parser.add_argument("--width", type=int, default=None, help="new shard width: number of hex chars per directory level")
+    parser.add_argument("--threads", type=int, default=4, help="number of parallel threads")
+    options = parser.parse_args()
+
+    store_prefix_list = [os.path.abspath(store_prefix) for store_prefix in options.store_prefix]
+    store_prefix = store_prefix_list[0]
+    las_store_prefix = options.las
+    if las_store_prefix == None:
+        las_store_prefix = os.path.join(os.path.dirname(store_prefix), "las")
+
+    new_config = None
+    if options.depth != None or options.width != None:
+        old_config = store_config.read_store_config(store_prefix)
+        new_config = {
+            "shard_depth": options.depth if options.depth != None else old_config["shard_depth"],
+            "shard_width": options.width if options.width != None else old_config["shard_width"],
+        }
+
+    Reshard(store_prefix_list, las_store_prefix, new_config, options.threads).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+# verify files in the sha256 store
+
+# files in the sha256 store are read-only, but never hashed again.
+# bit rot on hard drives is found only when peers reject our pieces.
+# scrub hashes all files again and compares the hash with the file name
+
+# python3 -m cas_torrent.scrub cas/
+# python3 -m cas_torrent.scrub --max-bandwidth 50M /disk1/cas /disk2/cas
+
+# checks:
+# corrupted: sha256 of the file is not the file name
+# read_error: the file cannot be read
+# index_mismatch: the bt2 root hash in cas/index.sqlite is not the bt2 root hash of the file
+# bt2r_missing: the file has no link in the bt2r store
+# bt2r_conflict: the bt2r link of the file points to another file
+# bt2r_dangling: a bt2r link points to a missing file
+# bt2r_mismatch: a bt2r link name is not the bt2 root hash of its file
+
+# files are only reported, not changed.
+# a corrupted file can be downloaded again: remove it, then add the torrent again
+
+# a scrub of a large store takes days, so progress is stored in cas/scrub.json,
+# and an interrupted scrub continues where it stopped.
+# work is split by top-level shard directory, like in reshard.py.
+# volumes are scrubbed in parallel, files on one volume by --threads-per-device threads.
+# --max-bandwidth limits the read rate of all threads, so scrub can run beside seeding
+
+# the report is written to cas/scrub-report.json
+
+import os
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+
+from . import hashing
+from . import hash_pool
+from . import hash_index
+from . import store_config
+from . import reshard
+
+
+scrub_state_file_name = "scrub.json"
+
+scrub_report_file_name = "scrub-report.json"
+
+
+class BandwidthLimiter(object):
+    """
+    limit the read rate of all threads
+
+    max_bytes_per_second: 0 = no limit
+    """
+
+    def __init__(self, max_bytes_per_second=0):
+        self._rate = max_bytes_per_second
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def wait(self, num_bytes):
+        if self._rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(self._next_time, now)
+            self._next_time = start_time + num_bytes / self._rate
+        sleep_time = start_time - now
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+
+def scrub_file(file_path, limiter, drop_cache=True):
+    """
+    get sha256 and bt2 root hash of file path
+
+    return hashing.IngestResult
+    """
+    hasher = hashing.IngestHasher()
+    for chunk in hashing.iter_file_chunks(file_path, drop_cache, skip_holes=True):
+        if isinstance(chunk, int):
+            # holes are not read
+            hasher.update_zeros(chunk)
+            continue
+        limiter.wait(len(chunk))
+        hasher.update(chunk)
+    return hasher.result()
+
+
+class Scrub(object):
+    """
+    verify the sha256 and bt2r stores
+
+    store_prefix_list: all volumes. the first volume has the progress file and the hash index
+    """
+
+    def __init__(self, store_prefix_list, max_bandwidth=0, threads_per_device=2, drop_cache=True, report_path=None, restart=False):
+        if isinstance(store_prefix_list, str):
+            store_prefix_list = [store_prefix_list]
+        self.store_prefix_list = [os.path.abspath(store_prefix) for store_prefix in store_prefix_list]
+        self.store_prefix = self.store_prefix_list[0]
+        self.config = store_config.read_store_config(self.store_prefix)
+        self.drop_cache = drop_cache
+        self.report_path = report_path
+        if self.report_path == None:
+            self.report_path = os.path.join(self.store_prefix, scrub_report_file_name)
+        self.limiter = BandwidthLimiter(max_bandwidth)
+        self.hash_pool = hash_pool.HashPool(None, threads_per_device)
+        self.index = None
+        index_path = os.path.join(self.store_prefix, "index.sqlite")
+        if os.path.exists(index_path):
+            self.index = hash_index.HashIndex(index_path)
+        self.state_path = os.path.join(self.store_prefix, scrub_state_file_name)
+        self._lock = threading.Lock()
+        self.state = None
+        if not restart:
+            try:
+                with open(self.state_path) as f:
+                    self.state = json.load(f)
+                print(f"scrub: resuming scrub from {time.ctime(self.state['start_time'])}")
+            except FileNotFoundError:
+                pass
+        if self.state == None:
+            self.state = {
+                "start_time": time.time(),
+                # finished units of work
+                "done": [],
+                "num_files": 0,
+                "num_bytes": 0,
+                "errors": [],
+            }
+            self._write_state()
+
+    def _write_state(self):
+        # atomic write
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.rename(tmp_path, self.state_path)
+
+    def _set_done(self, unit, num_files, num_bytes, errors):
+        with self._lock:
+            self.state["done"].append(unit)
+            self.state["num_files"] += num_files
+            self.state["num_bytes"] += num_bytes
+            self.state["errors"] += errors
+            self._write_state()
+            num_done = len(self.state["done"])
+        for error in errors:
+            print(f"scrub: {error['kind']}: {error['path']}")
+        print(f"scrub: done {num_done} of {self._num_units} directories. {self.hash_pool.format_stats()}")
+
+    def run(self):
+        if os.path.exists(os.path.join(self.store_prefix, reshard.reshard_state_file_name)):
+            raise Exception("scrub: store is being resharded. finish the reshard first")
+        done = set(self.state["done"])
+        # map volume_idx to units
+        volume_units = {}
+        num_units = 0
+        for unit in self._get_units():
+            if unit in done:
+                continue
+            volume_idx = int(unit.split(":", 1)[0])
+            volume_units.setdefault(volume_idx, []).append(unit)
+            num_units += 1
+        self._num_units = len(done) + num_units
+        print(f"scrub: {num_units} directories in {len(volume_units)} volumes")
+        # one thread per volume
+        with concurrent.futures.ThreadPoolExecutor(max(1, len(volume_units))) as executor:
+            futures = [executor.submit(self._run_units, units) for units in volume_units.values()]
+            for future in concurrent.futures.as_completed(futures):
+                # raise exceptions from threads
+                future.result()
+        self.hash_pool.shutdown()
+        if self.index != None:
+            self.index.close()
+        self.write_report()
+        os.unlink(self.state_path)
+        print(f"scrub: done. checked {self.state['num_files']} files, {self.state['num_bytes'] / 1e6:.1f} MB, {len(self.state['errors'])} errors")
+        print(f"scrub: report: {self.report_path}")
+
+    def _run_units(self, units):
+        for unit in units:
+            volume_idx, unit_path = unit.split(":", 1)
+            store_dir, top_name = unit_path.split("/")
+            store_prefix = self.store_prefix_list[int(volume_idx)]
+            if store_dir == "sha256":
+                result = self._scrub_sha256_unit(store_prefix, top_name)
+            else:
+                result = self._check_bt2r_unit(store_prefix, top_name)
+            self._set_done(unit, *result)
+
+    def _get_units(self):
+        # unit: "volume_idx:store_dir/top_dir"
+        # all files are hashed before the bt2r links are checked
+        for store_dir in ["sha256", "bt2r"]:
+            for volume_idx, store_prefix in enumerate(self.store_prefix_list):
+                store_dir_path = os.path.join(store_prefix, store_dir)
+                try:
+                    names = sorted(os.listdir(store_dir_path))
+                except FileNotFoundError:
+                    continue
+                for name in names:
+                    if len(name) == self.config["shard_width"] and reshard.is_hex(name):
+                        yield f"{volume_idx}:{store_dir}/{name}"
+
+    def _iter_unit_files(self, store_prefix, store_dir, top_name):
+        """
+        yield (hashid, path) of all entries in a top-level shard directory
+        """
+        hash_len = reshard.hash_store_dirs[store_dir]
+        shard_depth = self.config["shard_depth"]
+        shard_width = self.config["shard_width"]
+
+        def walk(dir_path, hash_prefix, depth):
+            try:
+                entries = sorted(os.scandir(dir_path), key=lambda entry: entry.name)
+            except (FileNotFoundError, NotADirectoryError):
+                return
+            for entry in entries:
+                name = entry.name
+                if not reshard.is_hex(name):
+                    continue
+                if depth < shard_depth:
+                    if len(name) == shard_width and entry.is_dir(follow_symlinks=False):
+                        yield from walk(entry.path, hash_prefix + name, depth + 1)
+                    continue
+                if len(hash_prefix) + len(name) != hash_len:
+                    continue
+                yield hash_prefix + name, entry.path
+
+        yield from walk(os.path.join(store_prefix, store_dir, top_name), top_name, 1)
+
+    def _get_bt2r_path(self, bt2_root_hex):
+        shard = store_config.get_shard(bt2_root_hex, self.config)
+        for store_prefix in self.store_prefix_list:
+            path = os.path.join(store_prefix, "bt2r", *shard)
+            if os.path.lexists(path):
+                return path
+        return None
+
+    def _scrub_sha256_unit(self, store_prefix, top_name):
+        files = list(self._iter_unit_files(store_prefix, "sha256", top_name))
+        errors = []
+        num_bytes = 0
+
+        def scrub_one(file_path):
+            try:
+                return scrub_file(file_path, self.limiter, self.drop_cache)
+            except OSError as e:
+                return e
+
+        # HashPool.submit stats the file in this thread.
+        # files can be removed after listing, by gc or a dangling link
+        futures = []
+        for hashid, file_path in files:
+            try:
+                futures.append(self.hash_pool.submit(scrub_one, file_path))
+            except OSError as e:
+                futures.append(e)
+        for (hashid, file_path), future in zip(files, futures):
+            result = future if isinstance(future, OSError) else future.result()
+            if isinstance(result, OSError):
+                errors.append({"kind": "read_error", "path": file_path, "error": str(result)})
+                continue
+            num_bytes += result.size
+            actual = result.sha256.hex()
+            if actual != hashid:
+                errors.append({"kind": "corrupted", "path": file_path, "expected": hashid, "actual": actual})
+                continue
+            if result.bt2_root == None:
+                # empty file
+                continue
+            bt2_root_hex = result.bt2_root.hex()
+            if self.index != None:
+                entry = self.index.get(result.sha256)
+                if entry != None and entry.bt2_root != None and entry.bt2_root != result.bt2_root:
+                    errors.append({"kind": "index_mismatch", "path": file_path, "expected": bt2_root_hex, "actual": entry.bt2_root.hex()})
+            bt2r_path = self._get_bt2r_path(bt2_root_hex)
+            if bt2r_path == None:
+                errors.append({"kind": "bt2r_missing", "path": file_path, "expected": bt2_root_hex})
+                continue
+            parsed = reshard.parse_link_target(os.readlink(bt2r_path)) if os.path.islink(bt2r_path) else None
+            if parsed == None or parsed[1] != hashid:
+                errors.append({"kind": "bt2r_conflict", "path": bt2r_path, "expected": hashid, "actual": parsed[1] if parsed != None else None})
+        return len(files), num_bytes, errors
+
+    def _check_bt2r_unit(self, store_prefix, top_name):
+        errors = []
+        num_files = 0
+        for bt2_root_hex, link_path in self._iter_unit_files(store_prefix, "bt2r", top_name):
+            if not os.path.islink(link_path):
+                continue
+            num_files += 1
+            if not os.path.exists(link_path):
+                errors.append({"kind": "bt2r_dangling", "path": link_path, "actual": os.readlink(link_path)})
+                continue
+            parsed = reshard.parse_link_target(os.readlink(link_path))
+            if parsed == None or parsed[0] != "sha256" or self.index == None:
+                continue
+            # the files were verified in the sha256 phase.
+            # the index has their bt2 root hashes
+            entry = self.index.get(bytes.fromhex(parsed[1]))
+            if entry != None and entry.bt2_root != None and entry.bt2_root.hex() != bt2_root_hex:
+                errors.append({"kind": "bt2r_mismatch", "path": link_path, "expected": entry.bt2_root.hex(), "actual": bt2_root_hex})
+        return num_files, 0, errors
+
+    def write_report(self):
+        report = {
+            "store_prefix_list": self.store_prefix_list,
+            "start_time": self.state["start_time"],
+            "end_time": time.time(),
+            "num_files": self.state["num_files"],
+            "num_bytes": self.state["num_bytes"],
+            "num_errors": len(self.state["errors"]),
+            "errors": self.state["errors"],
+        }
+        # atomic write
+        tmp_path = self.report_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        os.rename(tmp_path, self.report_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="verify files in the sha256 store and links in the bt2r store",
+    )
+    parser.add_argument("store_prefix", nargs="+", help="path to the cas stores, for example cas/. the first store is the primary store")
+    parser.add_argument("--max-bandwidth", default="0", help="max read rate of all threads in bytes per second, for example 50M. default: no limit")
+    parser.add_argument("--threads-per-device", type=int, default=2, help="number of hashing threads per device")
+    parser.add_argument("--keep-cache", action="store_true", help="dont drop files from the page cache after reading")
+    parser.add_argument("--report", default=None, help=f"path of the json report. default: cas/{scrub_report_file_name}")
+    parser.add_argument("--restart", action="store_true", help=f"start a new scrub, ignore cas/{scrub_state_file_name}")
+    options = parser.parse_args()
+
+    Scrub(
+        options.store_prefix,
+        max_bandwidth=store_config.parse_size(options.max_bandwidth),
+        threads_per_device=options.threads_per_device,
+        drop_cache=not options.keep_cache,
+        report_path=options.report,
+        restart=options.restart,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
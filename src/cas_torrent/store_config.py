@@ -0,0 +1,108 @@
+# store metadata: cas/store.json
+
+# the shard layout of the cas store is stored in the store,
+# so the store can be resharded, and other tools can read the layout
+
+# shard_depth: number of directory levels
+# shard_width: number of hex chars per directory level
+# shard_depth 2 and shard_width 2:
+# cas/sha256/12/34/567890123456789012345678901234567890123456789012345678901234
+
+# with 256 * 256 leaf directories,
+# every leaf directory has about 150 entries per 10 million objects.
+# with tens of millions of objects, use shard_depth 3
+
+# materialize: how files of the sha256 store appear in torrent directories:
+# symlink, hardlink, reflink. see materialize.py
+
+# v1_piece_lengths: piece lengths of cached v1 piece hashes, see v1_pieces.py.
+# empty list: no cache
+
+import os
+import json
+
+from . import casfs_util
+from . import materialize
+
+
+store_config_file_name = "store.json"
+
+# stores without store.json were created with this layout
+default_shard_depth = 2
+default_shard_width = 2
+
+store_config_version = 1
+
+
+def parse_size(size_str):
+    """
+    parse sizes like 123, 16K, 64M, 4G
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    size_str = size_str.strip().upper().rstrip("IB")
+    if size_str and size_str[-1] in units:
+        return int(float(size_str[:-1]) * units[size_str[-1]])
+    return int(size_str)
+
+
+def get_default_store_config():
+    return {
+        "version": store_config_version,
+        "shard_depth": default_shard_depth,
+        "shard_width": default_shard_width,
+        "materialize": materialize.default_materialize_mode,
+        "v1_piece_lengths": [],
+    }
+
+
+def check_store_config(config):
+    shard_depth = config["shard_depth"]
+    shard_width = config["shard_width"]
+    if not isinstance(shard_depth, int) or not isinstance(shard_width, int):
+        raise ValueError(f"store config: shard_depth and shard_width must be integers: {config}")
+    # iter_changed_dirs needs at least one level of directories
+    # the shortest hash is a 40 chars v1 info hash
+    if shard_depth < 1 or shard_width < 1 or shard_depth * shard_width >= 40:
+        raise ValueError(f"store config: bad shard layout: depth {shard_depth} width {shard_width}")
+    if config["materialize"] not in materialize.materialize_modes:
+        raise ValueError(f"store config: unknown materialize mode: {config['materialize']}")
+    for piece_length in config["v1_piece_lengths"]:
+        # powers of two, at least 16 KiB
+        if not isinstance(piece_length, int) or piece_length < 16 * 1024 or piece_length & (piece_length - 1) != 0:
+            raise ValueError(f"store config: bad v1 piece length: {piece_length}")
+
+
+def read_store_config(store_prefix):
+    """
+    read cas/store.json
+
+    return the default config if the file does not exist
+    """
+    config = get_default_store_config()
+    store_config_path = os.path.join(store_prefix, store_config_file_name)
+    try:
+        with open(store_config_path) as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    check_store_config(config)
+    return config
+
+
+def write_store_config(store_prefix, config):
+    check_store_config(config)
+    os.makedirs(store_prefix, exist_ok=True)
+    store_config_path = os.path.join(store_prefix, store_config_file_name)
+    # atomic write
+    tmp_path = store_config_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+    os.rename(tmp_path, store_config_path)
+
+
+def get_shard(hashid, config):
+    """
+    split a hex hash into path components
+    """
+    return casfs_util.shard(hashid, config["shard_depth"], config["shard_width"])
@@ -0,0 +1,660 @@
+#!/usr/bin/env python3
+
+# garbage collector for the cas store
+
+# nothing is removed from the cas store when a torrent is removed,
+# so the store only grows. this finds and removes unreachable objects:
+# torrent directories in the bt1 and bt2 stores, files in the sha256 store,
+# and symlinks in the bt2r store
+
+# python3 -m cas_torrent.store_gc cas/
+# python3 -m cas_torrent.store_gc --quarantine cas/
+# python3 -m cas_torrent.store_gc --delete /disk1/cas /disk2/cas
+
+# without --delete or --quarantine, this only reports the reclaimable bytes
+
+# mark phase: find reachable objects
+#   roots are symlinks in the las store.
+#   las links point to torrent directories, which are reachable.
+#   bt1 symlinks to bt2 directories are reachable with their target.
+#   files in reachable torrent directories are reachable:
+#   symlinks to the sha256 store, symlinks to the bt2r store with their target,
+#   and hardlinks by (dev, ino).
+#   by default, all torrent directories are reachable,
+#   and only unused files in the sha256 store are removed.
+#   with --collect-torrents, torrent directories are reachable from las links,
+#   from the resume files of the cas_torrent session (--session),
+#   or when they are younger than --min-age.
+#   downloads have no las links until they are complete,
+#   and magnet links have no las links until the metadata is known
+# sweep phase: remove unreachable objects in batches
+#   files in the sha256 store are listed from cas/index.sqlite,
+#   or by scanning the sha256 store.
+#   files are kept when they are younger than --min-age,
+#   or have more hardlinks than we found (hardlinks by other apps).
+#   reflinks cannot be detected, so files are also kept
+#   when a reachable torrent has a regular file with the same size.
+
+# gc can run beside cas_torrent. new torrent directories are marked again before the sweep,
+# and --max-rate limits the io. for a consistent gc, stop cas_torrent first
+
+# cached v1 piece hashes (see v1_pieces.py) are removed with their files.
+
+# stores with multiple volumes are collected together, like in reshard.py
+
+import os
+import sys
+import glob
+import time
+import stat
+import shutil
+import argparse
+import collections
+import concurrent.futures
+
+from . import store_config
+from . import hash_index
+from . import bt2r_table
+from . import reshard
+from . import v1_pieces
+from . import torrent_parser
+
+
+quarantine_dir_name = "gc-quarantine"
+
+torrent_store_dirs = ["bt1", "bt2"]
+
+GcItem = collections.namedtuple(
+    "GcItem",
+    [
+        # torrent, sha256, bt2r
+        "kind",
+        "path",
+        # hex hash
+        "hashid",
+        # bytes on disk
+        "num_bytes",
+    ],
+)
+
+
+class StoreGc(object):
+    """
+    mark-and-sweep garbage collector for cas stores
+
+    store_prefix_list: all volumes. the first volume has the hash index
+    session_path: directory with the .fastresume files of cas_torrent (its --save-path)
+    """
+
+    def __init__(self, store_prefix_list, las_store_prefix, keep_torrents=True, min_age=3600, num_threads=4, use_index=True, session_path=None):
+        if isinstance(store_prefix_list, str):
+            store_prefix_list = [store_prefix_list]
+        self.store_prefix_list = [os.path.abspath(store_prefix) for store_prefix in store_prefix_list]
+        self.store_prefix = self.store_prefix_list[0]
+        self.las_store_prefix = None
+        if las_store_prefix != None:
+            self.las_store_prefix = os.path.abspath(las_store_prefix)
+        self.keep_torrents = keep_torrents
+        self.session_path = session_path
+        if not keep_torrents and session_path == None:
+            # torrents of a running cas_torrent would be removed
+            raise Exception("store_gc: collecting torrents needs the session path")
+        self.min_age = min_age
+        self.num_threads = num_threads
+        self.config = store_config.read_store_config(self.store_prefix)
+        self.index_path = os.path.join(self.store_prefix, "index.sqlite")
+        self.use_index = use_index and os.path.exists(self.index_path)
+        self.start_time = None
+        # mark
+        # (store_dir, hashid) of torrent directories
+        self.reachable_torrents = set()
+        # hex sha256 hashes
+        self.reachable_sha256 = set()
+        # hex bt2 root hashes of symlinks to the bt2r store
+        self.reachable_bt2r = set()
+        # torrent save paths from the resume files of the session
+        self._session_torrent_paths = set()
+        # (dev, ino) of hardlinks in torrent directories
+        self.reachable_inodes = set()
+        # sizes of regular files in torrent directories, maybe reflinks
+        self.reachable_sizes = set()
+        # torrent directories whose files were marked
+        self._walked_torrent_paths = set()
+        # (store_dir, hashid, path, is_link, ctime) of all torrent directories
+        self._torrent_entries = []
+        # sweep
+        self.garbage = []
+        # hex bt2 root hashes of removed files, for the bt2r table
+        self._garbage_bt2_roots = set()
+        self.reclaimable_bytes = 0
+        self.num_kept_young = 0
+        self.num_kept_hardlinked = 0
+        self.num_kept_same_size = 0
+        self.num_removed = 0
+        self.removed_bytes = 0
+
+    def run(self, action=None, batch_size=1000, max_rate=0):
+        """
+        action: None (report), "delete" or "quarantine"
+        max_rate: max number of removed objects per second. 0 = no limit
+        """
+        if os.path.exists(os.path.join(self.store_prefix, reshard.reshard_state_file_name)):
+            raise Exception("store_gc: store is being resharded. finish the reshard first")
+        self.start_time = time.time()
+        self.mark()
+        self.find_garbage()
+        print(self.format_report())
+        if action != None:
+            self.sweep(action, batch_size, max_rate)
+            print(f"store_gc: removed {self.num_removed} objects, {format_bytes(self.removed_bytes)}")
+
+    def _run_parallel(self, func, args_list):
+        # return the results of func in order
+        with concurrent.futures.ThreadPoolExecutor(self.num_threads) as executor:
+            return list(executor.map(lambda args: func(*args), args_list))
+
+    def _iter_top_dirs(self, store_dir):
+        # units of work: (volume_idx, top_dir_path)
+        for volume_idx, store_prefix in enumerate(self.store_prefix_list):
+            store_dir_path = os.path.join(store_prefix, store_dir)
+            try:
+                names = sorted(os.listdir(store_dir_path))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if len(name) == self.config["shard_width"] and reshard.is_hex(name):
+                    yield volume_idx, os.path.join(store_dir_path, name), name
+
+    def _scan_hash_store(self, store_dir, stat_entries=False):
+        """
+        list all entries of a hash store in all volumes
+
+        return list of (hashid, path, is_link, stat_result)
+        """
+        hash_len = reshard.hash_store_dirs[store_dir]
+        shard_depth = self.config["shard_depth"]
+        shard_width = self.config["shard_width"]
+
+        def scan_unit(volume_idx, top_dir_path, top_name):
+            result = []
+
+            def walk(dir_path, hash_prefix, depth):
+                try:
+                    dir_iter = os.scandir(dir_path)
+                except (FileNotFoundError, NotADirectoryError):
+                    return
+                with dir_iter:
+                    for entry in dir_iter:
+                        name = entry.name
+                        if not reshard.is_hex(name):
+                            continue
+                        if depth < shard_depth:
+                            if len(name) == shard_width and entry.is_dir(follow_symlinks=False):
+                                walk(entry.path, hash_prefix + name, depth + 1)
+                            continue
+                        if len(hash_prefix) + len(name) != hash_len:
+                            continue
+                        stat_result = None
+                        if stat_entries:
+                            stat_result = entry.stat(follow_symlinks=False)
+                        result.append((hash_prefix + name, entry.path, entry.is_symlink(), stat_result))
+
+            walk(top_dir_path, top_name, 1)
+            return result
+
+        results = self._run_parallel(scan_unit, self._iter_top_dirs(store_dir))
+        return [item for result in results for item in result]
+
+    def _get_las_links(self):
+        """
+        return the parsed targets of all symlinks in the las store
+        """
+        if self.las_store_prefix == None:
+            return []
+        try:
+            names = sorted(os.listdir(self.las_store_prefix))
+        except FileNotFoundError:
+            return []
+
+        def scan_unit(name):
+            result = []
+            dir_stack = [os.path.join(self.las_store_prefix, name)]
+            while dir_stack:
+                path = dir_stack.pop()
+                if os.path.islink(path):
+                    parsed = reshard.parse_link_target(os.readlink(path))
+                    if parsed != None:
+                        result.append(parsed)
+                        if parsed[0] == "bt2r":
+                            # also mark the target in the sha256 store
+                            parsed = reshard.parse_link_target(os.path.realpath(path))
+                            if parsed != None and parsed[0] == "sha256":
+                                result.append(parsed)
+                    continue
+                try:
+                    dir_iter = os.scandir(path)
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                with dir_iter:
+                    for entry in dir_iter:
+                        dir_stack.append(entry.path)
+            return result
+
+        results = self._run_parallel(scan_unit, [(name,) for name in names])
+        return [item for result in results for item in result]
+
+    def _walk_torrent_dir(self, torrent_path):
+        """
+        return (sha256_set, bt2r_set, inode_set, size_set) of files in a torrent directory
+        """
+        sha256_set = set()
+        bt2r_set = set()
+        inode_set = set()
+        size_set = set()
+        for dir_path, dir_names, file_names in os.walk(torrent_path):
+            # os.walk does not follow symlinks to directories
+            for name in file_names + dir_names:
+                file_path = os.path.join(dir_path, name)
+                try:
+                    stat_result = os.lstat(file_path)
+                except FileNotFoundError:
+                    continue
+                if stat.S_ISLNK(stat_result.st_mode):
+                    parsed = reshard.parse_link_target(os.readlink(file_path))
+                    if parsed == None:
+                        continue
+                    if parsed[0] == "bt2r":
+                        # torrent directories of older versions and reshard link to the bt2r store
+                        bt2r_set.add(parsed[1])
+                        parsed = reshard.parse_link_target(os.path.realpath(file_path))
+                        if parsed == None:
+                            continue
+                    if parsed[0] == "sha256":
+                        sha256_set.add(parsed[1])
+                elif stat.S_ISREG(stat_result.st_mode):
+                    if stat_result.st_nlink > 1:
+                        inode_set.add((stat_result.st_dev, stat_result.st_ino))
+                    else:
+                        size_set.add(stat_result.st_size)
+        return sha256_set, bt2r_set, inode_set, size_set
+
+    def _mark_torrent_dirs(self, torrent_paths):
+        torrent_paths = [path for path in torrent_paths if path not in self._walked_torrent_paths]
+        results = self._run_parallel(self._walk_torrent_dir, [(path,) for path in torrent_paths])
+        for sha256_set, bt2r_set, inode_set, size_set in results:
+            self.reachable_sha256.update(sha256_set)
+            self.reachable_bt2r.update(bt2r_set)
+            self.reachable_inodes.update(inode_set)
+            self.reachable_sizes.update(size_set)
+        self._walked_torrent_paths.update(torrent_paths)
+
+    def _scan_torrents(self):
+        torrent_entries = []
+        for store_dir in torrent_store_dirs:
+            for hashid, path, is_link, stat_result in self._scan_hash_store(store_dir, stat_entries=True):
+                torrent_entries.append((store_dir, hashid, path, is_link, stat_result.st_ctime))
+        return torrent_entries
+
+    def _mark_torrents(self, torrent_entries, min_ctime):
+        for store_dir, hashid, path, is_link, ctime in torrent_entries:
+            if self.keep_torrents or ctime >= min_ctime or path in self._session_torrent_paths:
+                self.reachable_torrents.add((store_dir, hashid))
+        # bt1 symlinks to bt2 directories
+        for store_dir, hashid, path, is_link, ctime in torrent_entries:
+            if store_dir != "bt1" or not is_link:
+                continue
+            parsed = reshard.parse_link_target(os.readlink(path))
+            if parsed == None:
+                continue
+            target_key = (parsed[0], parsed[1])
+            if ("bt1", hashid) in self.reachable_torrents or target_key in self.reachable_torrents:
+                self.reachable_torrents.add(("bt1", hashid))
+                self.reachable_torrents.add(target_key)
+        self._mark_torrent_dirs([
+            path for store_dir, hashid, path, is_link, ctime in torrent_entries
+            if not is_link and (store_dir, hashid) in self.reachable_torrents
+        ])
+
+    def _get_session_torrents(self):
+        """
+        return (torrent_keys, save_paths) of the resume files of the session
+
+        torrent_keys: set of (store_dir, hashid)
+        """
+        torrent_keys = set()
+        save_paths = set()
+        if self.session_path == None:
+            return torrent_keys, save_paths
+        for resume_file in glob.glob(os.path.join(glob.escape(self.session_path), "*.fastresume")):
+            try:
+                with open(resume_file, "rb") as f:
+                    resume_data = f.read()
+                resume_data = torrent_parser.decode(
+                    resume_data,
+                    errors="usebytes",
+                    hash_fields={"info-hash": (20, False), "info-hash2": (32, False)},
+                    include_paths=[["info-hash"], ["info-hash2"], ["save_path"]],
+                )
+            except (OSError, torrent_parser.InvalidTorrentDataException) as e:
+                # keep all torrents when a resume file is broken
+                raise Exception(f"store_gc: failed to read resume file {repr(resume_file)}: {e}")
+            if not isinstance(resume_data, dict):
+                raise Exception(f"store_gc: failed to read resume file {repr(resume_file)}")
+            for key, store_dir in (("info-hash", "bt1"), ("info-hash2", "bt2")):
+                hashid = resume_data.get(key)
+                if isinstance(hashid, str):
+                    torrent_keys.add((store_dir, hashid))
+            save_path = resume_data.get("save_path")
+            if isinstance(save_path, str):
+                save_paths.add(os.path.abspath(save_path))
+                save_paths.add(os.path.realpath(save_path))
+        return torrent_keys, save_paths
+
+    def mark(self):
+        print("store_gc: marking las links")
+        for store_dir, hashid, rest in self._get_las_links():
+            if store_dir == "sha256":
+                self.reachable_sha256.add(hashid)
+            elif store_dir == "bt2r":
+                self.reachable_bt2r.add(hashid)
+            elif store_dir in torrent_store_dirs:
+                self.reachable_torrents.add((store_dir, hashid))
+        if not self.keep_torrents:
+            print("store_gc: marking torrents of the session")
+            torrent_keys, self._session_torrent_paths = self._get_session_torrents()
+            self.reachable_torrents.update(torrent_keys)
+        print("store_gc: marking torrent directories")
+        self._torrent_entries = self._scan_torrents()
+        self._mark_torrents(self._torrent_entries, self.start_time - self.min_age)
+        print(f"store_gc: {len(self.reachable_torrents)} of {len(self._torrent_entries)} torrents are reachable")
+
+    def _iter_sha256_objects(self):
+        """
+        yield (hashid, path, bt2_root) of all files in the sha256 store
+        """
+        if self.use_index:
+            index = hash_index.HashIndex(self.index_path)
+            rows = list(index.iter_objects())
+            index.close()
+            for sha256, size, bt2_root, dev in rows:
+                hashid = sha256.hex()
+                shard = store_config.get_shard(hashid, self.config)
+                for store_prefix in self.store_prefix_list:
+                    path = os.path.join(store_prefix, "sha256", *shard)
+                    if os.path.lexists(path):
+                        yield hashid, path, bt2_root
+                        break
+            return
+        for hashid, path, is_link, stat_result in self._scan_hash_store("sha256"):
+            yield hashid, path, None
+
+    def _check_sha256_object(self, hashid, path, min_ctime):
+        """
+        return (reason to keep, stat_result)
+        """
+        try:
+            stat_result = os.lstat(path)
+        except FileNotFoundError:
+            return "missing", None
+        if (stat_result.st_dev, stat_result.st_ino) in self.reachable_inodes:
+            return "reachable", stat_result
+        if stat_result.st_ctime >= min_ctime:
+            return "young", stat_result
+        if stat_result.st_nlink > 1:
+            return "hardlinked", stat_result
+        if stat_result.st_size in self.reachable_sizes:
+            return "same_size", stat_result
+        return None, stat_result
+
+    def find_garbage(self):
+        min_ctime = self.start_time - self.min_age
+        self.garbage = []
+        self.reclaimable_bytes = 0
+
+        # torrent directories
+        garbage_torrents = [
+            (store_dir, hashid, path, is_link)
+            for store_dir, hashid, path, is_link, ctime in self._torrent_entries
+            if (store_dir, hashid) not in self.reachable_torrents
+        ]
+        # partial downloads, hardlinks are counted in the sha256 store
+        def get_torrent_bytes(path, is_link):
+            if is_link:
+                return 0
+            num_bytes = 0
+            for dir_path, dir_names, file_names in os.walk(path):
+                for name in file_names:
+                    stat_result = os.lstat(os.path.join(dir_path, name))
+                    if stat.S_ISREG(stat_result.st_mode) and stat_result.st_nlink == 1:
+                        num_bytes += stat_result.st_blocks * 512
+            return num_bytes
+        torrent_bytes = self._run_parallel(get_torrent_bytes, [(path, is_link) for store_dir, hashid, path, is_link in garbage_torrents])
+        for (store_dir, hashid, path, is_link), num_bytes in zip(garbage_torrents, torrent_bytes):
+            self.garbage.append(GcItem("torrent", path, hashid, num_bytes))
+            self.reclaimable_bytes += num_bytes
+
+        # files in the sha256 store
+        print("store_gc: checking the sha256 store")
+        candidates = [
+            (hashid, path, bt2_root)
+            for hashid, path, bt2_root in self._iter_sha256_objects()
+            if hashid not in self.reachable_sha256
+        ]
+        results = self._run_parallel(self._check_sha256_object, [(hashid, path, min_ctime) for hashid, path, bt2_root in candidates])
+        garbage_sha256 = set()
+        for (hashid, path, bt2_root), (reason, stat_result) in zip(candidates, results):
+            if reason == "young":
+                self.num_kept_young += 1
+            elif reason == "hardlinked":
+                self.num_kept_hardlinked += 1
+            elif reason == "same_size":
+                self.num_kept_same_size += 1
+            if reason != None:
+                continue
+            num_bytes = stat_result.st_blocks * 512
+            self.garbage.append(GcItem("sha256", path, hashid, num_bytes))
+            self.reclaimable_bytes += num_bytes
+            garbage_sha256.add(hashid)
+            if bt2_root != None:
+                self._garbage_bt2_roots.add(bt2_root.hex())
+
+        # symlinks in the bt2r store
+        for hashid, path, is_link, stat_result in self._scan_hash_store("bt2r"):
+            if not is_link or hashid in self.reachable_bt2r:
+                continue
+            parsed = reshard.parse_link_target(os.readlink(path))
+            if parsed == None:
+                continue
+            if parsed[1] in garbage_sha256 or not os.path.exists(path):
+                self.garbage.append(GcItem("bt2r", path, hashid, 0))
+                self._garbage_bt2_roots.add(hashid)
+
+    def _remark_new_torrents(self):
+        # torrents that were added since the mark phase
+        torrent_entries = [
+            entry for entry in self._scan_torrents()
+            if entry[4] >= self.start_time
+        ]
+        if len(torrent_entries) == 0:
+            return
+        print(f"store_gc: marking {len(torrent_entries)} new torrents")
+        self._mark_torrents(torrent_entries, self.start_time)
+        reachable_torrent_hashes = set(hashid for store_dir, hashid in self.reachable_torrents)
+        garbage = []
+        for item in self.garbage:
+            if item.kind == "torrent" and item.hashid in reachable_torrent_hashes:
+                continue
+            if item.kind == "sha256" and item.hashid in self.reachable_sha256:
+                continue
+            if item.kind == "bt2r" and item.hashid in self.reachable_bt2r:
+                continue
+            garbage.append(item)
+        self.garbage = garbage
+
+    def _get_quarantine_path(self, path):
+        for store_prefix in self.store_prefix_list:
+            if path.startswith(store_prefix + "/"):
+                return os.path.join(store_prefix, quarantine_dir_name, self._quarantine_name, os.path.relpath(path, store_prefix))
+        raise Exception(f"store_gc: not in the cas store: {path}")
+
+    def _get_v1_pieces_path(self, sha256_path):
+        # same shard path in the v1p store of the same volume
+        store_prefix = sha256_path
+        shard = []
+        while os.path.basename(store_prefix) != "sha256":
+            store_prefix, name = os.path.split(store_prefix)
+            shard.insert(0, name)
+        return os.path.join(os.path.dirname(store_prefix), v1_pieces.v1_pieces_store_dir, *shard)
+
+    def _remove_item(self, item, action):
+        if item.kind == "sha256":
+            # check again, a torrent can have linked the file since the mark phase
+            try:
+                stat_result = os.lstat(item.path)
+            except FileNotFoundError:
+                return False
+            if stat_result.st_nlink > 1:
+                return False
+        paths = [item.path]
+        if item.kind == "sha256":
+            # cached v1 piece hashes
+            v1_pieces_path = self._get_v1_pieces_path(item.path)
+            if os.path.exists(v1_pieces_path):
+                paths.append(v1_pieces_path)
+        for path in paths:
+            if action == "quarantine":
+                quarantine_path = self._get_quarantine_path(path)
+                os.makedirs(os.path.dirname(quarantine_path), exist_ok=True)
+                os.rename(path, quarantine_path)
+            elif os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        # remove empty shard directories
+        dir_path = os.path.dirname(item.path)
+        for _ in range(self.config["shard_depth"]):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                break
+            dir_path = os.path.dirname(dir_path)
+        return True
+
+    def sweep(self, action, batch_size=1000, max_rate=0):
+        assert action in ("delete", "quarantine"), f"unknown action: {action}"
+        self._quarantine_name = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.start_time))
+        self._remark_new_torrents()
+        # remove links before their targets
+        kind_order = {"torrent": 0, "bt2r": 1, "sha256": 2}
+        items = sorted(self.garbage, key=lambda item: kind_order[item.kind])
+        index = None
+        if self.use_index:
+            index = hash_index.HashIndex(self.index_path)
+        table = None
+        table_path = os.path.join(self.store_prefix, "bt2r.table")
+        if os.path.exists(table_path) or os.path.exists(table_path + ".wal"):
+            table = bt2r_table.Bt2rTable(table_path)
+        try:
+            for batch_start in range(0, len(items), batch_size):
+                batch = items[batch_start:batch_start + batch_size]
+                t1 = time.time()
+                for item in batch:
+                    if not self._remove_item(item, action):
+                        continue
+                    self.num_removed += 1
+                    self.removed_bytes += item.num_bytes
+                    if item.kind == "sha256" and index != None:
+                        index.remove(bytes.fromhex(item.hashid))
+                if table != None:
+                    # the table is locked between processes,
+                    # a running cas_torrent sees the removed records within a second
+                    for item in batch:
+                        if item.kind == "bt2r":
+                            table.remove(bytes.fromhex(item.hashid))
+                print(f"store_gc: removed {self.num_removed} of {len(items)} objects")
+                if max_rate > 0:
+                    # rate limit, so gc can run beside seeding
+                    t2 = t1 + len(batch) / max_rate
+                    sleep_time = t2 - time.time()
+                    if sleep_time > 0:
+                        time.sleep(sleep_time)
+            if table != None:
+                # bt2 roots from the index without bt2r links
+                bt2r_items = set(item.hashid for item in items if item.kind == "bt2r")
+                for bt2_root_hex in self._garbage_bt2_roots - bt2r_items:
+                    table.remove(bytes.fromhex(bt2_root_hex))
+                table.compact()
+        finally:
+            if index != None:
+                index.close()
+            if table != None:
+                table.close()
+
+    def format_report(self):
+        count = collections.Counter(item.kind for item in self.garbage)
+        return "\n".join([
+            f"store_gc: unreachable torrents: {count['torrent']}",
+            f"store_gc: unreachable files in the sha256 store: {count['sha256']}",
+            f"store_gc: unreachable links in the bt2r store: {count['bt2r']}",
+            f"store_gc: kept files: {self.num_kept_young} young, {self.num_kept_hardlinked} hardlinked, {self.num_kept_same_size} maybe reflinked",
+            f"store_gc: reclaimable: {format_bytes(self.reclaimable_bytes)}",
+        ])
+
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes} B"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TiB"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="remove unreachable objects from a cas store",
+    )
+    parser.add_argument("store_prefix", nargs="+", help="path to the cas stores, for example cas/. the first store is the primary store")
+    parser.add_argument("--las", default=None, help="path to the las store. default: las/ next to the first cas store")
+    action_group = parser.add_mutually_exclusive_group()
+    action_group.add_argument("--delete", dest="action", action="store_const", const="delete", help="delete unreachable objects")
+    action_group.add_argument("--quarantine", dest="action", action="store_const", const="quarantine", help=f"move unreachable objects to cas/{quarantine_dir_name}/")
+    parser.add_argument("--collect-torrents", action="store_true", help="also remove unreachable torrent directories. needs --session. default: keep all torrent directories, only remove unused files")
+    parser.add_argument("--session", default=None, help="path to the session of cas_torrent (its --save-path) with the .fastresume files. torrents of the session are reachable")
+    parser.add_argument("--min-age", type=float, default=3600, help="keep objects younger than this, in seconds. default: 3600")
+    parser.add_argument("--threads", type=int, default=4, help="number of parallel threads")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of objects per batch")
+    parser.add_argument("--max-rate", type=float, default=0, help="max number of removed objects per second. default: no limit")
+    parser.add_argument("--no-index", action="store_true", help="scan the sha256 store, dont use cas/index.sqlite")
+    options = parser.parse_args()
+
+    store_prefix_list = [os.path.abspath(store_prefix) for store_prefix in options.store_prefix]
+    las_store_prefix = options.las
+    if las_store_prefix == None:
+        las_store_prefix = os.path.join(os.path.dirname(store_prefix_list[0]), "las")
+    if options.collect_torrents:
+        if not os.path.isdir(las_store_prefix):
+            # without las links, all torrents are unreachable
+            print(f"store_gc: las store not found: {las_store_prefix}. use --las")
+            sys.exit(1)
+        if options.session == None:
+            # torrents of a running cas_torrent have no las links yet
+            print("store_gc: --collect-torrents needs --session")
+            sys.exit(1)
+        if not os.path.isdir(options.session):
+            print(f"store_gc: session not found: {options.session}")
+            sys.exit(1)
+
+    gc = StoreGc(
+        store_prefix_list,
+        las_store_prefix,
+        keep_torrents=not options.collect_torrents,
+        min_age=options.min_age,
+        num_threads=options.threads,
+        use_index=not options.no_index,
+        session_path=options.session,
+    )
+    gc.run(options.action, options.batch_size, options.max_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,13 @@ Usage:
     with open(filename, 'rb') as f: # the binary mode 'b' is necessary
         data = TorrentFileParser(f).parse()
 
+    # or skip large values, they are decoded on access
+
+    data = parse_torrent_file(
+        filename, exclude_paths=TorrentFileParser.BULK_HASH_PATHS
+    )
+    pieces = data['info']['pieces'].value
+
     # then you can edit the data
 
     data['announce-list'].append(['http://127.0.0.1:8080'])
@@ -38,6 +45,7 @@ from __future__ import print_function, unicode_literals
 import argparse
 import binascii
 import collections
+import hashlib
 import io
 import json
 import sys
@@ -80,6 +88,9 @@ __all__ = [
     "TorrentFileCreator",
     "create_torrent_file",
     "parse_torrent_file",
+    "InfoHashes",
+    "info_hashes",
+    "LazyValue",
 ]
 
 __version__ = "0.4.1"
@@ -103,6 +114,47 @@ class __EndCls(object):
 _END = __EndCls()
 
 
+class LazyValue(object):
+    """
+    A value that was skipped by :any:`BDecoder`, because of
+    ``include_paths`` or ``exclude_paths``.
+    It is decoded when :any:`value` is accessed.
+    When encoded, the raw bytes are copied as they are.
+    """
+
+    __slots__ = ("_decoder", "_data", "offset", "length", "key", "_value")
+
+    def __init__(self, decoder, data, offset, length, key):
+        self._decoder = decoder
+        self._data = data
+        self.offset = offset
+        self.length = length
+        self.key = key
+        self._value = _END
+
+    @property
+    def raw(self):
+        """
+        :return: raw bencoded bytes of the value, without copy
+        :rtype: memoryview
+        """
+        return memoryview(self._data)[self.offset : self.offset + self.length]
+
+    @property
+    def value(self):
+        """
+        :return: the decoded value, decoded on first access
+        """
+        if self._value is _END:
+            self._value = self._decoder._decode_lazy(self)
+        return self._value
+
+    def __repr__(self):
+        return "LazyValue(key={!r}, offset={}, length={})".format(
+            self.key, self.offset, self.length
+        )
+
+
 def _check_hash_field_params(name, value):
     return (
         isinstance(name, str_type)
@@ -148,10 +200,15 @@ class BDecoder(object):
         errors="strict",
         hash_fields=None,
         hash_raw=False,
+        span_paths=None,
+        include_paths=None,
+        exclude_paths=None,
     ):
         """
-        :param bytes|file data: bytes or a **binary** file-like object to parse,
-          which means need 'b' mode when use built-in open function
+        :param bytes|memoryview|file data: bytes or a **binary** file-like
+          object to parse, which means need 'b' mode when use built-in open
+          function. file content is read into memory once, then parsed by
+          index
         :param bool use_ordered_dict: Use collections.OrderedDict as dict
           container default False, which mean use built-in dict
         :param str encoding: file content encoding, default utf-8, use 'auto'
@@ -166,15 +223,26 @@ class BDecoder(object):
           be treated as hash value. dict key is the field name, value is a
           two-element tuple of (hash_block_length, as_a_list).
           See :any:`hash_field` for detail
+        :param bool hash_raw: keep hash fields as raw bytes
+        :param List[List[str]] span_paths: key paths of values whose raw
+          byte span should be recorded. See :any:`record_span` for detail
+        :param List[List[str]] include_paths: if set, only decode values at
+          these key paths and their parents. other values are returned as
+          :any:`LazyValue`. See :any:`include_path` for detail
+        :param List[List[str]] exclude_paths: key paths of values that are
+          returned as :any:`LazyValue`. See :any:`exclude_path` for detail
         """
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
         if isinstance(data, bytes_type):
-            data = io.BytesIO(data)
+            pass
         elif getattr(data, "read") is not None and getattr(data, "seek") is not None:
             pass
         else:
             raise ValueError("Parameter data must be bytes or file like object")
 
         self._pos = 0
+        self._data = b""
         self._encoding = encoding
         self._content = data
         self._use_ordered_dict = use_ordered_dict
@@ -196,6 +264,35 @@ class BDecoder(object):
                     )
         self._hash_raw = bool(hash_raw)
 
+        # current key path while inside the parents of
+        # span_paths, include_paths or exclude_paths, else None
+        self._path = None
+        self._path_prefixes = set()
+        self._span_paths = set()
+        self._spans = {}
+        self._include_paths = set()
+        self._include_prefixes = set()
+        self._exclude_paths = set()
+        # True while inside one of include_paths
+        self._included = True
+        if span_paths is not None:
+            for path in span_paths:
+                self.record_span(path)
+        if include_paths is not None:
+            for path in include_paths:
+                self.include_path(path)
+        if exclude_paths is not None:
+            for path in exclude_paths:
+                self.exclude_path(path)
+
+        # dispatch on the first byte of an element
+        self._type_funcs = {}
+        for element_type, indicator in self.TYPES:
+            if indicator:
+                self._type_funcs[indicator] = getattr(self, "_next_" + element_type)
+        for digit in range(10):
+            self._type_funcs[str(digit).encode("ascii")] = self._next_string
+
     def hash_field(self, name, block_length=20, need_list=False):
         """
         Let field with the `name` to be treated as hash value, don't decode it
@@ -215,6 +312,99 @@ class BDecoder(object):
             raise ValueError("Invalid hash field parameter")
         return self
 
+    def record_span(self, path):
+        """
+        Record the raw byte span of the value at the key path ``path``
+        while decoding, for example ``["info"]``.
+        The span can be used to hash the value exactly as it is in the data,
+        without encoding it again.
+
+        :param List[str] path: dict keys from the root element
+        :return: return self, so you can chained call
+        """
+        path = tuple(path)
+        self._span_paths.add(path)
+        self._add_path_prefixes(path, self._path_prefixes)
+        return self
+
+    def include_path(self, path):
+        """
+        Decode the value at the key path ``path``, for example
+        ``["info", "name"]``. When include paths are set, values that are
+        not at an include path or a parent of it are not decoded, and are
+        returned as :any:`LazyValue`.
+
+        :param List[str] path: dict keys from the root element.
+          key paths have no list indices, so lists are decoded as a whole
+        :return: return self, so you can chained call
+        """
+        path = tuple(path)
+        self._include_paths.add(path)
+        self._add_path_prefixes(path, self._path_prefixes)
+        self._add_path_prefixes(path, self._include_prefixes)
+        return self
+
+    def exclude_path(self, path):
+        """
+        Dont decode the value at the key path ``path``, for example
+        ``["info", "pieces"]``. It is returned as :any:`LazyValue`.
+
+        :param List[str] path: dict keys from the root element
+        :return: return self, so you can chained call
+        """
+        path = tuple(path)
+        self._exclude_paths.add(path)
+        self._add_path_prefixes(path, self._path_prefixes)
+        return self
+
+    @staticmethod
+    def _add_path_prefixes(path, prefixes):
+        for i in range(len(path) + 1):
+            prefixes.add(path[:i])
+
+    def get_span(self, path):
+        """
+        :param List[str] path: a key path given to :any:`record_span`
+        :return: (start, end) offsets of the value recorded by the last
+          :any:`decode`, or None if the key path was not found
+        :rtype: Tuple[int, int]|None
+        """
+        return self._spans.get(tuple(path))
+
+    def get_span_data(self, path):
+        """
+        :param List[str] path: a key path given to :any:`record_span`
+        :return: raw bytes of the value recorded by the last :any:`decode`,
+          without copy, or None if the key path was not found
+        :rtype: memoryview|None
+        """
+        span = self.get_span(path)
+        if span is None:
+            return None
+        return memoryview(self._data)[span[0] : span[1]]
+
+    def find_span(self, path):
+        """
+        Find the raw byte span of the value at the key path ``path``
+        without decoding the data. Other values are skipped.
+
+        :param List[str] path: dict keys from the root element
+        :return: (start, end) offsets, or None if the key path was not found
+        :rtype: Tuple[int, int]|None
+        """
+        self._restart()
+        start = 0
+        for key in path:
+            for k in self._iter_dict_keys(start):
+                if k == key:
+                    start = self._pos
+                    break
+            else:
+                return None
+        self._pos = start
+        self._skip_element()
+        return start, self._pos
+
     def decode(self):
         """
         :rtype: dict|list|int|str|unicode|bytes
@@ -224,121 +414,244 @@ class BDecoder(object):
         self._restart()
         data = self._next_element()
 
-        try:
-            c = self._read_byte(1, True)
+        if self._pos < len(self._data):
+            c = self._data[self._pos : self._pos + 1]
             raise InvalidTorrentDataException(
                 0, "Expect EOF, but get [{}] at pos {}".format(c, self._pos)
             )
-        except EOFError:  # expect EOF
-            pass
 
         return data
 
-    def _read_byte(self, count=1, raise_eof=False):
-        assert count >= 0
-        gotten = self._content.read(count)
-        if count != 0 and len(gotten) == 0:
-            if raise_eof:
-                raise EOFError()
-            raise InvalidTorrentDataException(
-                self._pos, "Unexpected EOF when reading torrent file"
-            )
-        self._pos += count
-        return gotten
-
-    def _seek_back(self, count):
-        self._content.seek(-count, 1)
-        self._pos = self._pos - count
-
     def _restart(self):
-        self._content.seek(0, 0)
+        if isinstance(self._content, bytes_type):
+            self._data = self._content
+        else:
+            self._content.seek(0, 0)
+            self._data = self._content.read()
         self._pos = 0
+        self._path = () if self._path_prefixes else None
+        self._included = not self._include_paths
+        self._spans = {}
 
-    def _dict_items_generator(self):
+    def _unexpected_eof(self, pos):
+        return InvalidTorrentDataException(
+            pos, "Unexpected EOF when reading torrent file"
+        )
+
+    def _next_dict(self, field=None):
+        self._pos += 1
+        data = collections.OrderedDict() if self._use_ordered_dict else dict()
+        hash_fields = self._hash_fields
+        next_element = self._next_element
+        path = self._path
         while True:
-            k = self._next_element()
+            k = next_element()
             if k is _END:
-                return
+                return data
             if not isinstance(k, str_type) and not isinstance(k, bytes_type):
                 raise InvalidTorrentDataException(
                     self._pos, "Type of dict key can't be " + type(k).__name__
                 )
-            if k in self._hash_fields:
-                v = self._next_hash(*self._hash_fields[k])
+            if path is not None:
+                v = self._next_path_value(path, k)
+            elif k in hash_fields:
+                v = self._next_hash(*hash_fields[k])
             else:
-                v = self._next_element(k)
-            if k == "encoding":
+                v = next_element(k)
+            if k == "encoding" and not isinstance(v, LazyValue):
                 self._encoding = v
-            yield k, v
-
-    def _next_dict(self):
-        data = collections.OrderedDict() if self._use_ordered_dict else dict()
-        for key, element in self._dict_items_generator():
-            data[key] = element
+            data[k] = v
+
+    def _next_value(self, k):
+        # the value of dict key k
+        if k in self._hash_fields:
+            return self._next_hash(*self._hash_fields[k])
+        return self._next_element(k)
+
+    def _next_path_value(self, path, k):
+        # the value of dict key k, in the dict at key path ``path``
+        key_path = path + (k,)
+        start = self._pos
+        if key_path in self._exclude_paths or not (
+            self._included or key_path in self._include_prefixes
+        ):
+            self._skip_element()
+            v = LazyValue(self, self._data, start, self._pos - start, k)
+        else:
+            included = self._included
+            self._included = included or key_path in self._include_paths
+            self._path = key_path if key_path in self._path_prefixes else None
+            v = self._next_value(k)
+            self._included = included
+            self._path = path
+        if key_path in self._span_paths:
+            self._spans[key_path] = (start, self._pos)
+        return v
+
+    def _decode_lazy(self, lazy_value):
+        # decode a LazyValue, then continue where we were
+        state = (self._data, self._pos, self._path, self._included)
+        self._data = lazy_value._data
+        self._pos = lazy_value.offset
+        self._path = None
+        self._included = True
+        try:
+            return self._next_value(lazy_value.key)
+        finally:
+            self._data, self._pos, self._path, self._included = state
+
+    def _next_list(self, field=None):
+        self._pos += 1
+        data = []
+        # key paths have no list indices
+        path = self._path
+        self._path = None
+        next_element = self._next_element
+        element = next_element()
+        while element is not _END:
+            data.append(element)
+            element = next_element()
+        self._path = path
         return data
 
-    def _list_items_generator(self):
+    def _iter_dict_keys(self, pos):
+        """
+        yield the keys of the dict at ``pos``, with self._pos at the value.
+        values that are not read by the caller are skipped without decoding
+        """
+        if self._data[pos : pos + 1] != self.DICT_INDICATOR:
+            return
+        self._pos = pos + 1
         while True:
-            element = self._next_element()
-            if element is _END:
+            k = self._next_element()
+            if k is _END:
                 return
-            yield element
-
-    def _next_list(self):
-        return [element for element in self._list_items_generator()]
-
-    def _next_int(self, end=END_INDICATOR):
-        value = 0
-        char = self._read_byte(1)
-        neg = False
-        while char != end:
-            if not neg and char == b"-":
-                neg = True
-            elif not b"0" <= char <= b"9":
-                raise InvalidTorrentDataException(self._pos - 1)
+            start = self._pos
+            yield k
+            if self._pos == start:
+                self._skip_element()
+
+    def _skip_element(self):
+        # move self._pos to the end of the element, without a call per element
+        data = self._data
+        find = data.find
+        pos = self._pos
+        depth = 0
+        while True:
+            indicator = data[pos : pos + 1]
+            if indicator.isdigit():
+                delimiter = find(self.STRING_DELIMITER, pos)
+                raw_length = data[pos:delimiter]
+                if delimiter != -1 and raw_length.isdigit():
+                    length = int(raw_length)
+                else:
+                    length = self._parse_int(pos, delimiter)
+                    if length < 0:
+                        raise InvalidTorrentDataException(pos)
+                pos = delimiter + 1 + length
+                if pos > len(data):
+                    raise self._unexpected_eof(len(data))
+            elif indicator == b"d" or indicator == b"l":
+                depth += 1
+                pos += 1
+                continue
+            elif indicator == b"e" and depth > 0:
+                depth -= 1
+                pos += 1
+            elif indicator == b"i":
+                end = find(self.END_INDICATOR, pos + 1)
+                raw = data[pos + 1 : end]
+                if end == -1 or not raw.isdigit():
+                    self._parse_int(pos + 1, end)
+                pos = end + 1
+            elif not indicator:
+                raise self._unexpected_eof(pos)
             else:
-                value = value * 10 + int(char) - int(b"0")
-            char = self._read_byte(1)
+                raise InvalidTorrentDataException(pos)
+            if depth == 0:
+                self._pos = pos
+                return
+
+    def _parse_int(self, start, end):
+        # parse the digits in self._data[start:end]
+        # slow path for signs, empty values and errors
+        if end == -1:
+            raise self._unexpected_eof(len(self._data))
+        raw = self._data[start:end]
+        neg = raw[:1] == b"-"
+        digits = raw[1:] if neg else raw
+        if not digits:
+            return 0
+        if not digits.isdigit():
+            for i in range(len(digits)):
+                if not digits[i : i + 1].isdigit():
+                    raise InvalidTorrentDataException(end - len(digits) + i)
+        value = int(digits)
         return -value if neg else value
 
-    def _next_string(self, need_decode=True, field=None):
-        length = self._next_int(self.STRING_DELIMITER)
-        raw = self._read_byte(length)
-        if need_decode:
-            encoding = self._encoding
-            if encoding == "auto":
-                self.encoding = encoding = detect(raw)
-            try:
-                string = raw.decode(encoding, self._error_handler)
-            except UnicodeDecodeError as e:
-                if self._error_use_bytes:
-                    return raw
-                else:
-                    msg = [
-                        "Fail to decode string at pos {pos} using encoding ",
-                        e.encoding,
-                    ]
-                    if field:
-                        msg.extend(
-                            [
-                                ' when parser field "',
-                                field,
-                                '"' ", maybe it is an hash field. ",
-                                'You can use self.hash_field("',
-                                field,
-                                '") ',
-                                "to let it be treated as hash value, ",
-                                "so this error may disappear",
-                            ]
-                        )
-                    raise InvalidTorrentDataException(
-                        self._pos - length + e.start, "".join(msg)
+    def _next_int(self, field=None):
+        start = self._pos + 1
+        end = self._data.find(self.END_INDICATOR, start)
+        raw = self._data[start:end]
+        if end != -1 and raw.isdigit():
+            value = int(raw)
+        else:
+            value = self._parse_int(start, end)
+        self._pos = end + 1
+        return value
+
+    def _next_raw_string(self):
+        data = self._data
+        delimiter = data.find(self.STRING_DELIMITER, self._pos)
+        raw_length = data[self._pos : delimiter]
+        if delimiter != -1 and raw_length.isdigit():
+            length = int(raw_length)
+        else:
+            length = self._parse_int(self._pos, delimiter)
+            if length < 0:
+                raise InvalidTorrentDataException(self._pos)
+        start = delimiter + 1
+        end = start + length
+        if end > len(data):
+            raise self._unexpected_eof(len(data))
+        self._pos = end
+        return data[start:end]
+
+    def _next_string(self, field=None):
+        raw = self._next_raw_string()
+        encoding = self._encoding
+        if encoding == "auto":
+            self.encoding = encoding = detect(raw)
+        try:
+            string = raw.decode(encoding, self._error_handler)
+        except UnicodeDecodeError as e:
+            if self._error_use_bytes:
+                return raw
+            else:
+                msg = [
+                    "Fail to decode string at pos {pos} using encoding ",
+                    e.encoding,
+                ]
+                if field:
+                    msg.extend(
+                        [
+                            ' when parser field "',
+                            field,
+                            '"' ", maybe it is an hash field. ",
+                            'You can use self.hash_field("',
+                            field,
+                            '") ',
+                            "to let it be treated as hash value, ",
+                            "so this error may disappear",
+                        ]
                     )
-            return string
-        return raw
+                raise InvalidTorrentDataException(
+                    self._pos - len(raw) + e.start, "".join(msg)
+                )
+        return string
 
     def _next_hash(self, p_len, need_list):
-        raw = self._next_string(need_decode=False)
+        raw = self._next_raw_string()
         if len(raw) % p_len != 0:
             raise InvalidTorrentDataException(
                 self._pos - len(raw), "Hash bit length not match at pos {pos}"
@@ -355,29 +668,20 @@ class BDecoder(object):
             return res[0]
         return res
 
-    @staticmethod
-    def _next_end():
+    def _next_end(self, field=None):
+        self._pos += 1
         return _END
 
-    def _next_type(self):
-        for (element_type, indicator) in self.TYPES:
-            indicator_length = len(indicator)
-            char = self._read_byte(indicator_length)
-            if indicator == char:
-                return element_type
-            self._seek_back(indicator_length)
-        raise InvalidTorrentDataException(self._pos)
-
-    def _type_to_func(self, t):
-        return getattr(self, "_next_" + t)
-
     def _next_element(self, field=None):
-        element_type = self._next_type()
-        if element_type is BDecoder.TYPE_STRING and field is not None:
-            element = self._type_to_func(element_type)(field=field)
-        else:
-            element = self._type_to_func(element_type)()
-        return element
+        pos = self._pos
+        indicator = self._data[pos : pos + 1]
+        try:
+            func = self._type_funcs[indicator]
+        except KeyError:
+            if not indicator:
+                raise self._unexpected_eof(pos)
+            raise InvalidTorrentDataException(pos)
+        return func(field)
 
 
 class BEncoder(object):
@@ -387,8 +691,12 @@ class BEncoder(object):
         (list,): BDecoder.TYPE_LIST,
         (int,): BDecoder.TYPE_INT,
         (str_type, bytes_type): BDecoder.TYPE_STRING,
+        (LazyValue,): "lazy",
     }
 
+    # pass the output to the file-like object in chunks of this size
+    BUFFER_SIZE = 64 * 1024
+
     def __init__(self, data, encoding="utf-8", hash_fields=None):
         """
         :param dict|list|int|str data: data will be encoded
@@ -401,6 +709,11 @@ class BEncoder(object):
         self._hash_fields = []
         if hash_fields is not None:
             self._hash_fields = hash_fields
+        # exact types, subclasses are found with isinstance
+        self._type_cache = {}
+        for types, t in self.TYPES.items():
+            for element_type in types:
+                self._type_cache[element_type] = t
 
     def hash_field(self, name):
         """
@@ -417,30 +730,122 @@ class BEncoder(object):
 
         :rtype: bytes
         """
-        return b"".join(self._output_element(self._data))
+        buf = bytearray()
+        self._encode_into(buf, None)
+        return bytes(buf)
 
-    def encode_to_filelike(self):
+    def encode_to_filelike(self, fp=None):
         """
-        Encode to a file-like(BytesIO) object
+        Encode to a file-like object. The output is written in chunks,
+        so large data is not held in memory as a whole
 
-        :rtype: BytesIO
+        :param file fp: **binary** file-like object to write to,
+          default is a new BytesIO
+        :return: ``fp``, or the new BytesIO at position 0
+        :rtype: BytesIO|file
+        """
+        if fp is None:
+            result = io.BytesIO()
+            self._encode_into(bytearray(), result.write)
+            result.seek(0)
+            return result
+        self._encode_into(bytearray(), fp.write)
+        return fp
+
+    def _encode_into(self, buf, write):
+        """
+        Append the encoded data to the bytearray ``buf``.
+        If ``write`` is not None, full chunks of ``buf`` are passed to
+        ``write``, and large strings are passed to ``write`` directly.
+        Nested lists and dicts are handled with a stack, not recursion
         """
-        return io.BytesIO(self.encode())
+        # (iterator over items, is_dict)
+        stack = []
+        value = self._data
+        while True:
+            t = self._type_cache.get(type(value))
+            if t is None:
+                t = self._find_type(value)
+            if t == BDecoder.TYPE_STRING:
+                self._write_string(buf, write, value)
+            elif t == BDecoder.TYPE_DICT:
+                buf += BDecoder.DICT_INDICATOR
+                stack.append((iter(value.items()), True))
+            elif t == BDecoder.TYPE_LIST:
+                buf += BDecoder.LIST_INDICATOR
+                stack.append((iter(value), False))
+            elif t == BDecoder.TYPE_INT:
+                buf += BDecoder.INT_INDICATOR
+                buf += str(value).encode("ascii")
+                buf += BDecoder.END_INDICATOR
+            else:
+                # LazyValue, already encoded
+                self._write_raw(buf, write, value.raw)
+
+            # find the next value
+            value = _END
+            while stack:
+                items, is_dict = stack[-1]
+                item = next(items, _END)
+                if item is _END:
+                    buf += BDecoder.END_INDICATOR
+                    stack.pop()
+                    continue
+                if not is_dict:
+                    value = item
+                    break
+                k, v = item
+                if not isinstance(k, str_type) and not isinstance(k, bytes_type):
+                    raise InvalidTorrentDataException(
+                        None,
+                        "Dict key must be "
+                        + str_type.__name__
+                        + " or "
+                        + bytes_type.__name__,
+                    )
+                self._write_string(buf, write, k)
+                if k in self._hash_fields and not isinstance(v, LazyValue):
+                    self._write_string(buf, write, self._decode_hash(v))
+                    continue
+                value = v
+                break
+            if value is _END:
+                break
+            if write is not None and len(buf) >= self.BUFFER_SIZE:
+                write(buf)
+                del buf[:]
+        if write is not None and buf:
+            write(buf)
+            del buf[:]
+
+    def _find_type(self, data):
+        for types, t in self.TYPES.items():
+            if isinstance(data, types):
+                return t
+        raise InvalidTorrentDataException(
+            None,
+            "Invalid type for torrent file: " + type(data).__name__,
+        )
 
-    def _output_string(self, data):
+    def _write_string(self, buf, write, data):
         if isinstance(data, str_type):
             data = data.encode(self._encoding)
-        yield str(len(data)).encode("ascii")
-        yield BDecoder.STRING_DELIMITER
-        yield data
+        buf += str(len(data)).encode("ascii")
+        buf += BDecoder.STRING_DELIMITER
+        self._write_raw(buf, write, data)
+
+    def _write_raw(self, buf, write, data):
+        if write is not None and len(data) >= self.BUFFER_SIZE:
+            # dont copy large strings into the buffer
+            write(buf)
+            del buf[:]
+            write(data)
+        else:
+            buf += data
 
     @staticmethod
-    def _output_int(data):
-        yield BDecoder.INT_INDICATOR
-        yield str(data).encode("ascii")
-        yield BDecoder.END_INDICATOR
-
-    def _output_decode_hash(self, data):
+    def _decode_hash(data):
+        # hex strings to raw bytes
         if isinstance(data, str_type):
             data = [data]
         result = []
@@ -470,49 +875,7 @@ class BEncoder(object):
                     str(e),
                 )
             result.append(raw)
-        for x in self._output_string(b"".join(result)):
-            yield x
-
-    def _output_dict(self, data):
-        yield BDecoder.DICT_INDICATOR
-        for k, v in data.items():
-            if not isinstance(k, str_type) and not isinstance(k, bytes_type):
-                raise InvalidTorrentDataException(
-                    None,
-                    "Dict key must be "
-                    + str_type.__name__
-                    + " or "
-                    + bytes_type.__name__,
-                )
-            for x in self._output_element(k):
-                yield x
-            if k in self._hash_fields:
-                for x in self._output_decode_hash(v):
-                    yield x
-            else:
-                for x in self._output_element(v):
-                    yield x
-        yield BDecoder.END_INDICATOR
-
-    def _output_list(self, data):
-        yield BDecoder.LIST_INDICATOR
-        for v in data:
-            for x in self._output_element(v):
-                yield x
-        yield BDecoder.END_INDICATOR
-
-    def _type_to_func(self, t):
-        return getattr(self, "_output_" + t)
-
-    def _output_element(self, data):
-        for types, t in self.TYPES.items():
-            if isinstance(data, types):
-                # noinspection PyCallingNonCallable
-                return self._type_to_func(t)(data)
-        raise InvalidTorrentDataException(
-            None,
-            "Invalid type for torrent file: " + type(data).__name__,
-        )
+        return b"".join(result)
 
 
 class TorrentFileParser(object):
@@ -524,6 +887,12 @@ class TorrentFileParser(object):
         "pieces root": (32, False),
     }
 
+    # large hash values, not needed to list the files of a torrent
+    BULK_HASH_PATHS = [
+        ["info", "pieces"],
+        ["piece layers"],
+    ]
+
     def __init__(
         self,
         fp,
@@ -532,6 +901,9 @@ class TorrentFileParser(object):
         errors=BDecoder.ERROR_HANDLER_USEBYTES,
         hash_fields=None,
         hash_raw=False,
+        span_paths=None,
+        include_paths=None,
+        exclude_paths=None,
     ):
         """
         See :any:`BDecoder.__init__` for parameter description.
@@ -544,6 +916,10 @@ class TorrentFileParser(object):
         :param str errors:
         :param Dict[str, Tuple[int, bool]] hash_fields:
         :param bool hash_raw:
+        :param List[List[str]] span_paths:
+        :param List[List[str]] include_paths:
+        :param List[List[str]] exclude_paths: for example
+          :any:`BULK_HASH_PATHS`
         """
         torrent_hash_fields = dict(TorrentFileParser.HASH_FIELD_DEFAULT_PARAMS)
         if hash_fields is not None:
@@ -556,6 +932,9 @@ class TorrentFileParser(object):
             errors,
             torrent_hash_fields,
             hash_raw,
+            span_paths,
+            include_paths,
+            exclude_paths,
         )
 
     def hash_field(self, name, block_length=20, need_dict=False):
@@ -570,6 +949,25 @@ class TorrentFileParser(object):
         self._decoder.hash_field(name, block_length, need_dict)
         return self
 
+    def record_span(self, path):
+        """
+        See :any:`BDecoder.record_span` for parameter description
+
+        :param path:
+        :return: return self, so you can chained call
+        """
+        self._decoder.record_span(path)
+        return self
+
+    def get_span_data(self, path):
+        """
+        See :any:`BDecoder.get_span_data`
+
+        :param path:
+        :rtype: memoryview|None
+        """
+        return self._decoder.get_span_data(path)
+
     def parse(self):
         """
         Parse provided file
@@ -624,7 +1022,7 @@ class TorrentFileCreator(object):
         :return:
         """
         with open(filename, "wb") as f:
-            f.write(self._encoder.encode())
+            self._encoder.encode_to_filelike(f)
 
 
 def encode(data, encoding="utf-8", hash_fields=None):
@@ -648,6 +1046,8 @@ def decode(
     errors="strict",
     hash_fields=None,
     hash_raw=False,
+    include_paths=None,
+    exclude_paths=None,
 ):
     """
     Shortcut function for decode bytes as torrent file format(bencode) to python
@@ -661,6 +1061,8 @@ def decode(
     :param str errors:
     :param Dict[str, Tuple[int, bool]] hash_fields:
     :param bool hash_raw:
+    :param List[List[str]] include_paths:
+    :param List[List[str]] exclude_paths:
     :rtype: dict|list|int|str|bytes|bytes
     """
     return BDecoder(
@@ -670,6 +1072,8 @@ def decode(
         errors,
         hash_fields,
         hash_raw,
+        include_paths=include_paths,
+        exclude_paths=exclude_paths,
     ).decode()
 
 
@@ -680,6 +1084,8 @@ def parse_torrent_file(
     errors="usebytes",
     hash_fields=None,
     hash_raw=False,
+    include_paths=None,
+    exclude_paths=None,
 ):
     """
     Shortcut function for parse torrent object using TorrentFileParser
@@ -692,6 +1098,8 @@ def parse_torrent_file(
     :param str errors:
     :param Dict[str, Tuple[int, bool]] hash_fields:
     :param bool hash_raw:
+    :param List[List[str]] include_paths:
+    :param List[List[str]] exclude_paths:
     :rtype: dict|list|int|str|bytes
     """
     with open(filename, "rb") as f:
@@ -702,9 +1110,55 @@ def parse_torrent_file(
             errors,
             hash_fields,
             hash_raw,
+            include_paths=include_paths,
+            exclude_paths=exclude_paths,
         ).parse()
 
 
+InfoHashes = collections.namedtuple("InfoHashes", ["v1", "v2"])
+
+
+def info_hashes(filename):
+    """
+    Shortcut function for calculating the v1 (sha1) and v2 (sha256) info
+    hashes of a torrent file. The raw bytes of the info dict are hashed,
+    so the info dict is not decoded and encoded again
+
+    :param str filename: torrent filename
+    :return: hex digests. v1 is None for v2-only torrents,
+      v2 is None for v1-only torrents (BEP 52)
+    :rtype: InfoHashes
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    decoder = BDecoder(data, errors=BDecoder.ERROR_HANDLER_USEBYTES)
+    decoder._restart()
+    for key in decoder._iter_dict_keys(0):
+        if key == "info":
+            break
+    else:
+        raise InvalidTorrentDataException(0, "No info dict in torrent file")
+    # one pass over the info dict, to find its end and the version keys
+    info_start = decoder._pos
+    if data[info_start : info_start + 1] != BDecoder.DICT_INDICATOR:
+        raise InvalidTorrentDataException(info_start, "Info is not a dict")
+    has_pieces = False
+    meta_version = None
+    for key in decoder._iter_dict_keys(info_start):
+        if key == "pieces":
+            has_pieces = True
+        elif key == "meta version":
+            meta_version = decoder._next_element()
+    info_bytes = memoryview(data)[info_start : decoder._pos]
+    v1 = None
+    if has_pieces:
+        v1 = hashlib.sha1(info_bytes).hexdigest()
+    v2 = None
+    if meta_version == 2:
+        v2 = hashlib.sha256(info_bytes).hexdigest()
+    return InfoHashes(v1, v2)
+
+
 def create_torrent_file(filename, data, encoding="utf-8", hash_fields=None):
     """
     Shortcut function for create a torrent file using BEncoder
@@ -0,0 +1,105 @@
+# find complete files of v1 torrents in the sha256 store
+
+# v2 torrents have a merkle root hash per file ("pieces root"),
+# so complete files are found in the bt2r store.
+# v1 torrents have only piece hashes, and pieces can span multiple files.
+# so we find candidate files by file size (see HashIndex.get_by_size),
+# and verify the pieces that are fully inside the file.
+# files without full pieces (small files) cannot be verified.
+# cached piece hashes (see v1_pieces.py) are used when the file starts at a piece boundary
+
+import os
+import hashlib
+import collections
+
+
+piece_hash_size = 20
+
+V1File = collections.namedtuple(
+    "V1File",
+    [
+        "file_idx",
+        # path in the torrent, without the torrent name
+        # empty list for single file torrents
+        "path",
+        # offset of the file in the torrent data
+        "offset",
+        "length",
+    ],
+)
+
+
+def iter_v1_files(torrent_files):
+    """
+    yield V1File of all files of a v1 torrent
+
+    torrent_files: file_list.FileList of the torrent
+
+    padding files are skipped
+    """
+    offset = 0
+    for file_idx in range(len(torrent_files)):
+        length = torrent_files.lengths[file_idx]
+        if not torrent_files.is_pad_file(file_idx):
+            # without the torrent name
+            yield V1File(file_idx, torrent_files.get_path(file_idx)[1:], offset, length)
+        offset += length
+
+
+def get_full_pieces(v1_file, piece_length, total_size):
+    """
+    return the range of piece indices that are fully inside the file
+    """
+    first_piece = (v1_file.offset + piece_length - 1) // piece_length
+    file_end = v1_file.offset + v1_file.length
+    if file_end == total_size:
+        # the last piece can be shorter
+        end_piece = (total_size + piece_length - 1) // piece_length
+    else:
+        end_piece = file_end // piece_length
+    return range(first_piece, max(first_piece, end_piece))
+
+
+def verify_v1_pieces(v1_pieces, v1_file, pieces, piece_length, total_size):
+    """
+    verify v1_file with cached piece hashes, without reading the file
+
+    v1_pieces: v1_pieces.V1Pieces of the candidate file
+
+    return True or False, or None if the cache cannot be used
+    """
+    if v1_pieces.file_size != v1_file.length:
+        return False
+    file_pieces = v1_pieces.pieces.get(piece_length)
+    if file_pieces == None or v1_file.offset % piece_length != 0:
+        # the cached pieces are not the pieces of the torrent
+        return None
+    piece_range = get_full_pieces(v1_file, piece_length, total_size)
+    if len(piece_range) == 0:
+        return False
+    first_piece = v1_file.offset // piece_length
+    file_start = (piece_range.start - first_piece) * piece_hash_size
+    file_end = (piece_range.stop - first_piece) * piece_hash_size
+    return file_pieces[file_start:file_end] == pieces[piece_range.start * piece_hash_size:piece_range.stop * piece_hash_size]
+
+
+def verify_file(file_path, v1_file, pieces, piece_length, total_size):
+    """
+    return True if the full pieces of v1_file match the data of file_path
+
+    pieces: raw piece hashes, 20 bytes per piece
+    """
+    piece_range = get_full_pieces(v1_file, piece_length, total_size)
+    if len(piece_range) == 0:
+        return False
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size != v1_file.length:
+            return False
+        f.seek(piece_range.start * piece_length - v1_file.offset)
+        for piece_idx in piece_range:
+            piece_size = min(piece_length, total_size - piece_idx * piece_length)
+            data = f.read(piece_size)
+            piece_hash = pieces[piece_idx * piece_hash_size:(piece_idx + 1) * piece_hash_size]
+            if hashlib.sha1(data).digest() != piece_hash:
+                return False
+    return True
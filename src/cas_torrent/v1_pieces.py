@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# cache of v1 piece hashes of files in the sha256 store
+
+# v1 torrents have sha1 piece hashes, and no file hashes.
+# to find complete files of v1 torrents, we compare piece hashes (see v1_match.py).
+# reading the candidate files is slow for large files,
+# so the piece hashes can be computed on ingest, and stored next to the file:
+
+# cas/v1p/12/34/567890123456789012345678901234567890123456789012345678901234
+
+# with the same name as the file in the sha256 store, on the same volume.
+# pieces start at offset 0 of the file,
+# so the cache works for files that start at a piece boundary in the torrent:
+# single file torrents, the first file, and torrents with padding files (BEP 47).
+# other files are verified by reading the file
+
+# piece lengths are powers of two. default: 256 KiB to 16 MiB.
+# the cache is about 0.015% of the file size.
+# the piece lengths are stored in cas/store.json as "v1_piece_lengths".
+# by default, the cache is disabled
+
+# hashes for old files in the sha256 store can be computed with
+# python3 -m cas_torrent.v1_pieces cas/
+# this uses the piece lengths from cas/store.json, or the default piece lengths
+
+# file format, little endian:
+# header: magic "CASV1P01", u64 file size, u32 number of piece lengths
+# per piece length: u32 piece length, u32 number of pieces
+# then the sha1 digests of all piece lengths, in the same order
+
+import os
+import sys
+import struct
+import argparse
+import collections
+
+from . import hashing
+from . import hash_pool
+from . import hash_index
+from . import store_config
+
+
+v1_pieces_store_dir = "v1p"
+
+default_v1_piece_lengths = [2**exponent for exponent in range(18, 25)]
+
+magic = b"CASV1P01"
+
+header_struct = struct.Struct("<8sQI")
+
+length_struct = struct.Struct("<II")
+
+piece_hash_size = 20
+
+V1Pieces = collections.namedtuple(
+    "V1Pieces",
+    [
+        "file_size",
+        # {piece_length: concatenated sha1 digests}
+        "pieces",
+    ],
+)
+
+
+def write_v1_pieces(path, file_size, v1_pieces):
+    """
+    write the v1 piece hashes of a file
+
+    v1_pieces: {piece_length: concatenated sha1 digests}
+    """
+    piece_lengths = sorted(v1_pieces)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # atomic write
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header_struct.pack(magic, file_size, len(piece_lengths)))
+        for piece_length in piece_lengths:
+            f.write(length_struct.pack(piece_length, len(v1_pieces[piece_length]) // piece_hash_size))
+        for piece_length in piece_lengths:
+            f.write(v1_pieces[piece_length])
+    os.chmod(tmp_path, 0o444)
+    os.rename(tmp_path, path)
+
+
+def read_v1_pieces(path):
+    """
+    return V1Pieces, or None if the file does not exist
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < header_struct.size:
+        return None
+    file_magic, file_size, num_lengths = header_struct.unpack_from(data, 0)
+    if file_magic != magic:
+        print(f"read_v1_pieces: ignoring bad file: {repr(path)}")
+        return None
+    offset = header_struct.size
+    lengths = []
+    for _ in range(num_lengths):
+        lengths.append(length_struct.unpack_from(data, offset))
+        offset += length_struct.size
+    pieces = {}
+    for piece_length, num_pieces in lengths:
+        size = num_pieces * piece_hash_size
+        pieces[piece_length] = data[offset:offset + size]
+        offset += size
+    return V1Pieces(file_size, pieces)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="compute missing v1 piece hashes of files in the sha256 store",
+    )
+    parser.add_argument("store_prefix", nargs="+", help="path to the cas stores, for example cas/. the first store is the primary store")
+    parser.add_argument("--threads-per-device", type=int, default=2, help="number of hashing threads per device")
+    options = parser.parse_args()
+
+    store_prefix_list = [os.path.abspath(store_prefix) for store_prefix in options.store_prefix]
+    config = store_config.read_store_config(store_prefix_list[0])
+    piece_lengths = config["v1_piece_lengths"] or default_v1_piece_lengths
+    index_path = os.path.join(store_prefix_list[0], "index.sqlite")
+    if not os.path.exists(index_path):
+        print(f"v1_pieces: hash index not found: {index_path}. run cas_torrent first")
+        sys.exit(1)
+    index = hash_index.HashIndex(index_path)
+    pool = hash_pool.HashPool(None, options.threads_per_device)
+
+    # hashing jobs, in order
+    pending = collections.deque()
+    max_pending_files = 100
+    num_hashed = 0
+
+    def handle_pending():
+        nonlocal num_hashed
+        sha256, file_path, v1_pieces_path, future = pending.popleft()
+        ingest_result = future.result()
+        if ingest_result.sha256 != sha256:
+            # corrupted file, see scrub.py
+            print(f"v1_pieces: sha256 mismatch: {repr(file_path)}")
+            return
+        write_v1_pieces(v1_pieces_path, ingest_result.size, ingest_result.v1_pieces)
+        num_hashed += 1
+
+    for sha256, size, bt2_root, dev in index.iter_objects():
+        if size == 0:
+            continue
+        shard = store_config.get_shard(sha256.hex(), config)
+        for store_prefix in store_prefix_list:
+            file_path = os.path.join(store_prefix, "sha256", *shard)
+            if not os.path.exists(file_path):
+                continue
+            v1_pieces_path = os.path.join(store_prefix, v1_pieces_store_dir, *shard)
+            if not os.path.exists(v1_pieces_path):
+                future = pool.submit(hashing.hash_file, file_path, drop_cache=True, v1_piece_lengths=piece_lengths)
+                pending.append((sha256, file_path, v1_pieces_path, future))
+                while len(pending) > max_pending_files:
+                    handle_pending()
+            break
+    while pending:
+        handle_pending()
+    print(f"v1_pieces: hashed {num_hashed} files")
+    pool.shutdown()
+    index.close()
+    print("v1_pieces:", pool.format_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# multiple cas stores on multiple filesystems, aka "soft raid"
+
+# the cas stores are configured in ~/.config/cas.json
+# this config is shared with scripts/qbittorrent-move-to-cas.py
+"""
+{
+  "dirs": [
+    "/run/media/user/disk1/cas",
+    "/run/media/user/disk2/cas"
+  ]
+}
+"""
+
+# every volume has the same layout: cas/sha256/ cas/bt2/ cas/bt2r/ ...
+# the first volume is the primary volume.
+# it holds the hash index and the bt2r table for all volumes.
+# the hash index stores the st_dev of every file,
+# so we know the volume of every file in the sha256 store
+
+# placement of new torrents and files:
+# prefer the volume where the file already is, so we can move the file with os.rename.
+# otherwise use the volume with the least pending io, and the most free space.
+# torrents are downloaded to sparse files,
+# so we reserve the torrent size until the torrent is finished
+
+import os
+import json
+import errno
+import shutil
+import threading
+import contextlib
+
+
+cas_config_path = os.path.expanduser("~/.config/cas.json")
+
+# dont fill volumes completely
+default_min_free_bytes = 1024 * 1024 * 1024
+
+
+def read_cas_config_dirs(config_path=cas_config_path):
+    """
+    get the list of cas stores from ~/.config/cas.json, or None
+    """
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return None
+    dirs = config.get("dirs")
+    if not dirs:
+        return None
+    return [os.path.abspath(os.path.expanduser(d)) for d in dirs]
+
+
+class Volume(object):
+    """
+    one cas store on one filesystem
+    """
+
+    def __init__(self, store_prefix):
+        self.store_prefix = os.path.abspath(store_prefix)
+        os.makedirs(self.store_prefix, exist_ok=True)
+        self.dev = os.stat(self.store_prefix).st_dev
+        # bytes of running copies and downloads
+        self.pending_bytes = 0
+        # bytes of unfinished torrents, sparse files are not yet allocated
+        self.reserved_bytes = 0
+
+    def __repr__(self):
+        return f"Volume({repr(self.store_prefix)})"
+
+    def get_free_bytes(self):
+        stat_result = os.statvfs(self.store_prefix)
+        return stat_result.f_bavail * stat_result.f_frsize
+
+    def get_available_bytes(self):
+        return self.get_free_bytes() - self.reserved_bytes
+
+
+class VolumeManager(object):
+    """
+    place and find files on multiple cas stores
+    """
+
+    def __init__(self, store_prefix_list, min_free_bytes=default_min_free_bytes):
+        assert len(store_prefix_list) > 0
+        self.volumes = [Volume(store_prefix) for store_prefix in store_prefix_list]
+        self._min_free_bytes = min_free_bytes
+        # map reservation key to (volume, num_bytes)
+        self._reservations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self):
+        return self.volumes[0]
+
+    def __len__(self):
+        return len(self.volumes)
+
+    def __iter__(self):
+        return iter(self.volumes)
+
+    def get_volume_by_dev(self, dev):
+        for volume in self.volumes:
+            if volume.dev == dev:
+                return volume
+        return None
+
+    def get_volume_of_path(self, path):
+        """
+        get the volume that contains path, or None
+        """
+        path = os.path.abspath(path)
+        for volume in self.volumes:
+            if path == volume.store_prefix or path.startswith(volume.store_prefix + os.sep):
+                return volume
+        # path is outside of the cas stores
+        # find the volume on the same filesystem
+        while True:
+            try:
+                return self.get_volume_by_dev(os.stat(path).st_dev)
+            except FileNotFoundError:
+                parent_path = os.path.dirname(path)
+                if parent_path == path:
+                    return None
+                path = parent_path
+
+    def choose_volume(self, num_bytes=0, near_path=None):
+        """
+        choose a volume for new data
+
+        near_path: prefer the volume of this path, if it has enough space
+        """
+        with self._lock:
+            if near_path != None:
+                volume = self.get_volume_of_path(near_path)
+                if volume != None:
+                    if os.path.exists(near_path) and os.stat(near_path).st_dev == volume.dev:
+                        # moving does not need space
+                        return volume
+                    if volume.get_available_bytes() - num_bytes >= self._min_free_bytes:
+                        return volume
+            candidates = []
+            for volume in self.volumes:
+                available_bytes = volume.get_available_bytes()
+                if available_bytes - num_bytes < self._min_free_bytes:
+                    continue
+                candidates.append((volume.pending_bytes, -available_bytes, volume))
+            if not candidates:
+                # all volumes are full. use the volume with the most space
+                return max(self.volumes, key=lambda volume: volume.get_available_bytes())
+            candidates.sort(key=lambda c: c[:2])
+            return candidates[0][2]
+
+    def reserve(self, key, volume, num_bytes):
+        """
+        reserve space for an unfinished torrent
+        """
+        with self._lock:
+            if key in self._reservations:
+                return
+            self._reservations[key] = (volume, num_bytes)
+            volume.reserved_bytes += num_bytes
+            volume.pending_bytes += num_bytes
+
+    def release(self, key):
+        with self._lock:
+            reservation = self._reservations.pop(key, None)
+            if reservation == None:
+                return
+            volume, num_bytes = reservation
+            volume.reserved_bytes -= num_bytes
+            volume.pending_bytes -= num_bytes
+
+    @contextlib.contextmanager
+    def pending_io(self, volume, num_bytes):
+        """
+        count the bytes of a running copy as io load of the volume
+        """
+        with self._lock:
+            volume.pending_bytes += num_bytes
+        try:
+            yield
+        finally:
+            with self._lock:
+                volume.pending_bytes -= num_bytes
+
+    def find_path(self, relative_path):
+        """
+        get the first existing path in all volumes, or None
+
+        relative_path: path in the cas store, like sha256/12/34/5678...
+        """
+        for volume in self.volumes:
+            path = os.path.join(volume.store_prefix, relative_path)
+            if os.path.lexists(path):
+                return path
+        return None
+
+    def move_file(self, src_path, dst_path):
+        """
+        move a file to a volume. copy between filesystems
+        """
+        try:
+            os.rename(src_path, dst_path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV: # cross-device link
+                raise
+        volume = self.get_volume_of_path(dst_path)
+        num_bytes = os.path.getsize(src_path)
+        if volume == None:
+            shutil.move(src_path, dst_path)
+            return
+        with self.pending_io(volume, num_bytes):
+            # copy to a temporary file, so we never have partial files in the store
+            tmp_path = dst_path + ".tmp"
+            shutil.copy2(src_path, tmp_path)
+            os.rename(tmp_path, dst_path)
+        os.unlink(src_path)
+
+    def format_stats(self):
+        out = "volumes:"
+        for volume in self.volumes:
+            out += (
+                f"\n  {volume.store_prefix}: free {volume.get_free_bytes() / 1e9:.1f} GB "
+                f"reserved {volume.reserved_bytes / 1e9:.1f} GB "
+                f"pending {volume.pending_bytes / 1e6:.1f} MB"
+            )
+        return out